@@ -0,0 +1,292 @@
+"""
+activation - Event driven tracking of a NetworkManager connection activation
+"""
+
+import time
+from syslog import syslog
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_DEVICE_IFACE = "org.freedesktop.NetworkManager.Device"
+NM_CONNECTION_ACTIVE_IFACE = "org.freedesktop.NetworkManager.Connection.Active"
+
+# Network Manager Device Connection States
+NM_DEVICE_STATE_PREPARE = 40
+NM_DEVICE_STATE_CONFIG = 50
+NM_DEVICE_STATE_NEED_AUTH = 60
+NM_DEVICE_STATE_IP_CONFIG = 70
+NM_DEVICE_STATE_IP_CHECK = 80
+NM_DEVICE_STATE_SECONDARIES = 90
+NM_DEVICE_STATE_ACTIVATED = 100
+NM_DEVICE_STATE_FAILED = 120
+
+NM_DEVICE_STATE_REASON_NONE = 1
+
+# Network Manager Device State Reasons that end an activation even before
+# the device fails, as NetworkManager would otherwise keep retrying (e.g.
+# by asking secret agents for new secrets, which we don't have)
+NM_DEVICE_STATE_REASON_NO_SECRETS = 7
+NM_DEVICE_STATE_REASON_SUPPLICANT_DISCONNECT = 8
+NM_DEVICE_STATE_REASON_SSID_NOT_FOUND = 53
+ACT_FAIL_FAST_REASONS = (
+    NM_DEVICE_STATE_REASON_NO_SECRETS,
+    NM_DEVICE_STATE_REASON_SUPPLICANT_DISCONNECT,
+    NM_DEVICE_STATE_REASON_SSID_NOT_FOUND,
+)
+
+# Network Manager Active Connection States
+NM_ACTIVE_CONNECTION_STATE_ACTIVATED = 2
+NM_ACTIVE_CONNECTION_STATE_DEACTIVATED = 4
+
+# Network Manager Connectivity States
+NM_CONNECTIVITY_NONE = 1
+NM_CONNECTIVITY_PORTAL = 2
+NM_CONNECTIVITY_LIMITED = 3
+NM_CONNECTIVITY_FULL = 4
+
+CONNECTIVITY_NAMES = {
+    NM_CONNECTIVITY_NONE: "none",
+    NM_CONNECTIVITY_PORTAL: "portal",
+    NM_CONNECTIVITY_LIMITED: "limited",
+    NM_CONNECTIVITY_FULL: "full",
+}
+
+# Activation states
+ACT_STATE_STARTING = "starting"
+ACT_STATE_ACTIVATED = "activated"
+ACT_STATE_DONE = "done"
+
+DEVICE_STATE_NAMES = {
+    NM_DEVICE_STATE_PREPARE: "prepare",
+    NM_DEVICE_STATE_CONFIG: "config",
+    NM_DEVICE_STATE_NEED_AUTH: "need-auth",
+    NM_DEVICE_STATE_IP_CONFIG: "ip-config",
+    NM_DEVICE_STATE_IP_CHECK: "ip-check",
+    NM_DEVICE_STATE_SECONDARIES: "secondaries",
+    NM_DEVICE_STATE_ACTIVATED: "activated",
+    NM_DEVICE_STATE_FAILED: "failed",
+}
+
+# Activation results
+ACT_RESULT_SUCCESS = "success"
+ACT_RESULT_FAILED = "failed"
+ACT_RESULT_TIMEOUT = "timeout"
+
+ACTIVATION_TIMEOUT_MS = 120000
+ACTIVATION_HEARTBEAT_MS = 5000
+
+
+class Activation:
+    """
+    State machine for one connection activation.  Progress is driven by the
+    device and active connection StateChanged signals and the NetworkManager
+    Connectivity, which the owner passes to connectivity_changed().  A
+    failure is reported with the last device state reason.  The progress
+    callback is only called on device state transitions, and on the
+    heartbeat (if any) when there was no transition for that long.
+    The only timers are the overall timeout and the heartbeat, both owned
+    by the request token; nothing remains once the activation is done.
+    Device state transitions and connectivity changes are timestamped, for
+    the timeline of where the activation time went.
+    """
+
+    def __init__(
+        self,
+        bus,
+        name,
+        token,
+        connectivity,
+        progress_cb,
+        done_cb,
+        heartbeat_ms=ACTIVATION_HEARTBEAT_MS,
+        timeout_ms=ACTIVATION_TIMEOUT_MS,
+    ):
+        self.name = name
+        self.token = token
+        self.connectivity = connectivity
+        self.progress_cb = progress_cb
+        self.done_cb = done_cb
+        self.heartbeat_ms = heartbeat_ms
+        self.state = ACT_STATE_STARTING
+        self.dev_state = None
+        self.reason = None
+        self.dev_path = None
+        self.active_path = None
+        self.heartbeat_id = None
+        self.started = time.monotonic()
+        self.events = []  # timeline, as (event, ms since start)
+        self.phases = []  # device states, as (state name, ms since start)
+        self.result = None
+        self.total_ms = None
+        self.matches = [
+            bus.add_signal_receiver(
+                self.device_state_changed,
+                signal_name="StateChanged",
+                dbus_interface=NM_DEVICE_IFACE,
+                bus_name=NM_IFACE,
+                path_keyword="path",
+            ),
+            bus.add_signal_receiver(
+                self.active_state_changed,
+                signal_name="StateChanged",
+                dbus_interface=NM_CONNECTION_ACTIVE_IFACE,
+                bus_name=NM_IFACE,
+                path_keyword="path",
+            ),
+        ]
+        self.timeout_id = self.token.timeout_add(timeout_ms, self.timed_out)
+        self.start_heartbeat()
+
+    def watch_device(self, dev_path):
+        """Follow the state of the device the connection activates on"""
+        self.dev_path = str(dev_path)
+
+    def watch_active(self, active_path):
+        """Follow the state of the active connection"""
+        self.active_path = str(active_path)
+
+    def is_done(self):
+        return self.state == ACT_STATE_DONE
+
+    def elapsed_ms(self):
+        return int((time.monotonic() - self.started) * 1000)
+
+    def record(self, event):
+        self.events.append((event, self.elapsed_ms()))
+
+    def phase_durations(self):
+        """Time spent in each device state, in ms"""
+        durations = {}
+        end_ms = self.total_ms if self.total_ms is not None else self.elapsed_ms()
+        for i, (state, start_ms) in enumerate(self.phases):
+            if i + 1 < len(self.phases):
+                next_ms = self.phases[i + 1][1]
+            else:
+                next_ms = end_ms
+            durations[state] = durations.get(state, 0) + next_ms - start_ms
+        return durations
+
+    def summary(self):
+        """Compact timeline for the final response"""
+        return {"totalMs": self.total_ms, "phases": self.phase_durations()}
+
+    def timeline(self):
+        """Full timeline for the activation history"""
+        return {
+            "type": self.name,
+            "result": self.result,
+            "reason": self.reason,
+            "totalMs": self.total_ms,
+            "phases": self.phase_durations(),
+            "events": [[event, ms] for event, ms in self.events],
+        }
+
+    #
+    # Events
+    #
+    def device_state_changed(self, new_state, old_state, reason, path=None):
+        if self.is_done() or str(path) != self.dev_path:
+            return
+        if new_state == self.dev_state:
+            return
+        self.dev_state = new_state
+        state_name = DEVICE_STATE_NAMES.get(new_state, str(new_state))
+        self.record(state_name)
+        self.phases.append(self.events[-1])
+        reason = int(reason)
+        syslog(
+            "{} device state: {} (reason {})".format(self.name, new_state, reason)
+        )
+        if reason > NM_DEVICE_STATE_REASON_NONE:
+            self.reason = reason
+        if new_state == NM_DEVICE_STATE_FAILED or reason in ACT_FAIL_FAST_REASONS:
+            # Fail on the first terminal reason, rather than waiting for
+            # NetworkManager's retries to run out
+            self.finish(ACT_RESULT_FAILED)
+        elif new_state == NM_DEVICE_STATE_ACTIVATED and self.active_path is None:
+            # Without an active connection, the device state is authoritative
+            self.activated()
+        elif new_state in DEVICE_STATE_NAMES:
+            self.progress()
+
+    def active_state_changed(self, state, reason, path=None):
+        # NetworkManager retries create a new active connection, so only the
+        # first one (returned by ActivateConnection) can succeed
+        if self.is_done() or str(path) != self.active_path:
+            return
+        if state == NM_ACTIVE_CONNECTION_STATE_ACTIVATED:
+            self.activated()
+        elif state == NM_ACTIVE_CONNECTION_STATE_DEACTIVATED:
+            syslog("{} connection deactivated (reason {})".format(self.name, reason))
+            self.finish(ACT_RESULT_FAILED)
+
+    def connectivity_changed(self, connectivity):
+        self.connectivity = connectivity
+        self.record(
+            "connectivity-" + CONNECTIVITY_NAMES.get(connectivity, str(connectivity))
+        )
+        if self.state == ACT_STATE_ACTIVATED:
+            self.finish(ACT_RESULT_SUCCESS)
+
+    def activated(self):
+        if self.state == ACT_STATE_ACTIVATED:
+            return
+        syslog("{} connection was activated!".format(self.name))
+        self.state = ACT_STATE_ACTIVATED
+        if self.connectivity == NM_CONNECTIVITY_FULL:
+            self.finish(ACT_RESULT_SUCCESS)
+        else:
+            # Wait for the connectivity check
+            self.progress()
+
+    def timed_out(self):
+        self.timeout_id = None
+        syslog("{} activation timed out.".format(self.name))
+        self.finish(ACT_RESULT_TIMEOUT)
+        return False
+
+    #
+    # Progress reporting
+    #
+    def progress(self):
+        self.start_heartbeat()
+        self.progress_cb()
+
+    def start_heartbeat(self):
+        self.stop_heartbeat()
+        if self.heartbeat_ms:
+            self.heartbeat_id = self.token.timeout_add(
+                self.heartbeat_ms, self.heartbeat
+            )
+
+    def stop_heartbeat(self):
+        if self.heartbeat_id is not None:
+            self.token.source_remove(self.heartbeat_id)
+            self.heartbeat_id = None
+
+    def heartbeat(self):
+        # Still waiting for activation, report progress
+        self.progress_cb()
+        return True
+
+    #
+    # Completion
+    #
+    def cancel(self):
+        """Stop following the activation, without a result"""
+        if self.is_done():
+            return
+        self.state = ACT_STATE_DONE
+        self.stop_heartbeat()
+        if self.timeout_id is not None:
+            self.token.source_remove(self.timeout_id)
+            self.timeout_id = None
+        for match in self.matches:
+            match.remove()
+        self.matches = []
+
+    def finish(self, result):
+        self.cancel()
+        self.result = result
+        self.record(result)
+        self.total_ms = self.events[-1][1]
+        self.done_cb(result, self.reason)
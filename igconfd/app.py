@@ -9,7 +9,11 @@ import subprocess
 from syslog import syslog
 
 from . import leadvert
+from . import request
+from . import schema
 from . import vspsvc
+from .statsdoc import StatsDocument
+from .worksched import scheduler
 
 from gi.repository import GObject as gobject
 
@@ -30,6 +34,9 @@ LE_SUPERVISION_TIMEOUT = 500  # 5000 ms
 LE_ADV_MIN_INTERVAL = 200  # 125 ms
 LE_ADV_MAX_INTERVAL = 800  # 500 ms
 
+# Time to wait for the remainder of a partially received request
+RX_TIMEOUT_MS = 2000
+
 IGCONFD_SVC = "com.lairdtech.security.ConfigService"
 IGCONFD_OBJ = "/com/lairdtech/security/ConfigService"
 
@@ -53,6 +60,8 @@ class Application(dbus.service.Object):
         # Start the VSP service
         self.vsp_svc = vspsvc.VirtualSerialPortService(bus, 0, self.rx_cb, self.disc_cb)
         self.add_service(self.vsp_svc)
+        # Background work yields to the indications of the VSP service
+        scheduler.set_tx_pending(self.vsp_svc.tx_pending)
 
         # Get the various Bluez Interfaces
         self.adapter = self.find_obj_by_iface(GATT_MANAGER_IFACE)
@@ -68,6 +77,7 @@ class Application(dbus.service.Object):
 
         self.rx_timeout_id = None
         self.rx_message = None
+        self.stats_doc = StatsDocument()
 
     def get_path(self):
         return dbus.ObjectPath(self.path)
@@ -88,6 +98,38 @@ class Application(dbus.service.Object):
         syslog("configsvc: connection stats changed")
         return connection_stats
 
+    @dbus.service.signal("com.lairdtech.security.ConfigInterface", signature="sts")
+    def ConnectionStatsPatch(self, epoch, version, patch):
+        """
+        Provides the changes of the connection stats document as an RFC 6902
+        JSON Patch, taking it from version - 1 to version.  A patch of
+        another epoch than the consumer's document doesn't apply to it.
+        """
+        return patch
+
+    @dbus.service.method(
+        "com.lairdtech.security.ConfigInterface", in_signature="st", out_signature="s"
+    )
+    def GetConnectionStats(self, epoch, since_version):
+        """
+        Get the connection stats document as the patch from since_version of
+        epoch to the current version, or in full if that version is unknown
+        (pass an empty epoch to get the full document)
+        """
+        return json.dumps(self.stats_doc.get_since(str(epoch), int(since_version)))
+
+    def publish_connection_stats(self, source, connection_stats):
+        """
+        Report the stats of one reporter, in full on ConnectionStatsChanged
+        and as a patch of the whole document on ConnectionStatsPatch
+        """
+        self.ConnectionStatsChanged(connection_stats)
+        patch = self.stats_doc.update(source, json.loads(connection_stats))
+        if patch is not None:
+            self.ConnectionStatsPatch(
+                self.stats_doc.epoch, self.stats_doc.version, json.dumps(patch)
+            )
+
     @dbus.service.method(
         "com.lairdtech.security.ConfigInterface", in_signature="s", out_signature="i"
     )
@@ -97,8 +139,14 @@ class Application(dbus.service.Object):
         except Exception as e:
             syslog("Configuration failed, exception = %s" % str(e))
             return -1
+        field = schema.validate_data(schema.MSG_ID_CONNECT_LTE, lte_config)
+        if field is not None:
+            syslog("Configuration failed, invalid field: {}".format(field))
+            return -1
 
-        self.msg_manager.net_manager.req_connect_lte(lte_config, self.LTEStatusChanged)
+        self.msg_manager.net_manager.req_connect_lte(
+            lte_config, lambda status, data=None: self.LTEStatusChanged(status)
+        )
         return 0
 
     @dbus.service.method(
@@ -110,6 +158,10 @@ class Application(dbus.service.Object):
         except Exception as e:
             syslog("Configuration failed, exception = %s" % str(e))
             return -1
+        field = schema.validate_data(schema.MSG_ID_UPDATE_APS, wifi_configs)
+        if field is not None:
+            syslog("Configuration failed, invalid field: {}".format(field))
+            return -1
 
         self.msg_manager.net_manager.req_update_aps(wifi_configs)
         return 0
@@ -141,12 +193,21 @@ class Application(dbus.service.Object):
             self.rx_timeout_id = None
         try:
             req_obj = json.loads(self.rx_message)
-            self.vsp_svc.flush_tx()
-            self.msg_manager.add_request(req_obj)
-            self.rx_message = None
         except ValueError:
             # Couldn't parse JSON, set timeout for additional data
-            self.rx_timeout_id = gobject.timeout_add(2000, self.rx_timeout)
+            self.rx_timeout_id = gobject.timeout_add(RX_TIMEOUT_MS, self.rx_timeout)
+            return
+        self.vsp_svc.flush_tx()
+        self.rx_message = None
+        # Decode the request once, here; handlers use the payload as-is
+        try:
+            req = request.decode_request(req_obj)
+        except request.RequestError as e:
+            syslog("Invalid request message: {}".format(e))
+            if e.request is not None:
+                self.msg_manager.reject_request(e.request, e.field)
+            return
+        self.msg_manager.add_request(req)
 
     def disc_cb(self):
         syslog("Client disconnected.")
@@ -0,0 +1,362 @@
+"""
+aptable - Live table of the access points seen by the Wi-Fi device
+"""
+
+import dbus, dbus.exceptions
+import heapq
+import json
+from collections import deque
+from syslog import syslog
+
+from .asynccall import call_async
+from .nmsnapshot import take_snapshot
+from .proxypool import pool, get_interface
+from .worksched import scheduler
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_AP_IFACE = "org.freedesktop.NetworkManager.AccessPoint"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+
+# Useful Network Manager AP Flags
+NM_802_11_AP_FLAGS_PRIVACY = 0x00000001
+
+# Useful Network Manager AP Security Flags
+NM_802_11_AP_SEC_NONE = 0x00000000
+NM_802_11_AP_SEC_KEY_MGMT_PSK = 0x00000100
+NM_802_11_AP_SEC_KEY_MGMT_802_1X = 0x00000200
+
+AP_GETALL_TIMEOUT = 5.0
+
+# AP list request options
+AP_OPT_MIN_STRENGTH = "minStrength"
+AP_OPT_SECURITY = "security"
+AP_OPT_LIMIT = "limit"
+AP_OPT_SORT = "sort"
+
+AP_SECURITY_OPEN = "open"
+AP_SECURITY_TYPES = (AP_SECURITY_OPEN, "wep", "psk", "eap")
+AP_SORT_STRENGTH = "strength"
+AP_SORT_SSID = "ssid"
+# Options that change the content of the AP list
+AP_LIST_OPTIONS = (AP_OPT_MIN_STRENGTH, AP_OPT_SECURITY, AP_OPT_LIMIT, AP_OPT_SORT)
+
+# AP list generations kept for delta updates, and the strength bucket size
+# (strength changes within a bucket aren't reported as changes)
+AP_HISTORY_LEN = 8
+AP_STRENGTH_BUCKET = 20
+
+# Frequency bands, as (name, lowest MHz, highest MHz)
+WIFI_BANDS = (("2.4GHz", 2400, 2500), ("5GHz", 4900, 5900), ("6GHz", 5925, 7125))
+
+# AccessPoint properties kept in the table, and their table names
+AP_PROPERTY_MAP = {
+    "Ssid": "ssid",
+    "Strength": "strength",
+    "Flags": "flags",
+    "WpaFlags": "wpa-flags",
+    "RsnFlags": "rsn-flags",
+    "Frequency": "frequency",
+    "HwAddress": "bssid",
+}
+
+
+def convert_ap_property(name, value):
+    if name == "ssid":
+        # Properly decode UTF-8 bytes into a string (Unicode)
+        return bytearray(value).decode("utf-8", "replace")
+    if name == "bssid":
+        return str(value)
+    return int(value)
+
+
+def ap_security(ap):
+    """Get the wep/psk/eap capabilities of an AP table entry"""
+    flags = ap.get("flags", 0)
+    wpa_flags = ap.get("wpa-flags", 0)
+    rsn_flags = ap.get("rsn-flags", 0)
+    return {
+        "wep": (
+            (flags & NM_802_11_AP_FLAGS_PRIVACY > 0)
+            and (wpa_flags == NM_802_11_AP_SEC_NONE)
+            and (rsn_flags == NM_802_11_AP_SEC_NONE)
+        ),
+        "psk": (wpa_flags & NM_802_11_AP_SEC_KEY_MGMT_PSK > 0)
+        or (rsn_flags & NM_802_11_AP_SEC_KEY_MGMT_PSK > 0),
+        "eap": (wpa_flags & NM_802_11_AP_SEC_KEY_MGMT_802_1X > 0)
+        or (rsn_flags & NM_802_11_AP_SEC_KEY_MGMT_802_1X > 0),
+    }
+
+
+def config_security(config):
+    """The security type requested by a client Wi-Fi configuration"""
+    if "psk" in config:
+        return "psk"
+    elif "wep-key" in config:
+        return "wep"
+    elif "eap" in config:
+        return "eap"
+    return AP_SECURITY_OPEN
+
+
+def frequency_band(frequency):
+    for name, lo, hi in WIFI_BANDS:
+        if lo <= frequency <= hi:
+            return name
+    return None
+
+
+def strength_key(entry):
+    return entry["strength"]
+
+
+def ap_signature(entry):
+    """The parts of an AP list entry that make up a change"""
+    return (
+        entry["strength"] // AP_STRENGTH_BUCKET,
+        entry["wep"],
+        entry["psk"],
+        entry["eap"],
+    )
+
+
+def options_key(options):
+    options = options or {}
+    return json.dumps(
+        {k: options[k] for k in AP_LIST_OPTIONS if k in options}, sort_keys=True
+    )
+
+
+class AccessPointTable:
+    """
+    Local copy of the access point properties of the Wi-Fi device.  Each AP
+    is read once with a single GetAll, then kept current from the device's
+    AccessPointAdded/AccessPointRemoved signals and the APs'
+    PropertiesChanged signals, so the AP list can be served from memory.
+    """
+
+    def __init__(self, bus, wifi_dev, ap_added_cb=None):
+        self.bus = bus
+        self.ap_added_cb = ap_added_cb
+        self.aps = {}  # path -> AP properties
+        self.changes = 0  # count of APs added or removed
+        self.generation = 0  # AP list generation, for delta updates
+        self.history = deque(maxlen=AP_HISTORY_LEN)  # (generation, options, list)
+
+        wifi_dev.connect_to_signal("AccessPointAdded", self.ap_added)
+        wifi_dev.connect_to_signal("AccessPointRemoved", self.ap_removed)
+        # One receiver for the property changes of every AP object
+        self.bus.add_signal_receiver(
+            self.ap_props_changed,
+            signal_name="PropertiesChanged",
+            dbus_interface=DBUS_PROP_IFACE,
+            bus_name=NM_IFACE,
+            arg0=NM_AP_IFACE,
+            path_keyword="path",
+        )
+        scheduler.add("AP load", self.load(wifi_dev.GetAllAccessPoints()))
+
+    def ap_props(self, path):
+        return get_interface(NM_IFACE, path, DBUS_PROP_IFACE)
+
+    def load(self, paths):
+        """
+        Read the initial APs, from a snapshot of the NetworkManager objects
+        when available, else one per step of a background task
+        """
+        snapshot = take_snapshot()
+        for path in paths:
+            if str(path) in self.aps:
+                # Already loaded from AccessPointAdded
+                continue
+            props = snapshot.get(path, NM_AP_IFACE) if snapshot else None
+            if props is not None:
+                self.store(path, props)
+                continue
+            try:
+                self.store(path, self.ap_props(path).GetAll(NM_AP_IFACE))
+            except dbus.exceptions.DBusException:
+                # Can occur as APs are removed, just move on to the next AP
+                pass
+            yield
+
+    def store(self, path, props):
+        ap = {}
+        for prop, name in AP_PROPERTY_MAP.items():
+            if prop in props:
+                ap[name] = convert_ap_property(name, props[prop])
+        self.aps[str(path)] = ap
+
+    def ap_added(self, path):
+        self.changes += 1
+        try:
+            call_async(
+                self.ap_props(path).GetAll,
+                NM_AP_IFACE,
+                timeout=AP_GETALL_TIMEOUT,
+                reply_cb=lambda props: self.ap_loaded(path, props),
+            )
+        except dbus.exceptions.DBusException as e:
+            syslog("Failed to read AP {}: {}".format(path, e))
+
+    def ap_loaded(self, path, props):
+        self.store(path, props)
+        ssid = self.aps[str(path)].get("ssid")
+        if self.ap_added_cb is not None and ssid is not None:
+            self.ap_added_cb(ssid)
+
+    def ap_removed(self, path):
+        self.changes += 1
+        self.aps.pop(str(path), None)
+        pool.evict(NM_IFACE, path)
+
+    def ap_props_changed(self, iface, props_changed, props_invalidated, path=None):
+        ap = self.aps.get(str(path))
+        if ap is None:
+            return
+        for prop, value in props_changed.items():
+            name = AP_PROPERTY_MAP.get(prop)
+            if name is not None:
+                ap[name] = convert_ap_property(name, value)
+
+    def select_ap(self, ssid, security):
+        """
+        Pick the AP to connect to for an SSID and security type.  Returns
+        (broadcast, path): broadcast is False if no AP broadcasts the SSID,
+        and path is the strongest AP supporting the security type, or None
+        if none does.
+        """
+        broadcast = False
+        best_path = None
+        best_strength = -1
+        for path, ap in self.aps.items():
+            if ap.get("ssid") != ssid:
+                continue
+            broadcast = True
+            ap_sec = ap_security(ap)
+            if security == AP_SECURITY_OPEN:
+                supported = not any(ap_sec.values())
+            else:
+                supported = ap_sec[security]
+            if supported and ap.get("strength", 0) > best_strength:
+                best_path = path
+                best_strength = ap.get("strength", 0)
+        return broadcast, best_path
+
+    def find_bssid(self, ssid, bssid):
+        """Get the path of the AP with a BSSID for an SSID, or None"""
+        for path, ap in self.aps.items():
+            if ap.get("ssid") == ssid and ap.get("bssid") == bssid:
+                return path
+        return None
+
+    def aggregate(self):
+        """
+        Combine the BSSs of each SSID into one entry with the best and worst
+        strength, BSS count, bands, frequencies and the union of security
+        capabilities.
+        """
+        ssids = {}
+        for ap in self.aps.values():
+            if "ssid" not in ap:
+                continue
+            strength = ap.get("strength", 0)
+            security = ap_security(ap)
+            entry = ssids.get(ap["ssid"])
+            if entry is None:
+                entry = {
+                    "ssid": ap["ssid"],
+                    "strength": strength,
+                    "worstStrength": strength,
+                    "count": 0,
+                    "bands": [],
+                    "frequencies": [],
+                    "wep": False,
+                    "psk": False,
+                    "eap": False,
+                    AP_SECURITY_OPEN: False,
+                }
+                ssids[ap["ssid"]] = entry
+            entry["strength"] = max(entry["strength"], strength)
+            entry["worstStrength"] = min(entry["worstStrength"], strength)
+            entry["count"] += 1
+            frequency = ap.get("frequency")
+            if frequency and frequency not in entry["frequencies"]:
+                entry["frequencies"].append(frequency)
+                band = frequency_band(frequency)
+                if band and band not in entry["bands"]:
+                    entry["bands"].append(band)
+            for sec, val in security.items():
+                entry[sec] = entry[sec] or val
+            entry[AP_SECURITY_OPEN] = entry[AP_SECURITY_OPEN] or not any(
+                security.values()
+            )
+        for entry in ssids.values():
+            entry["frequencies"].sort()
+        return list(ssids.values())
+
+    def get_access_points(self, options=None):
+        """
+        Get the AP list (one entry per SSID) reported to the client, filtered
+        by the request options: minimum strength, accepted security types,
+        top-K limit and sort order.
+        """
+        options = options or {}
+        min_strength = options.get(AP_OPT_MIN_STRENGTH, 0)
+        security = options.get(AP_OPT_SECURITY)
+        limit = options.get(AP_OPT_LIMIT)
+        sort = options.get(AP_OPT_SORT)
+
+        aplist = []
+        for entry in self.aggregate():
+            if entry["strength"] < min_strength:
+                continue
+            if security and not any(entry[sec] for sec in security):
+                continue
+            # 'open' is implied by the other flags, don't send it
+            del entry[AP_SECURITY_OPEN]
+            aplist.append(entry)
+
+        if limit is not None and limit < len(aplist):
+            # Strongest K, already sorted by strength
+            aplist = heapq.nlargest(limit, aplist, key=strength_key)
+        elif sort == AP_SORT_STRENGTH:
+            aplist.sort(key=strength_key, reverse=True)
+        if sort == AP_SORT_SSID:
+            aplist.sort(key=lambda entry: entry["ssid"])
+        return aplist
+
+    def get_access_points_since(self, since, options=None):
+        """
+        Get the AP list as a delta from the list generation 'since' sent
+        earlier with the same options: the added and changed entries, and
+        the SSIDs removed.  If that generation is no longer known, the
+        full list is returned instead.
+        """
+        aplist = self.get_access_points(options)
+        key = options_key(options)
+        snapshot = {entry["ssid"]: ap_signature(entry) for entry in aplist}
+        if not self.history or self.history[-1][1:] != (key, snapshot):
+            self.generation += 1
+            self.history.append((self.generation, key, snapshot))
+
+        for generation, old_key, old in self.history:
+            if generation == since and old_key == key:
+                break
+        else:
+            return {"generation": self.generation, "full": True, "aps": aplist}
+
+        delta = {"generation": self.generation}
+        added = [entry for entry in aplist if entry["ssid"] not in old]
+        changed = [
+            entry
+            for entry in aplist
+            if entry["ssid"] in old and old[entry["ssid"]] != snapshot[entry["ssid"]]
+        ]
+        removed = [ssid for ssid in old if ssid not in snapshot]
+        if added:
+            delta["added"] = added
+        if changed:
+            delta["changed"] = changed
+        if removed:
+            delta["removed"] = removed
+        return delta
@@ -0,0 +1,63 @@
+"""
+asynccall - Non-blocking D-Bus method calls for the BLE configuration service
+"""
+
+import dbus, dbus.exceptions
+from syslog import syslog
+
+# Default D-Bus method timeout used by libdbus
+DEFAULT_CALL_TIMEOUT = 25.0
+
+DBUS_ERROR_NO_REPLY = "org.freedesktop.DBus.Error.NoReply"
+DBUS_ERROR_TIMEOUT = "org.freedesktop.DBus.Error.Timeout"
+DBUS_ERROR_TIMED_OUT = "org.freedesktop.DBus.Error.TimedOut"
+
+
+def is_timeout(error):
+    """Check if a D-Bus error was caused by the call timing out"""
+    return isinstance(
+        error, dbus.exceptions.DBusException
+    ) and error.get_dbus_name() in (
+        DBUS_ERROR_NO_REPLY,
+        DBUS_ERROR_TIMEOUT,
+        DBUS_ERROR_TIMED_OUT,
+    )
+
+
+def call_async(
+    method, *args, timeout=DEFAULT_CALL_TIMEOUT, reply_cb=None, error_cb=None
+):
+    """
+    Invoke a D-Bus proxy method without blocking the main loop.
+
+    reply_cb is called with the method's return value (None if the method
+    returns nothing, a tuple if it returns several values); error_cb is
+    called with the DBusException if the call fails or times out.  Both
+    are called from the main loop.
+    """
+
+    def reply_handler(*ret):
+        if reply_cb is None:
+            return
+        if len(ret) == 0:
+            reply_cb(None)
+        elif len(ret) == 1:
+            reply_cb(ret[0])
+        else:
+            reply_cb(ret)
+
+    def error_handler(e):
+        syslog("Asynchronous D-Bus call failed: {}".format(e))
+        if error_cb is not None:
+            error_cb(e)
+
+    try:
+        method(
+            *args,
+            reply_handler=reply_handler,
+            error_handler=error_handler,
+            timeout=timeout
+        )
+    except dbus.exceptions.DBusException as e:
+        # Raised immediately if the call could not be sent at all
+        error_handler(e)
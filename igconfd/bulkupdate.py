@@ -0,0 +1,308 @@
+"""
+bulkupdate - Transactional update of the saved Wi-Fi profiles
+"""
+
+import copy
+import dbus, dbus.exceptions
+from syslog import syslog
+
+from .asynccall import call_async
+from .proxypool import get_interface
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_CONNECTION_IFACE = "org.freedesktop.NetworkManager.Settings.Connection"
+
+# The profiles are restored by BulkUpdate itself; the checkpoint only
+# restores the state of the device
+NM_CHECKPOINT_CREATE_FLAG_NONE = 0x00
+# NetworkManager rolls back by itself if the checkpoint is left behind
+CHECKPOINT_ROLLBACK_TIMEOUT_S = 60
+BULK_CALL_TIMEOUT = 30.0
+
+# NetworkManager without checkpoint support
+DBUS_ERROR_UNKNOWN_METHOD = "org.freedesktop.DBus.Error.UnknownMethod"
+
+# Settings holding secrets, which GetSettings leaves out
+SECRET_SETTINGS = ("802-11-wireless-security", "802-1x")
+
+# Profile operations
+OP_ADD = "add"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+# Operation results
+OP_STATUS_SUCCESS = 0
+OP_STATUS_INVALID = -1
+OP_STATUS_FAILED = -2
+OP_STATUS_NOT_FOUND = -4
+
+
+class BulkUpdate:
+    """
+    Apply a batch of profile operations as one transaction.  The settings
+    (with secrets) of the profiles to update or delete are saved first, and
+    all the Settings calls are then issued at once without waiting for each
+    other.  If any of them fails, the operations that went through are
+    undone (added profiles deleted, updated ones restored, deleted ones
+    added back) and reported as failed.  A NetworkManager checkpoint of the
+    Wi-Fi device also restores its state; without checkpoint support
+    (UnknownMethod) the batch is applied with the undo only, and any other
+    checkpoint failure fails the whole batch.
+
+    Each operation is a dict with the "op" (OP_ADD, OP_UPDATE or OP_DELETE),
+    the connection "path" (update and delete), the new "settings" (add and
+    update), the "old" settings (update and delete) and the resulting
+    "status".
+    """
+
+    def __init__(self, bus, nm, nm_settings, conn_cache, devices, ops, done_cb):
+        self.bus = bus
+        self.nm = nm
+        self.nm_settings = nm_settings
+        self.conn_cache = conn_cache
+        self.devices = devices
+        self.ops = ops
+        self.done_cb = done_cb
+        self.checkpoint = None
+        self.pending = 0
+        self.failed = False
+
+    def start(self):
+        if not self.ops:
+            self.done_cb(True)
+            return
+        self.save_settings()
+
+    def save_settings(self):
+        """Save the current settings of the profiles to update or delete"""
+        secrets = []
+        for op in self.ops:
+            if op["op"] == OP_ADD:
+                continue
+            op["old"] = copy.deepcopy(self.conn_cache.get_settings(op["path"]) or {})
+            for setting in SECRET_SETTINGS:
+                if setting in op["old"]:
+                    secrets.append((op, setting))
+        self.pending = len(secrets)
+        if not secrets:
+            self.create_checkpoint()
+            return
+        for op, setting in secrets:
+            self.get_secrets(op, setting)
+
+    def get_secrets(self, op, setting):
+        def reply_cb(ret):
+            for name, values in ret.items():
+                op["old"].setdefault(name, {}).update(values)
+            self.secrets_complete()
+
+        def error_cb(e):
+            # Secrets may be agent owned, restore what is known
+            syslog("Failed to read {} secrets: {}".format(setting, e))
+            self.secrets_complete()
+
+        conn = get_interface(NM_IFACE, op["path"], NM_CONNECTION_IFACE, False)
+        call_async(
+            conn.GetSecrets,
+            setting,
+            timeout=BULK_CALL_TIMEOUT,
+            reply_cb=reply_cb,
+            error_cb=error_cb,
+        )
+
+    def secrets_complete(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self.create_checkpoint()
+
+    def create_checkpoint(self):
+        call_async(
+            self.nm.CheckpointCreate,
+            dbus.Array(self.devices, signature="o"),
+            dbus.UInt32(CHECKPOINT_ROLLBACK_TIMEOUT_S),
+            dbus.UInt32(NM_CHECKPOINT_CREATE_FLAG_NONE),
+            timeout=BULK_CALL_TIMEOUT,
+            reply_cb=self.checkpoint_created,
+            error_cb=self.checkpoint_failed,
+        )
+
+    def checkpoint_created(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.apply()
+
+    def checkpoint_failed(self, error):
+        if (
+            isinstance(error, dbus.exceptions.DBusException)
+            and error.get_dbus_name() == DBUS_ERROR_UNKNOWN_METHOD
+        ):
+            syslog("No checkpoint support, profiles are restored without it.")
+            self.apply()
+            return
+        syslog("Failed to create checkpoint, not updating profiles.")
+        for op in self.ops:
+            op["status"] = OP_STATUS_FAILED
+        self.done_cb(False)
+
+    def apply(self):
+        self.pending = len(self.ops)
+        for op in self.ops:
+            try:
+                self.apply_op(op)
+            except dbus.exceptions.DBusException as e:
+                self.op_failed(op, e)
+
+    def apply_op(self, op):
+        def reply_cb(ret):
+            self.op_done(op, ret)
+
+        def error_cb(e):
+            self.op_failed(op, e)
+
+        if op["op"] == OP_ADD:
+            call_async(
+                self.nm_settings.AddConnection,
+                op["settings"],
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=reply_cb,
+                error_cb=error_cb,
+            )
+            return
+        conn = get_interface(NM_IFACE, op["path"], NM_CONNECTION_IFACE, False)
+        if op["op"] == OP_UPDATE:
+            call_async(
+                conn.Update,
+                op["settings"],
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=reply_cb,
+                error_cb=error_cb,
+            )
+        else:
+            call_async(
+                conn.Delete,
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=reply_cb,
+                error_cb=error_cb,
+            )
+
+    def op_done(self, op, ret):
+        op["status"] = OP_STATUS_SUCCESS
+        # Write through to the cache (the Settings signals follow anyway)
+        if op["op"] == OP_ADD:
+            op["path"] = ret
+            if self.conn_cache.get_settings(ret) is None:
+                self.conn_cache.update(ret, op["settings"])
+        elif op["op"] == OP_UPDATE:
+            self.conn_cache.update(op["path"], op["settings"])
+        else:
+            self.conn_cache.remove(op["path"])
+        self.op_complete()
+
+    def op_failed(self, op, error):
+        syslog("Failed to {} profile: {}".format(op["op"], error))
+        op["status"] = OP_STATUS_FAILED
+        self.failed = True
+        self.op_complete()
+
+    def op_complete(self):
+        self.pending -= 1
+        if self.pending > 0:
+            return
+        if self.failed:
+            syslog("Profile update failed, rolling back.")
+            self.undo()
+        elif self.checkpoint is None:
+            self.done_cb(True)
+        else:
+            call_async(
+                self.nm.CheckpointDestroy,
+                self.checkpoint,
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=self.committed,
+                error_cb=self.committed,
+            )
+
+    def undo(self):
+        """Undo the operations that went through"""
+        applied = [op for op in self.ops if op["status"] == OP_STATUS_SUCCESS]
+        self.pending = len(applied)
+        if not applied:
+            self.undo_done()
+            return
+        for op in applied:
+            # Rolled back, the entry was not applied
+            op["status"] = OP_STATUS_FAILED
+            try:
+                self.undo_op(op)
+            except dbus.exceptions.DBusException as e:
+                self.undo_failed(op, e)
+
+    def undo_op(self, op):
+        def reply_cb(ret):
+            self.op_undone(op, ret)
+
+        def error_cb(e):
+            self.undo_failed(op, e)
+
+        if op["op"] == OP_DELETE:
+            call_async(
+                self.nm_settings.AddConnection,
+                op["old"],
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=reply_cb,
+                error_cb=error_cb,
+            )
+            return
+        conn = get_interface(NM_IFACE, op["path"], NM_CONNECTION_IFACE, False)
+        if op["op"] == OP_UPDATE:
+            call_async(
+                conn.Update,
+                op["old"],
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=reply_cb,
+                error_cb=error_cb,
+            )
+        else:
+            call_async(
+                conn.Delete,
+                timeout=BULK_CALL_TIMEOUT,
+                reply_cb=reply_cb,
+                error_cb=error_cb,
+            )
+
+    def op_undone(self, op, ret):
+        # Write through to the cache; the restored settings are read back, as
+        # the saved ones hold secrets
+        if op["op"] == OP_ADD:
+            self.conn_cache.remove(op["path"])
+        elif op["op"] == OP_UPDATE:
+            self.conn_cache.refresh(op["path"])
+        else:
+            self.conn_cache.refresh(ret)
+        self.undo_complete()
+
+    def undo_failed(self, op, error):
+        syslog("Failed to undo {} of profile: {}".format(op["op"], error))
+        self.undo_complete()
+
+    def undo_complete(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self.undo_done()
+
+    def undo_done(self):
+        if self.checkpoint is None:
+            self.done_cb(False)
+            return
+        call_async(
+            self.nm.CheckpointRollback,
+            self.checkpoint,
+            timeout=BULK_CALL_TIMEOUT,
+            reply_cb=self.rolled_back,
+            error_cb=self.rolled_back,
+        )
+
+    def rolled_back(self, ret):
+        self.done_cb(False)
+
+    def committed(self, ret):
+        self.done_cb(True)
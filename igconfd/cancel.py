@@ -0,0 +1,112 @@
+"""
+cancel - Request deadlines and cooperative cancellation for the BLE
+configuration service
+"""
+
+import time
+from syslog import syslog
+
+from gi.repository import GObject as gobject
+
+# Cancellation reasons
+CANCEL_DEADLINE = "deadline"
+CANCEL_DISCONNECT = "disconnect"
+
+
+class CancelToken:
+    """
+    Tracks the main loop sources owned by one request, so that they can all
+    be released together when the request is cancelled, either because its
+    deadline passed or because the client went away.
+    """
+
+    def __init__(self, deadline_ms=None):
+        self.cancelled = False
+        self.finished = False
+        self.reason = None
+        self.sources = set()
+        self.cancel_cbs = []
+        self.deadline = None
+        self.deadline_id = None
+        if deadline_ms is not None:
+            self.deadline = time.monotonic() + deadline_ms / 1000.0
+            self.deadline_id = gobject.timeout_add(deadline_ms, self.deadline_expired)
+
+    def remaining(self):
+        """Seconds left until the deadline, or None if there is no deadline"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def clamp(self, timeout):
+        """Limit an operation timeout (in seconds) to the request deadline"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return min(timeout, remaining)
+
+    def timeout_add(self, interval_ms, cb, *args):
+        """
+        Same as gobject.timeout_add, but the source is owned by this token
+        and is removed when the token is cancelled or finished
+        """
+        if self.cancelled or self.finished:
+            return None
+
+        def run(*run_args):
+            if self.cancelled:
+                return False
+            ret = cb(*run_args)
+            if not ret:
+                self.sources.discard(source_id)
+            return ret
+
+        source_id = gobject.timeout_add(interval_ms, run, *args)
+        self.sources.add(source_id)
+        return source_id
+
+    def source_remove(self, source_id):
+        if source_id in self.sources:
+            self.sources.discard(source_id)
+            gobject.source_remove(source_id)
+
+    def on_cancel(self, cb):
+        """Register cb(reason) to be called if the token is cancelled"""
+        if self.cancelled:
+            cb(self.reason)
+        elif not self.finished:
+            self.cancel_cbs.append(cb)
+
+    def release(self):
+        """Remove all sources owned by the token"""
+        if self.deadline_id is not None:
+            gobject.source_remove(self.deadline_id)
+            self.deadline_id = None
+        for source_id in self.sources:
+            gobject.source_remove(source_id)
+        self.sources.clear()
+
+    def finish(self):
+        """The operation completed normally"""
+        if self.cancelled or self.finished:
+            return
+        self.finished = True
+        self.cancel_cbs = []
+        self.release()
+
+    def cancel(self, reason):
+        """Cancel the operation, releasing its sources and notifying owners"""
+        if self.cancelled or self.finished:
+            return
+        self.cancelled = True
+        self.reason = reason
+        self.release()
+        cbs, self.cancel_cbs = self.cancel_cbs, []
+        for cb in cbs:
+            cb(reason)
+
+    def deadline_expired(self):
+        self.deadline_id = None
+        syslog("Request deadline expired, cancelling.")
+        self.cancel(CANCEL_DEADLINE)
+        return False  # Don't repeat timer
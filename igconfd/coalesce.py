@@ -0,0 +1,109 @@
+"""
+coalesce - Bounded-latency coalescing of status reports
+"""
+
+import math
+import time
+
+from gi.repository import GObject as gobject
+
+# Report once the changes have stopped for this long...
+QUIET_PERIOD_MS = 2000
+# ...but never later than this after the first unreported change
+MAX_LATENCY_MS = 15000
+# Delay of the report of an urgent change (state transition)
+URGENT_DELAY_MS = 1000
+
+
+class Coalescer:
+    """
+    Collapse bursts of changes into one report.  The report is sent once
+    no change came in for the quiet period, and at most max_latency_ms
+    after the first change, however chatty the source (e.g. AP strength
+    updates).  An urgent change is reported within urgent_ms.
+
+    The clock and the timer functions can be replaced, for testing with a
+    fake clock.
+    """
+
+    def __init__(
+        self,
+        report_cb,
+        quiet_ms=QUIET_PERIOD_MS,
+        max_latency_ms=MAX_LATENCY_MS,
+        urgent_ms=URGENT_DELAY_MS,
+        clock=time.monotonic,
+        timeout_add=gobject.timeout_add,
+        source_remove=gobject.source_remove,
+    ):
+        self.report_cb = report_cb
+        self.quiet_ms = quiet_ms
+        self.max_latency_ms = max_latency_ms
+        self.urgent_ms = urgent_ms
+        self.clock = clock
+        self.timeout_add = timeout_add
+        self.source_remove = source_remove
+        self.timer_id = None
+        self.timer_due = None  # time the timer fires
+        self.first = None  # time of the first unreported change
+        self.last = None  # time of the last change
+        self.urgent_due = None
+
+    def now_ms(self):
+        return self.clock() * 1000.0
+
+    def due(self):
+        """Time the pending report is due"""
+        due = min(self.first + self.max_latency_ms, self.last + self.quiet_ms)
+        if self.urgent_due is not None:
+            due = min(due, self.urgent_due)
+        return due
+
+    def changed(self, urgent=False):
+        """Note a change to report"""
+        now = self.now_ms()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        if urgent:
+            urgent_due = now + self.urgent_ms
+            if self.urgent_due is None or urgent_due < self.urgent_due:
+                self.urgent_due = urgent_due
+        # A timer due no later than the report is left running, and re-armed
+        # when it fires early
+        due = self.due()
+        if self.timer_id is None or due < self.timer_due:
+            self.arm(due, now)
+
+    def arm(self, due, now):
+        if self.timer_id is not None:
+            self.source_remove(self.timer_id)
+        self.timer_due = due
+        self.timer_id = self.timeout_add(max(0, math.ceil(due - now)), self.timer_fired)
+
+    def timer_fired(self):
+        self.timer_id = None
+        now = self.now_ms()
+        due = self.due()
+        if now < due:
+            self.arm(due, now)
+            return False
+        self.flush()
+        return False
+
+    def flush(self):
+        """Send the pending report now"""
+        if self.timer_id is not None:
+            self.source_remove(self.timer_id)
+            self.timer_id = None
+        if self.first is None:
+            return
+        self.first = self.last = self.urgent_due = None
+        self.report_cb()
+
+    def cancel(self):
+        """Drop the pending report"""
+        if self.timer_id is not None:
+            self.source_remove(self.timer_id)
+            self.timer_id = None
+        self.first = self.last = self.urgent_due = None
@@ -14,6 +14,10 @@ from .ltestat import LTEStat
 
 from gi.repository import GObject as gobject
 
+# Reporters of the connection stats document
+STATS_SOURCE_NET = "net"
+STATS_SOURCE_LTE = "lte"
+
 
 class ConfigurationService(Application):
     def __init__(self, device):
@@ -24,18 +28,26 @@ class ConfigurationService(Application):
 
         super().__init__(bus, device_name, msg_manager)
 
-        self.msg_manager.start(self.vsp_svc.tx)
+        self.msg_manager.start(
+            self.vsp_svc.tx, self.vsp_svc.purge_tx, self.vsp_svc.drop_tx
+        )
         self.init_ble_service()
-        self.net_stat = NetStat(self.ConnectionStatsChanged)
-        self.lte_stat = LTEStat(self.ConnectionStatsChanged)
+        self.net_stat = NetStat(
+            lambda stats: self.publish_connection_stats(STATS_SOURCE_NET, stats)
+        )
+        self.lte_stat = LTEStat(
+            lambda stats: self.publish_connection_stats(STATS_SOURCE_LTE, stats)
+        )
 
     def start(self):
         syslog("Enabling BLE service.")
         self.register_le_services()
         subprocess.call(["btmgmt", "power", "on"])
+        self.msg_manager.net_manager.start_background_scan()
 
     def stop(self):
         syslog("Disabling BLE service.")
+        self.msg_manager.net_manager.stop_background_scan()
         self.disconnect_devices()
         self.deregister_le_services()
         subprocess.call(["btmgmt", "power", "off"])
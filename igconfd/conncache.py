@@ -0,0 +1,171 @@
+"""
+conncache - Indexed cache of NetworkManager connection settings
+"""
+
+import dbus, dbus.exceptions
+from syslog import syslog
+
+from .proxypool import pool, get_interface
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_CONNECTION_IFACE = "org.freedesktop.NetworkManager.Settings.Connection"
+
+NM_CONNECTION = "connection"
+NM_ID = "id"
+NM_UUID = "uuid"
+NM_TYPE = "type"
+NM_AUTOCONNECT_PRIORITY = "autoconnect-priority"
+NM_WIRELESS = "802-11-wireless"
+NM_SSID = "ssid"
+
+
+def get_settings_ssid(settings):
+    """Get the SSID of wireless connection settings as a string"""
+    try:
+        return bytearray(settings[NM_WIRELESS][NM_SSID]).decode("utf-8", "replace")
+    except KeyError:
+        return None
+
+
+class ConnectionCache:
+    """
+    In-memory index of NetworkManager connection settings keyed by object
+    path, id, uuid, SSID and type.  The index is loaded once, kept current
+    from the Settings NewConnection/ConnectionRemoved and per-connection
+    Updated signals, and written through by the NetManager's own changes,
+    so that lookups don't need any bus traffic.  removed_cb(path, settings)
+    is called once a connection is deleted.
+    """
+
+    def __init__(self, bus, nm_settings, removed_cb=None):
+        self.bus = bus
+        self.removed_cb = removed_cb
+        self.settings = {}  # path -> settings
+        self.by_id = {}  # id -> [path, ...]
+        self.by_uuid = {}  # uuid -> path
+        self.by_ssid = {}  # ssid -> [path, ...]
+        self.by_type = {}  # type -> [path, ...]
+        self.max_priority = None  # None when it must be recomputed
+
+        nm_settings.connect_to_signal("NewConnection", self.connection_added)
+        nm_settings.connect_to_signal("ConnectionRemoved", self.connection_removed)
+        # One receiver for the Updated signal of every connection object
+        self.bus.add_signal_receiver(
+            self.connection_updated,
+            signal_name="Updated",
+            dbus_interface=NM_CONNECTION_IFACE,
+            bus_name=NM_IFACE,
+            path_keyword="path",
+        )
+        for path in nm_settings.ListConnections():
+            self.refresh(path)
+
+    #
+    # Signal handlers
+    #
+    def connection_added(self, path):
+        self.refresh(path)
+
+    def connection_removed(self, path):
+        self.remove(path)
+        pool.evict(NM_IFACE, path)
+
+    def connection_updated(self, path=None):
+        if path is not None:
+            self.refresh(path)
+
+    #
+    # Index maintenance
+    #
+    def refresh(self, path):
+        """Re-read the settings of one connection from NetworkManager"""
+        try:
+            c = get_interface(NM_IFACE, path, NM_CONNECTION_IFACE)
+            self.update(path, c.GetSettings())
+        except dbus.exceptions.DBusException as e:
+            # Connection may have been removed meanwhile
+            syslog("Failed to read connection {}: {}".format(path, e))
+            self.remove(path)
+
+    def update(self, path, settings):
+        """Store new settings for a connection"""
+        path = str(path)
+        self.unindex_path(path)
+        self.settings[path] = settings
+        conn = settings.get(NM_CONNECTION, {})
+        if NM_ID in conn:
+            self.by_id.setdefault(str(conn[NM_ID]), []).append(path)
+        if NM_UUID in conn:
+            self.by_uuid[str(conn[NM_UUID])] = path
+        if NM_TYPE in conn:
+            self.by_type.setdefault(str(conn[NM_TYPE]), []).append(path)
+        ssid = get_settings_ssid(settings)
+        if ssid is not None:
+            self.by_ssid.setdefault(ssid, []).append(path)
+        priority = conn.get(NM_AUTOCONNECT_PRIORITY)
+        if priority is not None and self.max_priority is not None:
+            self.max_priority = max(self.max_priority, int(priority))
+
+    def remove(self, path):
+        """Drop a deleted connection from the index"""
+        settings = self.unindex_path(str(path))
+        if settings is not None and self.removed_cb is not None:
+            self.removed_cb(str(path), settings)
+
+    def unindex_path(self, path):
+        """Drop a connection from the index, returning its settings"""
+        settings = self.settings.pop(path, None)
+        if settings is None:
+            return None
+        conn = settings.get(NM_CONNECTION, {})
+        self.unindex(self.by_id, str(conn.get(NM_ID)), path)
+        self.unindex(self.by_type, str(conn.get(NM_TYPE)), path)
+        self.unindex(self.by_ssid, get_settings_ssid(settings), path)
+        if self.by_uuid.get(str(conn.get(NM_UUID))) == path:
+            del self.by_uuid[str(conn[NM_UUID])]
+        priority = conn.get(NM_AUTOCONNECT_PRIORITY)
+        if priority is not None and int(priority) == self.max_priority:
+            self.max_priority = None
+        return settings
+
+    def unindex(self, index, key, path):
+        paths = index.get(key)
+        if paths and path in paths:
+            paths.remove(path)
+            if not paths:
+                del index[key]
+
+    #
+    # Lookups
+    #
+    def find_path_by_id(self, conn_id):
+        paths = self.by_id.get(str(conn_id))
+        return paths[0] if paths else None
+
+    def find_path_by_uuid(self, uuid):
+        return self.by_uuid.get(str(uuid))
+
+    def find_paths_by_ssid(self, ssid):
+        return list(self.by_ssid.get(ssid, []))
+
+    def get_settings(self, path):
+        return self.settings.get(str(path))
+
+    def connections(self, conn_type=None):
+        """Iterate over (path, settings), optionally of one connection type"""
+        if conn_type is None:
+            paths = list(self.settings)
+        else:
+            paths = list(self.by_type.get(conn_type, []))
+        for path in paths:
+            yield path, self.settings[path]
+
+    def highest_priority(self):
+        """Highest autoconnect priority of any connection (at least 0)"""
+        if self.max_priority is None:
+            self.max_priority = 0
+            for settings in self.settings.values():
+                priority = settings.get(NM_CONNECTION, {}).get(NM_AUTOCONNECT_PRIORITY)
+                if priority is not None and int(priority) > self.max_priority:
+                    self.max_priority = int(priority)
+        return self.max_priority
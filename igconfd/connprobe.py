@@ -0,0 +1,248 @@
+"""
+connprobe - Multi-phase connectivity probe for the BLE configuration service
+"""
+
+import socket
+import ssl
+import time
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from syslog import syslog
+
+from gi.repository import GObject as gobject
+
+PROBE_DEFAULT_TIMEOUT = 10.0
+PROBE_MAX_URLS = 8
+PROBE_MAX_WORKERS = 8
+PROBE_USER_AGENT = "igconfd"
+
+# Not exported by the socket module on all Python versions
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+FAMILY_NAMES = {socket.AF_INET: "ipv4", socket.AF_INET6: "ipv6"}
+
+# Phase names reported in the probe results
+PHASE_DNS = "dns"
+PHASE_CONNECT = "connect"
+PHASE_TLS = "tls"
+PHASE_TTFB = "ttfb"
+PHASE_TRANSFER = "transfer"
+
+
+class ProbeError(Exception):
+    """Raised when a probe fails; records the phase that failed"""
+
+    def __init__(self, phase, reason):
+        super().__init__(reason)
+        self.phase = phase
+        self.reason = reason
+
+
+def elapsed_ms(start):
+    return int((time.monotonic() - start) * 1000)
+
+
+def connect_socket(addr_info, iface, timeout):
+    """Open a TCP connection to one resolved address, optionally bound to iface"""
+    family, socktype, proto, _, sockaddr = addr_info
+    s = socket.socket(family, socktype, proto)
+    try:
+        if iface:
+            s.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, iface.encode())
+        s.settimeout(timeout)
+        s.connect(sockaddr)
+    except OSError:
+        s.close()
+        raise
+    return s
+
+
+def race_connect(addr_infos, iface, timeout):
+    """
+    Connect to the first IPv4 and the first IPv6 address in parallel;
+    the first family to complete the TCP handshake wins and the other
+    socket is closed.  Returns (socket, family).
+    """
+    candidates = {}
+    for a in addr_infos:
+        if a[0] in FAMILY_NAMES:
+            candidates.setdefault(a[0], a)
+    if not candidates:
+        raise ProbeError(PHASE_DNS, "no usable address")
+
+    lock = threading.Lock()
+    done = threading.Event()
+    state = {"winner": None, "pending": len(candidates), "error": None}
+
+    def attempt(addr_info):
+        try:
+            s = connect_socket(addr_info, iface, timeout)
+        except OSError as e:
+            s = None
+            err = e
+        with lock:
+            state["pending"] -= 1
+            if s is not None and state["winner"] is None:
+                state["winner"] = (s, addr_info[0])
+                s = None
+            elif s is None:
+                state["error"] = err
+            if state["winner"] is not None or state["pending"] == 0:
+                done.set()
+        if s is not None:
+            # Lost the race
+            s.close()
+
+    for addr_info in candidates.values():
+        threading.Thread(target=attempt, args=(addr_info,), daemon=True).start()
+
+    done.wait(timeout)
+    with lock:
+        if state["winner"] is None:
+            # Any late winner will now find itself the winner with nobody
+            # waiting; mark the race as over so it closes its socket
+            state["winner"] = (None, None)
+            raise ProbeError(PHASE_CONNECT, str(state["error"] or "timed out"))
+        return state["winner"]
+
+
+def probe_url(url, iface=None, timeout=PROBE_DEFAULT_TIMEOUT):
+    """
+    Probe a single URL, timing each phase: name resolution, TCP connect
+    (IPv4 raced against IPv6), TLS handshake, time to first byte and body
+    transfer.  Returns a result dict; failures are reported in the dict
+    with the phase that failed rather than raised.
+    """
+    result = {"url": url, "phases": {}}
+    if iface:
+        result["interface"] = iface
+    phases = result["phases"]
+    start = time.monotonic()
+    sock = None
+    conn = None
+    try:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ProbeError(PHASE_DNS, "invalid url")
+        secure = parsed.scheme == "https"
+        port = parsed.port or (443 if secure else 80)
+        path = parsed.path or "/"
+        if parsed.query:
+            path = path + "?" + parsed.query
+
+        t = time.monotonic()
+        try:
+            addr_infos = socket.getaddrinfo(
+                parsed.hostname, port, type=socket.SOCK_STREAM
+            )
+        except socket.gaierror as e:
+            raise ProbeError(PHASE_DNS, str(e))
+        phases[PHASE_DNS] = elapsed_ms(t)
+
+        t = time.monotonic()
+        sock, family = race_connect(addr_infos, iface, timeout)
+        phases[PHASE_CONNECT] = elapsed_ms(t)
+        result["family"] = FAMILY_NAMES[family]
+
+        if secure:
+            t = time.monotonic()
+            try:
+                ctx = ssl.create_default_context()
+                sock = ctx.wrap_socket(sock, server_hostname=parsed.hostname)
+            except (ssl.SSLError, OSError) as e:
+                raise ProbeError(PHASE_TLS, str(e))
+            phases[PHASE_TLS] = elapsed_ms(t)
+
+        # Hand the connected socket to http.client to issue the request
+        conn = http.client.HTTPConnection(parsed.hostname, port, timeout=timeout)
+        conn.sock = sock
+        sock = None
+        t = time.monotonic()
+        try:
+            conn.request(
+                "GET",
+                path,
+                headers={"User-Agent": PROBE_USER_AGENT, "Connection": "close"},
+            )
+            resp = conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            raise ProbeError(PHASE_TTFB, str(e))
+        phases[PHASE_TTFB] = elapsed_ms(t)
+        t = time.monotonic()
+        try:
+            content = resp.read()
+        except (http.client.HTTPException, OSError) as e:
+            raise ProbeError(PHASE_TRANSFER, str(e))
+        phases[PHASE_TRANSFER] = elapsed_ms(t)
+        result["result"] = resp.status
+        result["len"] = len(content)
+    except ProbeError as e:
+        result["error"] = e.phase
+        result["reason"] = e.reason
+    finally:
+        if sock is not None:
+            sock.close()
+        if conn is not None:
+            conn.close()
+    result["total"] = elapsed_ms(start)
+    return result
+
+
+def summarize(results):
+    """Compare uplinks: per-interface success count and mean total time"""
+    summary = {}
+    for r in results:
+        s = summary.setdefault(r.get("interface", ""), {"ok": 0, "failed": 0})
+        if "error" in r:
+            s["failed"] += 1
+        else:
+            s["ok"] += 1
+            s["total"] = s.get("total", 0) + r["total"]
+    best = None
+    for iface, s in summary.items():
+        if s["ok"] > 0:
+            s["mean"] = int(s.pop("total") / s["ok"])
+            if best is None or s["mean"] < summary[best]["mean"]:
+                best = iface
+    return summary, best
+
+
+class ConnProbe:
+    """
+    Run a set of URL probes concurrently on worker threads, optionally
+    on each of several interfaces, and deliver the results on the main loop
+    """
+
+    def __init__(self, urls, interfaces=None, timeout=PROBE_DEFAULT_TIMEOUT):
+        self.urls = urls[:PROBE_MAX_URLS]
+        self.interfaces = interfaces or [None]
+        self.timeout = timeout
+
+    def run(self, done_cb):
+        """Start the probe; done_cb(data) is called from the main loop"""
+        threading.Thread(target=self.probe_all, args=(done_cb,), daemon=True).start()
+
+    def probe_all(self, done_cb):
+        jobs = [(url, iface) for iface in self.interfaces for url in self.urls]
+        syslog(
+            "Probing {} URL(s) on {} interface(s)".format(
+                len(self.urls), len(self.interfaces)
+            )
+        )
+        workers = min(len(jobs), PROBE_MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(
+                pool.map(lambda job: probe_url(job[0], job[1], self.timeout), jobs)
+            )
+        data = {"results": results}
+        if len(self.interfaces) > 1:
+            data["interfaces"], best = summarize(results)
+            if best is not None:
+                data["best"] = best
+        gobject.idle_add(self.deliver, done_cb, data)
+
+    def deliver(self, done_cb, data):
+        done_cb(data)
+        return False  # Don't repeat
@@ -56,9 +56,12 @@ class CustomService(ConfigurationService):
         self.register_le_services()
         self.device_svc.SetBLEState(BLE_STATE_ACTIVE)
         subprocess.call(["btmgmt", "power", "on"])
+        # Keep the AP scan list updated while BLE is active
+        self.msg_manager.net_manager.start_background_scan()
 
     def disable_ble_service(self):
         syslog("Disabling BLE service.")
+        self.msg_manager.net_manager.stop_background_scan()
         self.disconnect_devices()
         self.device_svc.SetBLEState(BLE_STATE_INACTIVE)
         self.deregister_gatt_services()
@@ -100,5 +103,3 @@ class CustomService(ConfigurationService):
             self.enable_ble_service()
             # Set message timeout callback to disable service after inactivity
             self.msg_manager.set_msg_timeout(BUTTON_PRESS_MSG_TIMEOUT_MS, self.stop)
-            # Make sure AP scan list gets updated
-            self.msg_manager.net_manager.start_ap_scan()
@@ -5,6 +5,9 @@ devmngr - Device service functionality for the BLE configuration service
 import dbus, dbus.exceptions
 from syslog import syslog
 
+from .asynccall import call_async
+from .cancel import CancelToken
+
 from gi.repository import GObject as gobject
 
 # Status codes for MessageManager responses
@@ -45,12 +48,14 @@ STORAGE_FORMATTING = "formatting"
 # Misc
 EXT_STORAGE_STATUS_PROP = "ExtStorageStatus"
 STORAGE_SWAP_TIMER_MS = 2000
+EXT_STORAGE_CALL_TIMEOUT = 30.0
 
 
 class DeviceManager:
     """Device States - these must match the IG Device Service"""
 
     def __init__(self, response_cb):
+        self.token = CancelToken()
         try:
             # Connect to the Device Service through DBUS. If unable, disable the
             # Device API to message manager
@@ -84,11 +89,13 @@ class DeviceManager:
         self.response_cb(MSG_STATUS_INTERMEDIATE, {"state": self.swap_status})
         return True  # Continue timer
 
-    def do_storage_swap(self):
+    def do_storage_swap(self, token=None):
         """Kick off a storage swap. Returns a MSG Status to include in the response."""
         # Check that we're not already performing a swap
         if self.id_swap_timer:
             return (MSG_STATUS_ERR_INVALID, None)
+        self.token = token or CancelToken()
+        self.token.on_cancel(self.storage_swap_cancelled)
 
         # Check current external storage state
         if (
@@ -100,9 +107,7 @@ class DeviceManager:
             # Card is present, request stop
             syslog("Ejecting external storage")
             self.swap_status = STORAGE_EJECTING
-            if self.device_svc.ExtStorageStop() != 0:
-                syslog("Failed request to stop external storage.")
-                return (MSG_STATUS_ERR_DEVICE, None)
+            self.storage_request(self.device_svc.ExtStorageStop, "stop")
         elif self.ext_storage_status == EXT_STORAGE_STATUS_STOPPING:
             # Already stopping
             self.swap_status = STORAGE_EJECTING
@@ -110,9 +115,7 @@ class DeviceManager:
             # Unformatted card is present, start formatting
             syslog("Formatting external storage")
             self.swap_status = STORAGE_FORMATTING
-            if self.device_svc.ExtStorageFormat() != 0:
-                syslog("Failed request to format external storage.")
-                return (MSG_STATUS_ERR_DEVICE, None)
+            self.storage_request(self.device_svc.ExtStorageFormat, "format")
         elif self.ext_storage_status == EXT_STORAGE_STATUS_FORMATTING:
             # Already formatting
             self.swap_status = STORAGE_FORMATTING
@@ -128,12 +131,40 @@ class DeviceManager:
             return (MSG_STATUS_ERR_INVALID, None)
 
         # Set timer task to check status & send intermediate responses
-        self.id_swap_timer = gobject.timeout_add(
+        self.id_swap_timer = self.token.timeout_add(
             STORAGE_SWAP_TIMER_MS, self.storage_swap_cb
         )
         # Send initial intermediate response
         return (MSG_STATUS_INTERMEDIATE, {"state": self.swap_status})
 
+    def storage_swap_cancelled(self, reason):
+        """The swap request was cancelled; its timer was already released"""
+        syslog("Storage swap cancelled ({}).".format(reason))
+        self.id_swap_timer = None
+
+    def storage_request(self, method, operation):
+        """Issue a storage request to the Device Service without blocking;
+        a failure ends the swap with a device error.
+        """
+
+        def reply_cb(ret):
+            if ret != 0:
+                storage_failed(None)
+
+        def storage_failed(error):
+            syslog("Failed request to {} external storage.".format(operation))
+            if self.id_swap_timer:
+                self.token.source_remove(self.id_swap_timer)
+                self.id_swap_timer = None
+                self.response_cb(MSG_STATUS_ERR_DEVICE)
+
+        call_async(
+            method,
+            timeout=self.token.clamp(EXT_STORAGE_CALL_TIMEOUT),
+            reply_cb=reply_cb,
+            error_cb=storage_failed,
+        )
+
     def get_storage_data(self):
         """Get the storage info properties from the Device Service"""
         props = self.device_props.GetAll(DEVICE_PUB_IFACE)
@@ -161,7 +192,7 @@ class DeviceManager:
         syslog("External storage state changed: {}".format(self.ext_storage_status))
         # Handle change in state while swap is in progress
         # Stop current timer
-        gobject.source_remove(self.id_swap_timer)
+        self.token.source_remove(self.id_swap_timer)
         self.id_swap_timer = None
         if self.ext_storage_status == EXT_STORAGE_STATUS_STOPPED:
             self.swap_status = STORAGE_STOPPED
@@ -179,10 +210,7 @@ class DeviceManager:
             # Unformatted card inserted
             syslog("Formatting external storage")
             self.swap_status = STORAGE_FORMATTING
-            if self.device_svc.ExtStorageFormat() != 0:
-                syslog("Failed request to format external storage.")
-                self.response_cb(MSG_STATUS_ERR_DEVICE)
-                return
+            self.storage_request(self.device_svc.ExtStorageFormat, "format")
         elif self.ext_storage_status == EXT_STORAGE_STATUS_STOPPING:
             self.swap_status = STORAGE_EJECTING
         elif self.ext_storage_status == EXT_STORAGE_STATUS_FORMATTING:
@@ -193,7 +221,7 @@ class DeviceManager:
             return
 
         # Set timer task to check status & send intermediate responses
-        self.id_swap_timer = gobject.timeout_add(
+        self.id_swap_timer = self.token.timeout_add(
             STORAGE_SWAP_TIMER_MS, self.storage_swap_cb
         )
 
@@ -7,7 +7,8 @@ import dbus.exceptions
 from syslog import syslog
 import json
 
-from gi.repository import GObject as gobject
+from .coalesce import Coalescer
+from .proxypool import get_interface
 
 NM_IFACE = "org.freedesktop.NetworkManager"
 NM_OBJ = "/org/freedesktop/NetworkManager"
@@ -48,7 +49,8 @@ CONNECTION_PROPERTY_MAP = [
     ("IPv6.Settings", "NetworkIpv6", True),
 ]
 
-PROPERTY_CHANGE_DELAY_MS = 15000
+# ConnectionContext properties whose changes are reported promptly
+URGENT_CONNECTION_PROPERTIES = ("Settings", "IPv6.Settings")
 
 
 class LTEStat:
@@ -60,7 +62,7 @@ class LTEStat:
         self.modem_connection = None
         self.connection_status = {}
         self.connection_stats_changed = connection_stat_changed_signal
-        self.property_timer_id = None
+        self.coalescer = Coalescer(self.status_update)
         try:
             self.bus = dbus.SystemBus()
             self.ofono = dbus.Interface(
@@ -98,23 +100,15 @@ class LTEStat:
         payload["lte"] = self.connection_status
         syslog("Sending LTE connection status via D-Bus: {}".format(payload))
         self.connection_stats_changed(json.dumps(payload))
-        self.property_timer_id = None
-        return False  # Don't repeat timer
 
-    def schedule_status_update(self):
-        """Schedule or reschedule the satus report"""
-        if self.property_timer_id is not None:
-            gobject.source_remove(self.property_timer_id)
-        self.property_timer_id = gobject.timeout_add(
-            PROPERTY_CHANGE_DELAY_MS, self.status_update
-        )
+    def schedule_status_update(self, urgent=False):
+        """Schedule the status report, coalescing the changes"""
+        self.coalescer.changed(urgent)
 
     def modem_added(self, object_path, properties):
         """Modem added signal handler"""
         self.modem_path = object_path
-        self.modem = dbus.Interface(
-            self.bus.get_object(OFONO_BUS_NAME, self.modem_path), OFONO_MODEM_IFACE
-        )
+        self.modem = get_interface(OFONO_BUS_NAME, self.modem_path, OFONO_MODEM_IFACE)
         self.collect_properties(self.modem.GetProperties(), MODEM_PROPERTY_MAP)
         self.modem.connect_to_signal("PropertyChanged", self.modem_prop_changed)
 
@@ -122,12 +116,11 @@ class LTEStat:
         """Modem property changed signal handler"""
         if name == "Online" and value:
             # Modem has gone online, schedule update
-            self.schedule_status_update()
+            self.schedule_status_update(urgent=True)
         elif name == "Interfaces":
             if OFONO_NETREG_IFACE in value and self.modem_netreg is None:
-                self.modem_netreg = dbus.Interface(
-                    dbus.SystemBus().get_object(OFONO_BUS_NAME, self.modem_path),
-                    OFONO_NETREG_IFACE,
+                self.modem_netreg = get_interface(
+                    OFONO_BUS_NAME, self.modem_path, OFONO_NETREG_IFACE
                 )
                 self.collect_properties(
                     self.modem_netreg.GetProperties(), NETREG_PROPERTY_MAP
@@ -136,15 +129,13 @@ class LTEStat:
                     "PropertyChanged", self.modem_netreg_prop_changed
                 )
             if OFONO_CONNMAN_IFACE in value and self.modem_connection is None:
-                connman = dbus.Interface(
-                    dbus.SystemBus().get_object(OFONO_BUS_NAME, self.modem_path),
-                    OFONO_CONNMAN_IFACE,
+                connman = get_interface(
+                    OFONO_BUS_NAME, self.modem_path, OFONO_CONNMAN_IFACE
                 )
                 ctx_objs = connman.GetContexts()
                 if len(ctx_objs) > 0:
-                    self.modem_connection = dbus.Interface(
-                        dbus.SystemBus().get_object(OFONO_BUS_NAME, ctx_objs[0][0]),
-                        OFONO_CONNECTION_IFACE,
+                    self.modem_connection = get_interface(
+                        OFONO_BUS_NAME, ctx_objs[0][0], OFONO_CONNECTION_IFACE
                     )
                     self.collect_properties(
                         self.modem_connection.GetProperties(), CONNECTION_PROPERTY_MAP
@@ -164,4 +155,4 @@ class LTEStat:
     def modem_connection_prop_changed(self, name, value):
         """ConnectionContext property changed signal handler"""
         if self.collect_properties({name: value}, CONNECTION_PROPERTY_MAP):
-            self.schedule_status_update()
+            self.schedule_status_update(name in URGENT_CONNECTION_PROPERTIES)
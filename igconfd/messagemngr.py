@@ -5,6 +5,10 @@ import urllib, urllib.request, urllib.error
 from .netmngr import NetManager
 from .provmngr import ProvManager
 from .devmngr import DeviceManager
+from .asynccall import call_async, is_timeout
+from .cancel import CancelToken, CANCEL_DEADLINE, CANCEL_DISCONNECT
+from .connprobe import ConnProbe, PROBE_DEFAULT_TIMEOUT
+from . import schema
 
 from syslog import syslog
 
@@ -34,8 +38,10 @@ MSG_ID_EXT_STORAGE_SWAP = "extStorageSwap"
 MSG_ID_GET_LTE_INFO = "getLTEInfo"
 MSG_ID_GET_LTE_STATUS = "getLTEStatus"
 MSG_ID_CONN_CHECK = "connCheck"
+MSG_ID_CONN_PROBE = "connProbe"
 MSG_ID_UPDATE_CONFIG = "updateConfig"
 MSG_ID_CHECK_UPDATE = "checkUpdate"
+MSG_ID_GET_ACTIVATION_HISTORY = "getActivationHistory"
 
 MSG_STATUS_INTERMEDIATE = 1
 MSG_STATUS_SUCCESS = 0
@@ -49,6 +55,7 @@ MSG_STATUS_API_DISABLED = -7
 MSG_STATUS_ERR_NOSIM = -8
 MSG_STATUS_ERR_BAD_CONFIG = -9
 MSG_STATUS_ERR_UNKNOWN = -10
+MSG_STATUS_ERR_BUSY = -11
 
 EXT_STORAGE_STATUS_FULL = -1
 EXT_STORAGE_STATUS_FAILED = -2
@@ -79,25 +86,12 @@ UPDATE_SVC = "com.lairdtech.security.UpdateService"
 UPDATE_PATH = "/com/lairdtech/security/UpdateService"
 UPDATE_IFACE = "com.lairdtech.security.UpdateInterface"
 UPDATE_PUBLIC_IFACE = "com.lairdtech.security.public.UpdateInterface"
+UPDATE_CONFIG_CALL_TIMEOUT = 10.0
+CHECK_UPDATE_CALL_TIMEOUT = 60.0
 
 STORAGE_SWAP_TIMER_MS = 2000
 
 
-def convert_dict_keys_values_to_string(data):
-    """Convert dict's keys & values from 'bytes' to 'string'"""
-    if isinstance(data, bytes):
-        return data.decode("utf-8")
-    if isinstance(data, dict):
-        return dict(map(convert_dict_keys_values_to_string, data.items()))
-    if isinstance(data, tuple):
-        return tuple(map(convert_dict_keys_values_to_string, data))
-    if isinstance(data, list):
-        return list(map(convert_dict_keys_values_to_string, data))
-    if isinstance(data, set):
-        return set(map(convert_dict_keys_values_to_string, data))
-    return data
-
-
 class MessageManager:
     def __init__(self, shutdown_cb):
         self.prov_manager = ProvManager(self.send_prov_response)
@@ -110,6 +104,9 @@ class MessageManager:
         self.msg_timeout_id = None
         self.msg_timeout_cb = None
         self.msg_timeout_delay = None
+        self.request_tokens = set()
+        self.purge_tx = None
+        self.drop_tx = None
 
         self.bus = dbus.SystemBus()
         self.bluez_dev_obj = self.bus.get_object(
@@ -117,8 +114,10 @@ class MessageManager:
         )
         self.bluez_dev_props = dbus.Interface(self.bluez_dev_obj, DBUS_PROP_IFACE)
 
-    def start(self, tx_msg):
+    def start(self, tx_msg, purge_tx=None, drop_tx=None):
         self.tx_msg = tx_msg
+        self.purge_tx = purge_tx
+        self.drop_tx = drop_tx
 
     def add_request(self, req_obj):
         """Schedule request handler to run on main loop"""
@@ -130,6 +129,36 @@ class MessageManager:
         # Reset message state on client disconnect
         syslog("BLE client disconnected, resetting state.")
         self.net_manager.stop_scanning()
+        # Nobody is listening any more, cancel all outstanding requests
+        tokens = list(self.request_tokens)
+        self.request_tokens = set()
+        for token in tokens:
+            token.cancel(CANCEL_DISCONNECT)
+        if self.purge_tx is not None:
+            self.purge_tx()
+
+    def request_token(self, req_obj):
+        """Create the cancellation token for a request, with its optional deadline"""
+        # Drop tokens of requests that were abandoned without a final response
+        self.request_tokens = {t for t in self.request_tokens if not t.finished}
+
+        token = CancelToken(req_obj.deadline)
+        token.on_cancel(lambda reason: self.request_cancelled(req_obj, reason))
+        self.request_tokens.add(token)
+        req_obj.token = token
+        return token
+
+    def get_request_token(self, req_obj):
+        return req_obj.token or CancelToken()
+
+    def request_cancelled(self, req_obj, reason):
+        self.request_tokens.discard(req_obj.token)
+        if reason == CANCEL_DEADLINE:
+            # Drop what is still queued for this request (leaving the responses
+            # to other requests alone), then report the timeout
+            if self.drop_tx is not None:
+                self.drop_tx(req_obj)
+            self.send_response(req_obj, MSG_STATUS_ERR_TIMEOUT)
 
     def reset_msg_timeout(self):
         if self.msg_timeout_id is not None:
@@ -151,33 +180,53 @@ class MessageManager:
         try:
             resp_obj = {
                 MSG_VERSION: MSG_VERSION_VAL,
-                MSG_ID: req_obj[MSG_ID],
-                MSG_TYPE: req_obj[MSG_TYPE],
+                MSG_ID: req_obj.id,
+                MSG_TYPE: req_obj.type,
                 MSG_STATUS: status,
             }
             if data:
                 resp_obj[MSG_DATA] = data
+            if status != MSG_STATUS_INTERMEDIATE:
+                # Final response, the request no longer owns any resources
+                if req_obj.token is not None:
+                    self.request_tokens.discard(req_obj.token)
+                    req_obj.token.finish()
             syslog(
                 "Sending {} response ({})".format(
                     resp_obj[MSG_TYPE], resp_obj[MSG_STATUS]
                 )
             )
-            self.tx_msg(json.dumps(resp_obj, separators=(",", ":")), tx_complete)
+            self.tx_msg(
+                json.dumps(resp_obj, separators=(",", ":")), tx_complete, req_obj
+            )
         except Exception as e:
             syslog("Failed to send response: '%s'" % str(e))
 
+    def reject_request(self, req_obj, field):
+        """Answer a request that could not be decoded"""
+        self.send_response(req_obj, MSG_STATUS_ERR_INVALID, data={"field": field})
+
     def handle_command(self, req_obj):
         """Process a request object"""
         self.reset_msg_timeout()
+        token = self.request_token(req_obj)
         try:
-            msg_type = req_obj[MSG_TYPE]
+            msg_type = req_obj.type
             syslog("Processing request: {}".format(msg_type))
             # Check version on all messages except the version check;
             # don't allow future versions (client must be backwards
             # compatible)
-            if msg_type != MSG_ID_VERSION and req_obj[MSG_VERSION] > MSG_VERSION_VAL:
+            if msg_type != MSG_ID_VERSION and req_obj.version > MSG_VERSION_VAL:
                 self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
                 return
+            # Reject malformed payloads before any work is started
+            field = schema.validate_data(msg_type, req_obj.data)
+            if field is not None:
+                syslog("Invalid {} request field: {}".format(msg_type, field))
+                self.send_response(
+                    req_obj, MSG_STATUS_ERR_INVALID, data={"field": field}
+                )
+                return
             if msg_type == MSG_ID_VERSION:
                 self.send_response(req_obj, MSG_STATUS_SUCCESS)
             elif msg_type == MSG_ID_GET_DEVICE_ID:
@@ -194,6 +243,8 @@ class MessageManager:
                 self.handle_net_manager_request(MSG_ID_GET_CURRENT_APS, req_obj)
             elif msg_type == MSG_ID_CONNECT_LTE:
                 self.handle_net_manager_request(MSG_ID_CONNECT_LTE, req_obj)
+            elif msg_type == MSG_ID_GET_ACTIVATION_HISTORY:
+                self.handle_net_manager_request(MSG_ID_GET_ACTIVATION_HISTORY, req_obj)
             elif msg_type == MSG_ID_PROVISION_URL:
                 self.handle_prov_manager_request(MSG_ID_PROVISION_URL, req_obj)
             elif msg_type == MSG_ID_PROVISION_EDGE:
@@ -208,16 +259,21 @@ class MessageManager:
                 self.handle_net_manager_request(MSG_ID_GET_LTE_STATUS, req_obj)
             elif msg_type == MSG_ID_CONN_CHECK:
                 self.req_conn_check(req_obj)
+            elif msg_type == MSG_ID_CONN_PROBE:
+                self.req_conn_probe(req_obj)
             elif msg_type == MSG_ID_UPDATE_CONFIG:
                 self.req_update_config(req_obj)
             elif msg_type == MSG_ID_CHECK_UPDATE:
                 self.req_check_update(req_obj)
             else:
                 self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
-        except KeyError:
-            syslog("Invalid request message, ignoring.")
+        except KeyError as k:
+            syslog("Invalid request message: missing {}".format(k))
+            self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
         except Exception as e:
             syslog("Unexpected failure: {}".format(e))
+            self.request_tokens.discard(token)
+            token.finish()
         # Exit timer
         return False
 
@@ -263,8 +319,10 @@ class MessageManager:
     def req_conn_check(self, req_obj):
         """Handle Connectivity Check Request"""
         try:
-            url = req_obj["data"]["url"]
-            check_timeout = float(req_obj["data"]["timeout"])
+            url = req_obj.data["url"]
+            check_timeout = self.get_request_token(req_obj).clamp(
+                float(req_obj.data["timeout"])
+            )
             syslog(
                 "Performing connectivity check on {} with timeout {}".format(
                     url, check_timeout
@@ -285,7 +343,7 @@ class MessageManager:
             self.send_response(req_obj, MSG_STATUS_ERR_TIMEOUT)
         except urllib.error.URLError:
             self.send_response(req_obj, MSG_STATUS_ERR_NOCONN)
-        except KeyError:
+        except (KeyError, TypeError):
             # Invalid request
             self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
         except ValueError:
@@ -295,6 +353,23 @@ class MessageManager:
             # Hmmm, something else went wrong
             self.send_response(req_obj, MSG_STATUS_ERR_UNKNOWN)
 
+    def req_conn_probe(self, req_obj):
+        """Handle Connectivity Probe Request"""
+        # Payload was checked against the connProbe schema
+        data = req_obj.data
+        urls = data["urls"] if "urls" in data else [data["url"]]
+        interfaces = data.get("interfaces")
+        timeout = float(data.get("timeout", PROBE_DEFAULT_TIMEOUT))
+
+        token = self.get_request_token(req_obj)
+        self.send_response(req_obj, MSG_STATUS_INTERMEDIATE)
+        probe = ConnProbe(urls, interfaces, token.clamp(timeout))
+        probe.run(lambda data: self.conn_probe_done(req_obj, token, data))
+
+    def conn_probe_done(self, req_obj, token, data):
+        if not token.cancelled:
+            self.send_response(req_obj, MSG_STATUS_SUCCESS, data=data)
+
     #
     # Response callbacks for the various service managers
     #
@@ -305,13 +380,17 @@ class MessageManager:
         ):
             self.send_response(self.cur_net_req_obj, MSG_STATUS_SUCCESS, data)
         elif status == NetManager.ACTIVATION_FAILED_AUTH:
-            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_AUTH)
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_AUTH, data)
         elif status == NetManager.ACTIVATION_FAILED_NETWORK:
-            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOCONN)
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOCONN, data)
+        elif status == NetManager.ACTIVATION_NOT_FOUND:
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOTFOUND, data)
+        elif status == NetManager.ACTIVATION_BAD_CONFIG:
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_BAD_CONFIG, data)
         elif status == NetManager.ACTIVATION_NO_SIM:
-            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOSIM)
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOSIM, data)
         elif status == NetManager.ACTIVATION_NO_CONN:
-            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOCONN)
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_NOCONN, data)
             self.net_manager.activation_cleanup()
         elif (
             status == NetManager.ACTIVATION_PENDING or status == NetManager.AP_SCANNING
@@ -330,7 +409,8 @@ class MessageManager:
         else:
             # LTE connect has completed (success or failure); continue provisioning
             self.prov_manager.start_provisioning(
-                convert_dict_keys_values_to_string(self.cur_prov_req_obj["data"])
+                self.cur_prov_req_obj.data,
+                self.get_request_token(self.cur_prov_req_obj),
             )
 
     def send_prov_response(self, status, data=None):
@@ -369,39 +449,30 @@ class MessageManager:
     #
     def handle_net_manager_request(self, msg_type, req_obj):
         self.cur_net_req_obj = req_obj
+        token = self.get_request_token(req_obj)
 
         if self.prov_manager.api_enabled and self.prov_manager.is_provisioned():
             self.send_response(self.cur_net_req_obj, MSG_STATUS_ERR_INVALID)
             return
 
         if msg_type == MSG_ID_GET_APS:
-            self.net_manager.req_get_access_points()
-        elif msg_type == MSG_ID_CONNECT_AP and "data" in req_obj:
-            self.net_manager.req_connect_ap(
-                convert_dict_keys_values_to_string(self.cur_net_req_obj["data"])
-            )
+            self.net_manager.req_get_access_points(req_obj.data, token)
+        elif msg_type == MSG_ID_CONNECT_AP and req_obj.has_data():
+            self.net_manager.req_connect_ap(req_obj.data, token)
         elif msg_type == MSG_ID_CONNECT_LTE:
-            if "data" in req_obj:
-                params = convert_dict_keys_values_to_string(
-                    self.cur_net_req_obj["data"]
-                )
-            else:
-                params = {}
-            self.net_manager.req_connect_lte(params)
-        elif msg_type == MSG_ID_UPDATE_APS and "data" in self.cur_net_req_obj:
-            ret = self.net_manager.req_update_aps(
-                convert_dict_keys_values_to_string(self.cur_net_req_obj["data"])
-            )
-            if ret:
-                self.send_net_response(NetManager.ACTIVATION_SUCCESS)
-            else:
-                self.send_net_response(NetManager.ACTIVATION_FAILED_NETWORK)
+            params = req_obj.data if req_obj.has_data() else {}
+            self.net_manager.req_connect_lte(params, token=token)
+        elif msg_type == MSG_ID_UPDATE_APS and req_obj.has_data():
+            self.net_manager.req_update_aps(req_obj.data, self.send_net_response)
         elif msg_type == MSG_ID_GET_CURRENT_APS:
-            aps = self.net_manager.req_get_aps()
+            aps = self.net_manager.req_get_aps(req_obj.data)
             if aps is not None:
                 self.send_net_response(NetManager.ACTIVATION_SUCCESS, data=aps)
             else:
                 self.send_net_response(NetManager.ACTIVATION_FAILED_NETWORK)
+        elif msg_type == MSG_ID_GET_ACTIVATION_HISTORY:
+            history = self.net_manager.req_get_activation_history()
+            self.send_response(self.cur_net_req_obj, MSG_STATUS_SUCCESS, history)
         elif msg_type == MSG_ID_GET_LTE_INFO:
             lte_info = self.net_manager.req_get_lte_info()
             if lte_info is not None:
@@ -422,28 +493,33 @@ class MessageManager:
         if self.net_manager.api_enabled:
             self.net_manager.stop_scanning()
 
+        if self.prov_manager.api_enabled and self.prov_manager.is_busy():
+            # Don't take over the responses of the provisioning in progress
+            syslog("Provisioning already in progress, rejecting request.")
+            self.send_response(req_obj, MSG_STATUS_ERR_BUSY)
+            return
+
         self.cur_prov_req_obj = req_obj
+        token = self.get_request_token(req_obj)
         if self.prov_manager.api_enabled:
-            if msg_type == MSG_ID_PROVISION_URL and "data" in req_obj:
+            if msg_type == MSG_ID_PROVISION_URL and req_obj.has_data():
                 # If the LTE modem is available and has not been
                 # configured, AND this request has the legacy version (1),
                 # configure the default LTE profile before performing
                 # provisioning via URL; this enables use of the
                 # LTE modem when using the legacy mobile application.
                 if (
-                    req_obj["version"] == 1
+                    req_obj.version == 1
                     and self.net_manager.is_modem_available()
                     and not self.net_manager.is_lte_configured()
                 ):
-                    self.net_manager.req_connect_lte({}, self.lte_autoconnect_status)
-                else:
-                    self.prov_manager.start_provisioning(
-                        convert_dict_keys_values_to_string(req_obj["data"])
+                    self.net_manager.req_connect_lte(
+                        {}, self.lte_autoconnect_status, token
                     )
-            elif msg_type == MSG_ID_PROVISION_EDGE and "data" in req_obj:
-                self.prov_manager.start_provisioning_edge(
-                    convert_dict_keys_values_to_string(req_obj["data"])
-                )
+                else:
+                    self.prov_manager.start_provisioning(req_obj.data, token)
+            elif msg_type == MSG_ID_PROVISION_EDGE and req_obj.has_data():
+                self.prov_manager.start_provisioning_edge(req_obj.data, token)
         else:
             self.send_prov_response(MSG_STATUS_ERR_INVALID, self.cur_prov_req_obj)
 
@@ -460,7 +536,9 @@ class MessageManager:
                 )
             elif msg_type == MSG_ID_EXT_STORAGE_SWAP:
                 self.cur_dev_storageswap_req_obj = req_obj
-                status, storage_data = self.dev_manager.do_storage_swap()
+                status, storage_data = self.dev_manager.do_storage_swap(
+                    self.get_request_token(req_obj)
+                )
                 self.send_response(
                     self.cur_dev_storageswap_req_obj, status, data=storage_data
                 )
@@ -479,35 +557,88 @@ class MessageManager:
 
     def req_update_config(self, req_obj):
         try:
+            # Skip introspection so that obtaining the proxy doesn't block
             updatesvc = dbus.Interface(
-                self.bus.get_object(UPDATE_SVC, UPDATE_PATH), UPDATE_IFACE
+                self.bus.get_object(UPDATE_SVC, UPDATE_PATH, introspect=False),
+                UPDATE_IFACE,
             )
-            ret = int(updatesvc.SetConfiguration(json.dumps(req_obj["data"])))
-            if ret == 0:
-                syslog("Update request success.")
-                self.send_response(req_obj, MSG_STATUS_SUCCESS)
-            else:
-                syslog("Update request failed.")
-                self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
+            if not req_obj.has_data():
+                raise KeyError(MSG_DATA)
+            config = json.dumps(req_obj.data)
         except dbus.DBusException:
             syslog("Failed to connect to the Update service.")
             self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
+            return
         except (KeyError, ValueError, TypeError) as e:
             # Invalid request
             syslog("Invalid update request.")
             self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
-        except:
-            # Hmmm, something else went wrong
-            self.send_response(req_obj, MSG_STATUS_ERR_UNKNOWN)
+            return
+
+        # Update service call is pending
+        token = self.get_request_token(req_obj)
+        self.send_response(req_obj, MSG_STATUS_INTERMEDIATE)
+        call_async(
+            updatesvc.SetConfiguration,
+            config,
+            timeout=token.clamp(UPDATE_CONFIG_CALL_TIMEOUT),
+            reply_cb=lambda ret: self.update_config_reply(req_obj, token, ret),
+            error_cb=lambda e: self.update_config_error(req_obj, token, e),
+        )
+
+    def update_config_reply(self, req_obj, token, ret):
+        if token.cancelled:
+            return
+        if int(ret) == 0:
+            syslog("Update request success.")
+            self.send_response(req_obj, MSG_STATUS_SUCCESS)
+        else:
+            syslog("Update request failed.")
+            self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
+
+    def update_config_error(self, req_obj, token, error):
+        if token.cancelled:
+            return
+        if is_timeout(error):
+            syslog("Update request timed out.")
+            self.send_response(req_obj, MSG_STATUS_ERR_TIMEOUT)
+        else:
+            syslog("Failed to connect to the Update service.")
+            self.send_response(req_obj, MSG_STATUS_ERR_INVALID)
 
     def req_check_update(self, req_obj):
         try:
             updatesvc = dbus.Interface(
-                self.bus.get_object(UPDATE_SVC, UPDATE_PATH), UPDATE_PUBLIC_IFACE
+                self.bus.get_object(UPDATE_SVC, UPDATE_PATH, introspect=False),
+                UPDATE_PUBLIC_IFACE,
             )
-            ret = int(updatesvc.CheckUpdate(False))
-            syslog("Update check status: {}".format(ret))
-            self.send_response(req_obj, MSG_STATUS_SUCCESS, data={"updateStatus": ret})
         except:
             # Hmmm, something went wrong
             self.send_response(req_obj, MSG_STATUS_ERR_UNKNOWN)
+            return
+
+        # The update check may go to the network, respond when it completes
+        token = self.get_request_token(req_obj)
+        self.send_response(req_obj, MSG_STATUS_INTERMEDIATE)
+        call_async(
+            updatesvc.CheckUpdate,
+            False,
+            timeout=token.clamp(CHECK_UPDATE_CALL_TIMEOUT),
+            reply_cb=lambda ret: self.check_update_reply(req_obj, token, ret),
+            error_cb=lambda e: self.check_update_error(req_obj, token, e),
+        )
+
+    def check_update_reply(self, req_obj, token, ret):
+        if token.cancelled:
+            return
+        ret = int(ret)
+        syslog("Update check status: {}".format(ret))
+        self.send_response(req_obj, MSG_STATUS_SUCCESS, data={"updateStatus": ret})
+
+    def check_update_error(self, req_obj, token, error):
+        if token.cancelled:
+            return
+        if is_timeout(error):
+            self.send_response(req_obj, MSG_STATUS_ERR_TIMEOUT)
+        else:
+            self.send_response(req_obj, MSG_STATUS_ERR_UNKNOWN)
@@ -4,8 +4,20 @@ netmngr - Network Manager functionality for the BLE configuration service
 
 import dbus, dbus.exceptions
 from syslog import syslog
-import time
 import os
+import copy
+import hashlib
+import json
+from collections import deque
+
+from .activation import Activation, ACT_RESULT_SUCCESS, ACT_RESULT_TIMEOUT
+from .cancel import CancelToken
+from .conncache import ConnectionCache, get_settings_ssid
+from .aptable import AccessPointTable, config_security
+from . import bulkupdate
+from .scansched import ScanScheduler
+from .reconnect import ReconnectHints, HINT_BSSID
+from .proxypool import get_interface
 
 from gi.repository import GObject as gobject
 
@@ -25,6 +37,39 @@ NM_DEVICE_STATE_ACTIVATED = 100
 NM_DEVICE_STATE_DEACTIVATING = 110
 NM_DEVICE_STATE_FAILED = 120
 
+# Network Manager Device State Reasons, by activation status
+NM_DEVICE_STATE_REASONS_AUTH = (
+    7,  # no-secrets
+    8,  # supplicant-disconnect
+    9,  # supplicant-config-failed
+    10,  # supplicant-failed
+    11,  # supplicant-timeout
+    34,  # gsm-pin-check-failed
+    46,  # gsm-sim-pin-required
+    47,  # gsm-sim-puk-required
+)
+NM_DEVICE_STATE_REASONS_NOT_FOUND = (
+    53,  # ssid-not-found
+    43,  # modem-not-found
+)
+NM_DEVICE_STATE_REASONS_NO_SIM = (
+    45,  # gsm-sim-not-inserted
+    48,  # gsm-sim-wrong
+)
+NM_DEVICE_STATE_REASONS_NETWORK = (
+    5,  # ip-config-unavailable
+    6,  # ip-config-expired
+    15,  # dhcp-start-failed
+    16,  # dhcp-error
+    17,  # dhcp-failed
+    25,  # modem-no-carrier
+    29,  # gsm-apn-failed
+    31,  # gsm-registration-denied
+    32,  # gsm-registration-timeout
+    33,  # gsm-registration-failed
+    40,  # carrier
+)
+
 # Network Manager Connectivity States
 NM_CONNECTIVITY_UNKNOWN = 0
 NM_CONNECTIVITY_NONE = 1
@@ -32,16 +77,6 @@ NM_CONNECTIVITY_PORTAL = 2
 NM_CONNECTIVITY_LIMITED = 3
 NM_CONNECTIVITY_FULL = 4
 
-# Useful Network Manager AP Flags
-NM_802_11_AP_FLAGS_PRIVACY = 0x00000001
-
-# Useful Network Manager AP Security Flags
-NM_802_11_AP_SEC_NONE = 0x00000000
-NM_802_11_AP_SEC_PAIR_WEP40 = 0x00000001
-NM_802_11_AP_SEC_PAIR_WEP104 = 0x00000002
-NM_802_11_AP_SEC_KEY_MGMT_PSK = 0x00000100
-NM_802_11_AP_SEC_KEY_MGMT_802_1X = 0x00000200
-
 NM_IFACE = "org.freedesktop.NetworkManager"
 NM_SETTINGS_IFACE = "org.freedesktop.NetworkManager.Settings"
 NM_SETTINGS_OBJ = "/org/freedesktop/NetworkManager/Settings"
@@ -77,11 +112,19 @@ BYTES_IPV4 = b"ipv4"
 BYTES_IPV6 = b"ipv6"
 BYTES_ROUTE_METRIC = b"route-metric"
 PREFER_LTE = "preferLTE"
-
-GET_AP_INTERMEDIATE_TIMEOUT = 2
-ACTIVATION_INTERMEDIATE_TIMEOUT = 5
-ACTIVATION_FAILURE_TIMEOUT = 120
-ACTIVATION_TIMER_MS = 500
+AP_OPT_MAX_AGE = "maxAge"
+AP_OPT_LIMIT = "limit"
+AP_OPT_SINCE = "since"
+AP_PAGE_SIZE = 5
+
+ACTIVATION_HEARTBEAT_MS = 5000
+# Activation timelines kept for getActivationHistory
+ACTIVATION_HISTORY_LEN = 10
+# The AP of the reconnect hint is preferred over the strongest AP of the
+# SSID unless its strength (%) is lower by more than this
+RECONNECT_HINT_MARGIN = 15
+ACTIVATION_WIFI = "WiFi"
+ACTIVATION_LTE = "LTE"
 
 NM_AUTOCONNECT_PRIORITY = "autoconnect-priority"
 NM_CONNECTION = "connection"
@@ -93,8 +136,27 @@ CFG_SSID = "ssid"
 
 AUTOCONF_LTE = "/etc/autoconf_lte"
 
+# Saved profile sync (getAPS/updateAPS)
+SYNC_HASH = "hash"
+SYNC_PROFILES = "profiles"
+SYNC_CHANGED = "changed"
+SYNC_REMOVED = "removed"
+PROFILE_HASH_LEN = 16
+
+
+def profile_hash(config):
+    """Hash of a saved profile, as reported by getAPS (compact sorted JSON)"""
+    data = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()[:PROFILE_HASH_LEN]
+
+
+def profile_set_hash(hashes):
+    """Hash of a set of saved profiles, from the profile hashes"""
+    data = ",".join(sorted(hashes))
+    return hashlib.sha256(data.encode()).hexdigest()[:PROFILE_HASH_LEN]
 
-def create_wireless_config(wlan_mac_addr, config_data):
+
+def create_wireless_config(wlan_mac_addr, config_data, hidden=True):
     """
     Create a NetworkManager wireless configuration from
     the BLE input configuration data
@@ -125,7 +187,7 @@ def create_wireless_config(wlan_mac_addr, config_data):
                         dbus.String("ssid"): dbus.ByteArray(
                             config_data["ssid"].encode()
                         ),
-                        dbus.String("hidden"): True,
+                        dbus.String("hidden"): hidden,
                     }
                 ),
             }
@@ -219,6 +281,12 @@ def update_wireless_config(orig_config, new_config):
             "autoconnect-priority"
         ]
 
+    # Hidden is set from the scan results, take it from the new configuration
+    if "802-11-wireless" in new_config and "hidden" in new_config["802-11-wireless"]:
+        orig_config.setdefault("802-11-wireless", {})["hidden"] = new_config[
+            "802-11-wireless"
+        ]["hidden"]
+
     # Merge IPv6 settings from new configuration
     if "ipv6" in new_config:
         orig_config["ipv6"].update(new_config["ipv6"])
@@ -295,6 +363,8 @@ class NetManager:
     ACTIVATION_INVALID = -1
     ACTIVATION_FAILED_AUTH = -3
     ACTIVATION_FAILED_NETWORK = -2
+    ACTIVATION_NOT_FOUND = -4
+    ACTIVATION_BAD_CONFIG = -9
     ACTIVATION_NO_CONN = -5
     ACTIVATION_NO_SIM = -8
 
@@ -304,6 +374,10 @@ class NetManager:
     def __init__(self, response_cb):
         try:
             self.api_enabled = False
+            self.activation_token = CancelToken()
+            # Token whose cancellation is already watched
+            self.watched_token = None
+            self.scan_token = CancelToken()
             self.bus = dbus.SystemBus()
             self.nm = dbus.Interface(self.bus.get_object(NM_IFACE, NM_OBJ), NM_IFACE)
             self.nm_props = dbus.Interface(
@@ -312,18 +386,38 @@ class NetManager:
             self.nm_settings = dbus.Interface(
                 self.bus.get_object(NM_IFACE, NM_SETTINGS_OBJ), NM_SETTINGS_IFACE
             )
+            self.conn_cache = ConnectionCache(
+                self.bus, self.nm_settings, self.connection_removed
+            )
             self.wifi_dev_obj = self.bus.get_object(
                 NM_IFACE, self.nm.GetDeviceByIpIface("wlan0")
             )
             self.wifi_dev = dbus.Interface(self.wifi_dev_obj, NM_WIFI_DEVICE_IFACE)
             self.wifi_dev_props = dbus.Interface(self.wifi_dev_obj, DBUS_PROP_IFACE)
-            self.ap_objs = None
-            self.in_full_scan = False
-            self.ap_scan_pending = True
+            self.ap_table = AccessPointTable(self.bus, self.wifi_dev, self.ap_added)
+            self.ap_scanning = False
+            self.ap_options = None
+            self.ap_streaming = False
+            self.ap_tx_busy = False
+            self.ap_queue = []
+            self.ap_sent = {}
+            self.scan_sched = ScanScheduler(
+                self.wifi_dev, self.wifi_dev_props, self.ap_table, self.ap_scan_complete
+            )
+            self.ap_scan_pending = False
+            self.reconnect_hints = ReconnectHints()
+            self.activation_hinted = False
             self.new_conn_obj = None
             self.connectivity = self.nm_props.Get(NM_IFACE, "Connectivity")
-            self.activated = False
-            self.activation_status = None
+            self.activation = None
+            self.activation_history = deque(maxlen=ACTIVATION_HISTORY_LEN)
+            self.candidates = []
+            self.candidate = None
+            self.activation_heartbeat_ms = ACTIVATION_HEARTBEAT_MS
+            try:
+                self.wwan_dev_path = self.nm.GetDeviceByIpIface(WWAN_DEV_NAME)
+            except dbus.exceptions.DBusException:
+                self.wwan_dev_path = None
             self.wifi_dev_props.connect_to_signal(
                 "PropertiesChanged", self.wifi_dev_props_changed
             )
@@ -357,84 +451,32 @@ class NetManager:
         return eth0_addr
 
     def find_conn_by_id(self, conn_id):
-        conns = self.nm_settings.ListConnections()
-        for c_path in conns:
-            c = dbus.Interface(
-                self.bus.get_object(NM_IFACE, c_path),
-                "org.freedesktop.NetworkManager.Settings.Connection",
-            )
-            if c.GetSettings()["connection"]["id"] == conn_id:
-                return c
-        return None
+        c_path = self.conn_cache.find_path_by_id(conn_id)
+        if c_path is None:
+            return None
+        return get_interface(NM_IFACE, c_path, NM_CONNECTION_IFACE)
 
     def find_conn_path_by_id(self, conn_id):
-        conns = self.nm_settings.ListConnections()
-        for c_path in conns:
-            c = dbus.Interface(
-                self.bus.get_object(NM_IFACE, c_path),
-                "org.freedesktop.NetworkManager.Settings.Connection",
-            )
-            if c.GetSettings()["connection"]["id"] == conn_id:
-                return c_path
-        return None
+        return self.conn_cache.find_path_by_id(conn_id)
 
     def start_ap_scan(self):
         """Start a WiFi scan, include all APs"""
-        syslog("Starting full AP scan...")
-        try:
-            self.wifi_dev.RequestScan({"ssids": [dbus.ByteArray("".encode())]})
-            self.in_full_scan = True
-        except dbus.exceptions.DBusException as e:
-            # Can fail if a scan was just performed, ignore
-            syslog("Attempt to start AP scan failed: {}".format(e))
-
-    def get_access_points(self, timeout=None, continue_scan=False):
-        """Scan for access points"""
-        if not continue_scan:
-            syslog("Obtaining access point list.")
-            self.ap_objs = self.wifi_dev.GetAllAccessPoints()
-        # NOTE: NetworkManager frequently returns multiple APs for the same SSID,
-        # so keep them unique using a dictionary
-        ap_dict = {}
-        start_time = time.time()
-        # Collect APs until the list is emptied, or a timeout
-        syslog("Collecting APs with timeout = {}".format(timeout))
-        while (
-            self.ap_objs
-            and len(self.ap_objs) > 0
-            and (not timeout or time.time() - start_time < timeout)
-        ):
-            ap_obj = self.ap_objs.pop(0)
-            try:
-                ap_props = dbus.Interface(
-                    self.bus.get_object(NM_IFACE, ap_obj), DBUS_PROP_IFACE
-                )
-                # Properly decode UTF-8 bytes into a string (Unicode)
-                ssid = bytearray(ap_props.Get(NM_AP_IFACE, "Ssid")).decode("utf-8")
-                ap_dict.setdefault(ssid, {})["ssid"] = ssid
-                ap_dict[ssid]["ssid"] = ssid
-                ap_dict[ssid]["strength"] = int(ap_props.Get(NM_AP_IFACE, "Strength"))
-                ap_flags = int(ap_props.Get(NM_AP_IFACE, "Flags"))
-                ap_wpa_flags = int(ap_props.Get(NM_AP_IFACE, "WpaFlags"))
-                ap_rsn_flags = int(ap_props.Get(NM_AP_IFACE, "RsnFlags"))
-                ap_dict[ssid]["wep"] = (
-                    (ap_flags & NM_802_11_AP_FLAGS_PRIVACY > 0)
-                    and (ap_wpa_flags == NM_802_11_AP_SEC_NONE)
-                    and (ap_rsn_flags == NM_802_11_AP_SEC_NONE)
-                )
-                ap_dict[ssid]["psk"] = (
-                    ap_wpa_flags & NM_802_11_AP_SEC_KEY_MGMT_PSK > 0
-                ) or (ap_rsn_flags & NM_802_11_AP_SEC_KEY_MGMT_PSK > 0)
-                ap_dict[ssid]["eap"] = (
-                    ap_wpa_flags & NM_802_11_AP_SEC_KEY_MGMT_802_1X > 0
-                ) or (ap_rsn_flags & NM_802_11_AP_SEC_KEY_MGMT_802_1X > 0)
-            except dbus.exceptions.DBusException:
-                # Can occur as APs are removed, just move on to the next AP
-                pass
-        return list(ap_dict.values())
+        return self.scan_sched.scan_now()
+
+    def start_background_scan(self):
+        """Keep the AP list fresh while the BLE service is active"""
+        if self.api_enabled:
+            self.scan_sched.start()
+
+    def stop_background_scan(self):
+        if self.api_enabled:
+            self.scan_sched.stop()
 
-    def activate_connection(self, config_data):
-        self.activation_status = self.ACTIVATION_PENDING
+    def get_access_points(self, options=None):
+        """Get the access point list from the AP table"""
+        return self.ap_table.get_access_points(options)
+
+    def activate_connection(self, config_data, ap_path="/", hidden=True, cb=None):
         try:
             mac = self.get_wlan_hw_address()
             if mac:
@@ -444,159 +486,314 @@ class NetManager:
 
             priority = self.get_highest_priority() + 1
             config_data[CFG_PRIORITY] = priority
-            conn = create_wireless_config(wlan_mac_addr, config_data)
+            conn = create_wireless_config(wlan_mac_addr, config_data, hidden)
             ret, conn = self.add_or_modify_connection(conn)
-            if ret:
-                self.new_conn_obj = conn
-                self.nm.ActivateConnection(self.new_conn_obj, self.wifi_dev_obj, "/")
+            if not ret:
+                return False
+            self.new_conn_obj = conn
+            ap_path = self.reconnect_ap(config_data[CFG_SSID], ap_path)
+            self.start_activation(ACTIVATION_WIFI, cb or self.response_cb)
+            self.activation.watch_device(self.wifi_dev_obj.object_path)
+            active_conn = self.nm.ActivateConnection(
+                self.new_conn_obj, self.wifi_dev_obj, ap_path
+            )
+            self.activation.watch_active(active_conn)
             return True
         except dbus.exceptions.DBusException as e:
             syslog("Failed to create connection: {}".format(e))
             return False
 
+    def reconnect_ap(self, ssid, ap_path):
+        """
+        Use the reconnect hint of a profile: pick the last good AP if it is
+        in the scan results and about as strong as the chosen one, or probe
+        for the SSID if it isn't seen at all
+        """
+        hint = self.reconnect_hints.get(ssid)
+        self.activation_hinted = False
+        if hint is None:
+            return ap_path
+        hint_path = self.ap_table.find_bssid(ssid, hint[HINT_BSSID])
+        if hint_path is not None:
+            hint_strength = self.ap_table.aps[hint_path].get("strength", 0)
+            best = self.ap_table.aps.get(str(ap_path), {})
+            if hint_strength + RECONNECT_HINT_MARGIN < best.get("strength", 0):
+                syslog(
+                    "Not reconnecting {} to {}, {} is stronger.".format(
+                        ssid, hint[HINT_BSSID], best.get("bssid")
+                    )
+                )
+                return ap_path
+            syslog("Reconnecting {} to {}.".format(ssid, hint[HINT_BSSID]))
+            self.activation_hinted = True
+            return hint_path
+        # Only a directed scan narrows the search; a full scan already
+        # running is left to complete
+        if ap_path == "/" and not self.scan_sched.scanning:
+            self.activation_hinted = self.scan_sched.scan_now(ssid)
+        return ap_path
+
+    def connection_removed(self, path, settings):
+        """Forget the reconnect hint of an SSID once its last profile is gone"""
+        ssid = get_settings_ssid(settings)
+        if ssid is not None and not self.conn_cache.find_paths_by_ssid(ssid):
+            self.reconnect_hints.remove(ssid)
+
+    def wifi_connected(self, activation):
+        """Record the reconnect hint and time-to-connect of an activation"""
+        try:
+            ap_path = self.wifi_dev_props.Get(NM_WIFI_DEVICE_IFACE, "ActiveAccessPoint")
+        except dbus.exceptions.DBusException:
+            return
+        ap = self.ap_table.aps.get(str(ap_path))
+        if ap is None or "ssid" not in ap or "bssid" not in ap:
+            return
+        self.reconnect_hints.record(ap["ssid"], ap["bssid"], ap.get("frequency"))
+        self.reconnect_hints.connected(self.activation_hinted, activation.elapsed_ms())
+
     def wifi_dev_props_changed(self, iface, props_changed, props_invalidated):
         """Signal callback for change to the wlan0 device properties"""
         if props_changed:
-            if "State" in props_changed:
-                syslog("WiFi state changed: {}".format(props_changed["State"]))
-                if props_changed["State"] == NM_DEVICE_STATE_ACTIVATED:
-                    # Make sure this is our connection
-                    active_conn_obj = self.wifi_dev_props.Get(
-                        NM_DEVICE_IFACE, "ActiveConnection"
-                    )
-                    active_conn_props = dbus.Interface(
-                        self.bus.get_object(NM_IFACE, active_conn_obj), DBUS_PROP_IFACE
-                    )
-                    conn_obj = active_conn_props.Get(
-                        NM_CONNECTION_ACTIVE_IFACE, "Connection"
-                    )
-                    if conn_obj == self.new_conn_obj:
-                        self.activated = True
-                        syslog("New connection was activated!")
-                        if self.connectivity == NM_CONNECTIVITY_FULL:
-                            self.activation_status = self.ACTIVATION_SUCCESS
-                elif props_changed["State"] == NM_DEVICE_STATE_FAILED:
-                    self.activation_status = self.ACTIVATION_FAILED_AUTH
             if "LastScan" in props_changed:
-                if self.in_full_scan:
-                    self.in_full_scan = False
-                    syslog("Full AP scan complete.")
-                    if self.ap_scan_pending:
-                        # Start reading AP list, now that scan is complete
-                        self.ap_scan_pending = False
-                        self.ap_scan_tx_complete()
+                self.scan_sched.last_scan_changed(props_changed["LastScan"])
+
+    def ap_scan_complete(self):
+        """Scan scheduler callback for full AP scan complete"""
+        if self.ap_scan_pending:
+            self.ap_scan_pending = False
+            if self.ap_streaming:
+                # Send the reconciliation page once the stream is drained
+                self.continue_ap_stream()
+            else:
+                # Send the AP list, now that scan is complete
+                self.ap_scan_tx_complete()
 
     def nm_props_changed(self, iface, props_changed, props_invalidated):
         """Signal callback for change to Network Manager properties"""
         if props_changed and "Connectivity" in props_changed:
             self.connectivity = props_changed["Connectivity"]
             syslog("Connectivity changed: {}".format(self.connectivity))
-            if self.activated:
-                self.activation_status = self.ACTIVATION_SUCCESS
+            if self.activation is not None:
+                self.activation.connectivity_changed(self.connectivity)
 
     def nm_device_added(self, dev_path):
-        dev_props = dbus.Interface(
-            self.bus.get_object(NM_IFACE, dev_path), DBUS_PROP_IFACE
-        )
+        dev_props = get_interface(NM_IFACE, dev_path, DBUS_PROP_IFACE)
         interface = dev_props.Get(NM_DEVICE_IFACE, "Interface")
         if interface == WWAN_DEV_NAME:
             syslog("Device {} connected.".format(interface))
-            # Request property changes on WWAN interface
-            dev_props.connect_to_signal(
-                "PropertiesChanged", self.wwan_dev_props_changed
-            )
+            self.wwan_dev_path = dev_path
+            if self.activation is not None and self.activation.name == ACTIVATION_LTE:
+                self.activation.watch_device(dev_path)
+
+    def start_activation(self, name, cb):
+        """Track a new connection activation, reporting through cb"""
+        if self.activation is not None:
+            self.activation.cancel()
+        self.activation = Activation(
+            self.bus,
+            name,
+            self.activation_token,
+            self.connectivity,
+            lambda: cb(self.ACTIVATION_PENDING),
+            lambda result, reason: self.activation_done(cb, result, reason),
+            self.activation_heartbeat_ms,
+        )
+        # Activations of several candidates share the request token, the
+        # cancellation must only be handled once
+        if self.watched_token is not self.activation_token:
+            self.watched_token = self.activation_token
+            self.activation_token.on_cancel(self.activation_cancelled)
+
+    def activation_done(self, cb, result, reason):
+        activation, self.activation = self.activation, None
+        self.activation_history.append(activation.timeline())
+        data = {"timeline": activation.summary()}
+        if result == ACT_RESULT_SUCCESS:
+            if activation.name == ACTIVATION_WIFI:
+                self.wifi_connected(activation)
+            cb(self.ACTIVATION_SUCCESS, data)
+            return
+        if result == ACT_RESULT_TIMEOUT:
+            # Failed to activate before timeout
+            status = self.ACTIVATION_NO_CONN
+        else:
+            status = self.activation_failure_status(reason)
+            syslog("Activation failed, reason {} (status {}).".format(reason, status))
+        # Don't leave NetworkManager retrying in the background
+        self.deactivate(activation)
+        cb(status, data)
+        self.activation_cleanup()
+
+    def deactivate(self, activation):
+        if activation is None or activation.active_path is None:
+            return
+        try:
+            self.nm.DeactivateConnection(activation.active_path)
+        except dbus.exceptions.DBusException:
+            # Already deactivated
+            pass
 
-    def get_activation_status(self):
-        return self.activation_status
+    def activation_failure_status(self, reason):
+        """Map the NM device state reason of a failed activation to a status"""
+        if reason in NM_DEVICE_STATE_REASONS_NOT_FOUND:
+            return self.ACTIVATION_NOT_FOUND
+        elif reason in NM_DEVICE_STATE_REASONS_NO_SIM:
+            return self.ACTIVATION_NO_SIM
+        elif reason in NM_DEVICE_STATE_REASONS_NETWORK:
+            return self.ACTIVATION_FAILED_NETWORK
+        # Authentication failures, and any other reason, as before
+        return self.ACTIVATION_FAILED_AUTH
 
     def activation_cleanup(self):
+        if self.activation is not None:
+            self.activation.cancel()
+            self.activation = None
         if self.new_conn_obj:
             syslog("Removing connection: {}".format(self.new_conn_obj))
-            conn = dbus.Interface(
-                self.bus.get_object(NM_IFACE, self.new_conn_obj), NM_CONNECTION_IFACE
-            )
+            conn = get_interface(NM_IFACE, self.new_conn_obj, NM_CONNECTION_IFACE)
             self.new_conn_obj = None
-            self.activated = False
-            self.activation_status = None
 
     def stop_scanning(self):
         self.ap_scanning = False
+        self.scan_token.finish()
+
+    def scan_cancelled(self, reason):
+        syslog("AP scan cancelled ({}).".format(reason))
+        self.ap_scanning = False
 
-    # NOTE: For some reason, using the NetworkManager API to query each
-    #      AP object is very slow, so we process the AP list
-    #      in batches and send them to the client.  Also, reading the APs
-    #      causes the Tx on the BLE GATT characteristic to slow down,
-    #      which leads to long delays (timeouts) for the client.  So,
-    #      the code below implements a callback when the BLE Tx is
-    #      complete.  Thus we only process the AP list after the last
-    #      message was sent, then send the message once we've processed
-    #      the AP list; this ends up being more responsive to the client.
+    def activation_cancelled(self, reason):
+        syslog("Activation cancelled ({}).".format(reason))
+        self.candidates = []
+        self.activation_cleanup()
 
     def ap_scan_tx_complete(self):
-        """Callback for AP scan list TX complete"""
+        """Callback for AP scan TX complete"""
         # Only continue if scanning was not cancelled
         if self.ap_scanning:
-            # Schedule call on main loop to process more results
-            gobject.timeout_add(0, self.get_ap_cb)
+            # Schedule call on main loop to send the AP list
+            self.scan_token.timeout_add(0, self.send_ap_list)
 
-    def get_ap_cb(self):
-        """Timer callback to process AP list"""
-        aplist = self.get_access_points(
-            GET_AP_INTERMEDIATE_TIMEOUT, not self.ap_first_scan
-        )
-        self.ap_first_scan = False
+    def send_ap_list(self):
+        """Timer callback to send the AP list, served from the AP table"""
         # Only continue if scanning was not cancelled
         if self.ap_scanning:
-            if aplist and len(aplist) > 0:
-                # Send response with TX complete callback to get more
-                syslog("Sending intermediate list of {} APs.".format(len(aplist)))
-                self.response_cb(
-                    self.AP_SCANNING, data=aplist, tx_complete=self.ap_scan_tx_complete
+            options = self.ap_options or {}
+            if AP_OPT_SINCE in options:
+                aplist = self.ap_table.get_access_points_since(
+                    options[AP_OPT_SINCE], options
                 )
+                syslog("Sending AP list generation {}.".format(aplist["generation"]))
             else:
-                # Send final response
-                syslog("Sending final AP response")
-                self.response_cb(self.AP_SCANNING_SUCCESS)
-                self.ap_scanning = False
-                return False
+                aplist = self.get_access_points(options)
+                syslog("Sending list of {} APs.".format(len(aplist)))
+            self.ap_scanning = False
+            self.response_cb(self.AP_SCANNING_SUCCESS, data=aplist)
+        return False
 
-    def req_get_access_points(self):
+    def req_get_access_points(self, options=None, token=None):
         """Handle Get Access Points request"""
-        self.ap_first_scan = True
+        options = options or {}
+        self.ap_options = options
+        self.scan_token = token or CancelToken()
+        self.scan_token.on_cancel(self.scan_cancelled)
         self.ap_scanning = True
-        if self.in_full_scan:
-            # Need to wait for the AP scan to complete until sending the list,
-            # just send an intermediate response until scan is complete
+        max_age = options.get(AP_OPT_MAX_AGE)
+        if (
+            max_age is not None
+            and not self.scan_sched.is_fresh(max_age)
+            and self.start_ap_scan()
+        ):
+            # The cached list is older than the client allows, so rescan
+            syslog("AP list is {} ms old, rescanning.".format(self.scan_sched.age_ms()))
             self.ap_scan_pending = True
-            self.response_cb(self.AP_SCANNING)
+            if AP_OPT_LIMIT in options or AP_OPT_SINCE in options:
+                # The top-K or a delta can only be built once the scan is
+                # complete, send an intermediate response until then
+                self.ap_streaming = False
+                self.response_cb(self.AP_SCANNING)
+            else:
+                self.start_ap_stream()
         else:
-            # Send response indicating request in progress, with TX complete callback to scan
-            self.response_cb(self.AP_SCANNING, tx_complete=self.ap_scan_tx_complete)
-
-    def check_activation(self, cb):
-        status = self.get_activation_status()
-        if status == self.ACTIVATION_SUCCESS:
-            cb(status)
-            return False  # Exit timer
-        elif status == self.ACTIVATION_FAILED_AUTH:
-            cb(status)
-            self.activation_cleanup()
-            return False  # Exit timer
-        elif status == self.ACTIVATION_FAILED_NETWORK:
-            cb(status)
-            self.activation_cleanup()
-            return False  # Exit timer
-        if time.time() - self.activation_start_time > ACTIVATION_FAILURE_TIMEOUT:
-            # Failed to activate before timeout, send failure and exit timer
-            cb(self.ACTIVATION_NO_CONN)
-            self.activation_cleanup()
-            return False
-        elif time.time() - self.activation_msg_time > ACTIVATION_INTERMEDIATE_TIMEOUT:
-            # Still waiting for activation, send intermediate response
-            cb(self.ACTIVATION_PENDING)
-            self.activation_msg_time = time.time()
+            # Serve the cached list immediately
+            self.ap_streaming = False
+            self.send_ap_list()
+
+    #
+    # AP streaming during a scan: APs are sent in small pages of SSIDs not
+    # sent yet, starting with those already known and followed by those
+    # reported by AccessPointAdded.  Only one page is in flight at a time,
+    # the next is sent when the BLE Tx of the last completes.  Once the
+    # scan is complete, a final reconciliation page carries the SSIDs whose
+    # strength changed since they were sent, and those that were removed.
+    #
+    def start_ap_stream(self):
+        self.ap_streaming = True
+        self.ap_tx_busy = False
+        self.ap_sent = {}
+        self.ap_queue = [entry["ssid"] for entry in self.get_access_points()]
+        # Always send a first (possibly empty) page to acknowledge the request
+        self.send_ap_page()
+
+    def ap_added(self, ssid):
+        """AP table callback for a new AP"""
+        if not (self.ap_scanning and self.ap_streaming) or ssid in self.ap_sent:
+            return
+        if ssid not in self.ap_queue:
+            self.ap_queue.append(ssid)
+        self.continue_ap_stream()
 
-        return True
+    def continue_ap_stream(self):
+        if self.ap_tx_busy or not self.ap_scanning:
+            return
+        if self.ap_queue:
+            self.send_ap_page()
+        elif not self.ap_scan_pending:
+            self.send_ap_reconcile()
+
+    def send_ap_page(self):
+        entries = {e["ssid"]: e for e in self.get_access_points(self.ap_options)}
+        page = []
+        while self.ap_queue and len(page) < AP_PAGE_SIZE:
+            entry = entries.get(self.ap_queue.pop(0))
+            # Entries may have been removed or filtered out meanwhile
+            if entry is not None and entry["ssid"] not in self.ap_sent:
+                self.ap_sent[entry["ssid"]] = entry["strength"]
+                page.append(entry)
+        self.ap_tx_busy = True
+        self.response_cb(
+            self.AP_SCANNING, data=page, tx_complete=self.ap_page_tx_complete
+        )
+
+    def ap_page_tx_complete(self):
+        """Callback for AP page TX complete"""
+        # Schedule call on main loop to send the next page
+        self.scan_token.timeout_add(0, self.ap_page_sent)
+
+    def ap_page_sent(self):
+        self.ap_tx_busy = False
+        self.continue_ap_stream()
+        return False
+
+    def send_ap_reconcile(self):
+        entries = {e["ssid"]: e for e in self.get_access_points(self.ap_options)}
+        page = [
+            entry
+            for ssid, entry in entries.items()
+            if self.ap_sent.get(ssid) != entry["strength"]
+        ]
+        page.extend(
+            {"ssid": ssid, "removed": True}
+            for ssid in self.ap_sent
+            if ssid not in entries
+        )
+        syslog(
+            "Sent {} APs during scan, reconciling {}.".format(
+                len(self.ap_sent), len(page)
+            )
+        )
+        self.ap_scanning = False
+        self.ap_streaming = False
+        self.response_cb(self.AP_SCANNING_SUCCESS, data=page)
 
     def get_config_from_nm_config(self, nm_config):
         config = {}
@@ -633,40 +830,67 @@ class NetManager:
 
         return config
 
-    def req_get_aps(self):
+    def req_get_aps(self, sync=None):
+        """
+        Get the saved Wi-Fi profiles.  With sync data, the client's set hash
+        (and optionally its per-SSID profile hashes) is compared, and only
+        what differs is returned, each profile with its hash.
+        """
         configs = []
-        try:
-            conns = self.nm_settings.ListConnections()
-            for c_path in conns:
-                c = dbus.Interface(
-                    self.bus.get_object(NM_IFACE, c_path),
-                    "org.freedesktop.NetworkManager.Settings.Connection",
-                )
-                config = c.GetSettings()
-                if config["connection"]["type"] == "802-11-wireless":
-                    config = self.get_config_from_nm_config(config)
-                    if config is not None:
-                        configs.append(config)
-        except dbus.DBusException:
-            return None
+        for c_path, nm_config in self.conn_cache.connections("802-11-wireless"):
+            config = self.get_config_from_nm_config(nm_config)
+            if config is not None:
+                configs.append(config)
+
+        if sync is None:
+            return configs
+        for config in configs:
+            config[SYNC_HASH] = profile_hash(config)
+        set_hash = profile_set_hash(config[SYNC_HASH] for config in configs)
+        if sync.get(SYNC_HASH) == set_hash:
+            return {SYNC_HASH: set_hash, "unchanged": True}
+        client = sync.get(SYNC_PROFILES)
+        if client is None:
+            return {SYNC_HASH: set_hash, "aps": configs}
+        ssids = set(config[CFG_SSID] for config in configs)
+        return {
+            SYNC_HASH: set_hash,
+            SYNC_CHANGED: [
+                config
+                for config in configs
+                if client.get(config[CFG_SSID]) != config[SYNC_HASH]
+            ],
+            SYNC_REMOVED: [ssid for ssid in client if ssid not in ssids],
+        }
 
-        return configs
+    def get_profile_set_hash(self):
+        return profile_set_hash(
+            profile_hash(config) for config in self.req_get_aps()
+        )
 
-    def req_connect_ap(self, data):
+    def req_connect_ap(self, data, token=None):
         """Handle Connect to AP message"""
+        self.activation_token = token or CancelToken()
         try:
             # Cancel AP scan if in progress
-            self.ap_scanning = False
-            # Issue request to Network Manager
-            if self.activate_connection(data):
+            self.stop_scanning()
+            if isinstance(data, list):
+                self.connect_candidates(data)
+                return
+            # Check the request against the scan results
+            security = config_security(data)
+            broadcast, ap_path = self.ap_table.select_ap(data["ssid"], security)
+            if broadcast and ap_path is None:
+                syslog(
+                    "No AP for {} supports {} security.".format(data["ssid"], security)
+                )
+                self.response_cb(self.ACTIVATION_BAD_CONFIG)
+                return
+            # Issue request to Network Manager; only a non-broadcast SSID needs
+            # to be hidden (probed for), otherwise start with the strongest AP
+            if self.activate_connection(data, ap_path or "/", not broadcast):
                 # Config succeeded, connection in progress
                 self.response_cb(self.ACTIVATION_PENDING)
-                # Set timer task to check connectivity
-                self.activation_start_time = time.time()
-                self.activation_msg_time = self.activation_start_time
-                gobject.timeout_add(
-                    ACTIVATION_TIMER_MS, self.check_activation, self.response_cb
-                )
             else:
                 # Failed to create connection from configuration
                 self.activation_cleanup()
@@ -674,31 +898,124 @@ class NetManager:
         except Exception as e:
             syslog("Failed to connect ap: '%s'" % str(e))
 
-    def get_highest_priority(self):
-        priority = 0
-
-        conns = self.nm_settings.ListConnections()
-        for c_path in conns:
-            c = dbus.Interface(
-                self.bus.get_object(NM_IFACE, c_path), NM_CONNECTION_IFACE
-            )
-            conn = c.GetSettings()
+    #
+    # Multi-candidate connectAP: the candidate configs are ranked against
+    # the AP table, the visible ones by strength ahead of those not seen
+    # (possibly hidden), keeping the client's order otherwise.  They are
+    # tried one at a time, moving on when an activation fails or times out.
+    # The profile of each failed candidate is put back as it was (settings
+    # and secrets), or deleted if it was added for the attempt.
+    #
+    def rank_candidates(self, configs):
+        visible = []
+        unseen = []
+        for index, config in enumerate(configs):
+            security = config_security(config)
+            broadcast, ap_path = self.ap_table.select_ap(config[CFG_SSID], security)
+            if not broadcast:
+                unseen.append((index, config, "/", True))
+            elif ap_path is not None:
+                visible.append((index, config, ap_path, False))
+            else:
+                syslog(
+                    "Skipping {}, no AP supports {} security.".format(
+                        config[CFG_SSID], security
+                    )
+                )
+        visible.sort(key=lambda c: -self.ap_table.aps[c[2]].get("strength", 0))
+        return visible + unseen
 
-            if "autoconnect-priority" in conn["connection"]:
-                if conn["connection"]["autoconnect-priority"] > priority:
-                    priority = conn["connection"]["autoconnect-priority"]
+    def connect_candidates(self, configs):
+        self.candidates = self.rank_candidates(configs)
+        if not self.candidates:
+            self.response_cb(self.ACTIVATION_BAD_CONFIG)
+            return
+        self.next_candidate()
+
+    def next_candidate(self, status=None, data=None):
+        """Activate the next candidate; status is that of the last failure"""
+        while self.candidates:
+            index, config, ap_path, hidden = self.candidates.pop(0)
+            saved = self.save_profile(config[CFG_SSID])
+            self.candidate = (index, config, hidden, saved)
+            syslog("Trying candidate {}: {}".format(index, config[CFG_SSID]))
+            if self.activate_connection(config, ap_path, hidden, self.candidate_cb):
+                self.candidate_cb(self.ACTIVATION_PENDING)
+                return False
+            self.activation_cleanup()
+            self.restore_candidate()
+            status, data = self.ACTIVATION_NO_CONN, None
+        self.candidate = None
+        self.response_cb(status or self.ACTIVATION_NO_CONN, data=data)
+        return False
+
+    def candidate_cb(self, status, data=None):
+        index, config, hidden, saved = self.candidate
+        if status == self.ACTIVATION_PENDING:
+            self.response_cb(status, data={"index": index, CFG_SSID: config[CFG_SSID]})
+        elif status == self.ACTIVATION_SUCCESS:
+            self.candidates = []
+            self.candidate = None
+            data = dict(data or {}, index=index)
+            data[CFG_SSID] = config[CFG_SSID]
+            self.response_cb(status, data=data)
+        else:
+            syslog("Candidate {} failed (status {}).".format(index, status))
+            self.restore_candidate()
+            # Continue once the failed activation is cleaned up
+            self.activation_token.timeout_add(0, self.next_candidate, status, data)
+
+    def save_profile(self, ssid):
+        """
+        Snapshot the profile for an SSID with its secrets, as (path,
+        settings), or None if there is no such profile
+        """
+        path = self.find_conn_path_by_id(ssid)
+        if path is None:
+            return None
+        settings = copy.deepcopy(self.conn_cache.get_settings(path))
+        conn = get_interface(NM_IFACE, path, NM_CONNECTION_IFACE)
+        for setting in bulkupdate.SECRET_SETTINGS:
+            if setting not in settings:
+                continue
+            try:
+                for name, values in conn.GetSecrets(setting).items():
+                    settings.setdefault(name, {}).update(values)
+            except dbus.exceptions.DBusException as e:
+                # Secrets may be agent owned, restore what is known
+                syslog("Failed to read {} secrets: {}".format(setting, e))
+        return path, settings
+
+    def restore_candidate(self):
+        """Put a failed candidate's profile back as it was before the attempt"""
+        index, config, hidden, saved = self.candidate
+        if saved is None:
+            # The profile was added for this attempt
+            self.remove_connection(config[CFG_SSID])
+            return
+        path, settings = saved
+        try:
+            conn = get_interface(NM_IFACE, path, NM_CONNECTION_IFACE)
+            conn.Update(settings)
+            # Read back, as the saved settings hold secrets
+            self.conn_cache.refresh(path)
+        except dbus.exceptions.DBusException as e:
+            syslog("Failed to restore connection {}: {}".format(path, e))
 
-        return priority
+    def get_highest_priority(self):
+        return self.conn_cache.highest_priority()
 
     def remove_connection(self, id):
         try:
-            conn = self.find_conn_by_id(id)
-            if conn == None:
+            c_path = self.find_conn_path_by_id(id)
+            if c_path == None:
                 return False
-            if "Wired connection" in conn.GetSettings()["connection"]["id"]:
+            if "Wired connection" in str(id):
                 syslog("Failed to delete wired connection")
                 return False
+            conn = get_interface(NM_IFACE, c_path, NM_CONNECTION_IFACE)
             conn.Delete()
+            self.conn_cache.remove(c_path)
         except dbus.exceptions.DBusException as e:
             syslog("Failed to delete connection: {}".format(e))
             return False
@@ -709,27 +1026,95 @@ class NetManager:
         try:
             conn = self.find_conn_path_by_id(config[NM_CONNECTION][NM_ID].decode())
             if conn != None:
-                conn_iface = dbus.Interface(
-                    self.bus.get_object(NM_IFACE, conn),
-                    "org.freedesktop.NetworkManager.Settings.Connection",
-                )
-                cur = conn_iface.GetSettings()
+                conn_iface = get_interface(NM_IFACE, conn, NM_CONNECTION_IFACE)
+                # The cached settings are shared, work on a copy
+                cur = copy.deepcopy(self.conn_cache.get_settings(conn))
                 updated = update_wireless_config(cur, config)
                 config[NM_CONNECTION][NM_UUID] = cur["connection"]["uuid"]
                 conn_iface.Update(updated)
+                self.conn_cache.update(conn, updated)
             else:
                 syslog(
                     "Adding wireless config for SSID: "
                     + config["connection"]["id"].decode("utf-8")
                 )
                 conn = self.nm_settings.AddConnection(config)
+                self.conn_cache.refresh(conn)
         except dbus.exceptions.DBusException as e:
             syslog("Failed to add or modify connection: {}".format(e))
             return False, None
 
         return True, conn
 
-    def req_update_aps(self, config_data):
+    def plan_update_aps(self, config_data, wlan_mac_addr):
+        """
+        Turn updateAPS entries into profile operations against the cached
+        settings.  Returns (ops, results): the operations to apply, and per
+        entry its SSID and operation (or just a status, if there is nothing
+        to apply).  A later entry for the same SSID replaces earlier ones.
+        """
+        ops = {}
+        results = []
+        for config in config_data:
+            ssid = config[CFG_SSID]
+            path = self.find_conn_path_by_id(ssid)
+            prev = ops.pop(ssid, None)
+            if CFG_PRIORITY in config and config[CFG_PRIORITY] < 0:
+                if prev is not None and prev["op"] == bulkupdate.OP_ADD:
+                    # Added earlier in this batch, just don't add it
+                    op = {"status": bulkupdate.OP_STATUS_SUCCESS}
+                elif path is None:
+                    op = {"status": bulkupdate.OP_STATUS_NOT_FOUND}
+                elif "Wired connection" in ssid:
+                    syslog("Failed to delete wired connection")
+                    op = {"status": bulkupdate.OP_STATUS_INVALID}
+                else:
+                    op = {"op": bulkupdate.OP_DELETE, "path": path}
+            else:
+                conn = create_wireless_config(wlan_mac_addr, config)
+                if not conn:
+                    op = {"status": bulkupdate.OP_STATUS_INVALID}
+                elif prev is not None and prev["op"] != bulkupdate.OP_DELETE:
+                    update_wireless_config(prev["settings"], conn)
+                    op = prev
+                elif path is not None:
+                    # The cached settings are shared, work on a copy
+                    cur = copy.deepcopy(self.conn_cache.get_settings(path))
+                    op = {
+                        "op": bulkupdate.OP_UPDATE,
+                        "path": path,
+                        "settings": update_wireless_config(cur, conn),
+                    }
+                else:
+                    op = {"op": bulkupdate.OP_ADD, "settings": conn}
+            if "op" in op:
+                ops[ssid] = op
+            # Earlier entries for the SSID take the result of this one
+            for result in results:
+                if result["op"] is prev:
+                    result["op"] = op
+            results.append({"ssid": ssid, "op": op})
+        return list(ops.values()), results
+
+    def req_update_aps(self, config_data, done_cb=None):
+        """
+        Handle updateAPS: apply all entries as one transaction, then call
+        done_cb(status, data) with the status of each entry.  The entries
+        can also be a profile diff from getAPS, applied only if the profile
+        set hash it was made against is still current.
+        """
+        if isinstance(config_data, dict):
+            set_hash = self.get_profile_set_hash()
+            if config_data[SYNC_HASH] != set_hash:
+                syslog("Profile diff is out of date.")
+                if done_cb is not None:
+                    done_cb(self.ACTIVATION_BAD_CONFIG, {SYNC_HASH: set_hash})
+                return
+            config_data = config_data.get(SYNC_CHANGED, []) + [
+                {CFG_SSID: ssid, CFG_PRIORITY: -1}
+                for ssid in config_data.get(SYNC_REMOVED, [])
+            ]
+
         mac = self.get_wlan_hw_address()
         if mac:
             wlan_mac_addr = mac.replace(":", "")
@@ -737,23 +1122,44 @@ class NetManager:
             wlan_mac_addr = ""
 
         try:
-            for config in config_data:
-                if CFG_PRIORITY in config and config[CFG_PRIORITY] < 0:
-                    if not self.remove_connection(config[CFG_SSID]):
-                        return False
-                else:
-                    conn = create_wireless_config(wlan_mac_addr, config)
-                    ret, conn = self.add_or_modify_connection(conn)
-                    if not ret:
-                        return False
+            ops, results = self.plan_update_aps(config_data, wlan_mac_addr)
         except KeyError as k:
             syslog("Invalid input configuration: %s" % str(k))
-            return False
+            ops, results = None, []
         except Exception as e:
             syslog("Failed update configs %s" % str(e))
-            return False
+            ops, results = None, []
 
-        return True
+        def update_done(ok):
+            data = [
+                {
+                    "ssid": result["ssid"],
+                    "status": result["op"].get("status", bulkupdate.OP_STATUS_FAILED),
+                }
+                for result in results
+            ]
+            if done_cb is not None:
+                done_cb(
+                    self.ACTIVATION_SUCCESS if ok else self.ACTIVATION_FAILED_NETWORK,
+                    data,
+                )
+
+        # Nothing is applied if any entry is invalid
+        if ops is None or any(
+            result["op"].get("status") not in (None, bulkupdate.OP_STATUS_SUCCESS)
+            for result in results
+        ):
+            update_done(False)
+            return
+        bulkupdate.BulkUpdate(
+            self.bus,
+            self.nm,
+            self.nm_settings,
+            self.conn_cache,
+            [self.wifi_dev_obj.object_path],
+            ops,
+            update_done,
+        ).start()
 
     def is_lte_configured(self):
         return self.find_conn_by_id(LTE_CONN_NAME) is not None
@@ -764,15 +1170,13 @@ class NetManager:
     def is_modem_available(self):
         return self.modem_present
 
-    def autoconf_cb(self, obj):
+    def autoconf_cb(self, status, data=None):
         pass
 
     def modem_added(self, object_path, properties):
         syslog("Modem added: {}".format(object_path))
         self.modem_path = object_path
-        self.modem = dbus.Interface(
-            self.bus.get_object(OFONO_BUS_NAME, self.modem_path), OFONO_MODEM_IFACE
-        )
+        self.modem = get_interface(OFONO_BUS_NAME, self.modem_path, OFONO_MODEM_IFACE)
         self.modem_present = False
         self.modem_sim = None
         self.modem_connman = None
@@ -789,33 +1193,29 @@ class NetManager:
         if self.modem_present and name == "Interfaces":
             if OFONO_SIM_IFACE in value:
                 if self.modem_sim is None:
-                    self.modem_sim = dbus.Interface(
-                        self.bus.get_object(OFONO_BUS_NAME, self.modem_path),
-                        OFONO_SIM_IFACE,
+                    self.modem_sim = get_interface(
+                        OFONO_BUS_NAME, self.modem_path, OFONO_SIM_IFACE
                     )
             elif self.modem_sim is not None:
                 self.modem_sim = None
             if OFONO_CONNMAN_IFACE in value:
                 if self.modem_connman is None:
-                    self.modem_connman = dbus.Interface(
-                        self.bus.get_object(OFONO_BUS_NAME, self.modem_path),
-                        OFONO_CONNMAN_IFACE,
+                    self.modem_connman = get_interface(
+                        OFONO_BUS_NAME, self.modem_path, OFONO_CONNMAN_IFACE
                     )
             elif self.modem_connman is not None:
                 self.modem_connman = None
             if OFONO_NETREG_IFACE in value:
                 if self.modem_netreg is None:
-                    self.modem_netreg = dbus.Interface(
-                        dbus.SystemBus().get_object(OFONO_BUS_NAME, self.modem_path),
-                        OFONO_NETREG_IFACE,
+                    self.modem_netreg = get_interface(
+                        OFONO_BUS_NAME, self.modem_path, OFONO_NETREG_IFACE
                     )
             elif self.modem_netreg is not None:
                 self.modem_netreg = None
             if OFONO_LTE_IFACE in value:
                 if self.modem_lte is None:
-                    self.modem_lte = dbus.Interface(
-                        dbus.SystemBus().get_object(OFONO_BUS_NAME, self.modem_path),
-                        OFONO_LTE_IFACE,
+                    self.modem_lte = get_interface(
+                        OFONO_BUS_NAME, self.modem_path, OFONO_LTE_IFACE
                     )
             elif self.modem_lte is not None:
                 self.modem_lte = None
@@ -832,21 +1232,20 @@ class NetManager:
                 self.lte_going_online = True
                 self.req_connect_lte({}, self.autoconf_cb)
 
-    def wwan_dev_props_changed(self, iface, props_changed, props_invalidated):
-        """Signal callback for change to the WWAN device properties"""
-        if props_changed and "State" in props_changed:
-            syslog("WWAN state changed: {}".format(props_changed["State"]))
-            if props_changed["State"] == NM_DEVICE_STATE_ACTIVATED:
-                syslog("New WWAN connection was activated!")
-                self.activated = True
-                if self.connectivity == NM_CONNECTIVITY_FULL:
-                    self.activation_status = self.ACTIVATION_SUCCESS
-            elif props_changed["State"] == NM_DEVICE_STATE_FAILED:
-                syslog("New WWAN connection failed.")
-                self.activation_status = self.ACTIVATION_FAILED_AUTH
-
-    def req_connect_lte(self, data, cb=None):
+    def req_get_activation_history(self):
+        """
+        Handle getActivationHistory message: the activations, most recent
+        last, and the time-to-connect statistics with and without a
+        reconnect hint
+        """
+        return {
+            "activations": list(self.activation_history),
+            "reconnect": self.reconnect_hints.get_stats(),
+        }
+
+    def req_connect_lte(self, data, cb=None, token=None):
         """Handle connectLTE message"""
+        self.activation_token = token or CancelToken()
         if not cb:
             cb = self.response_cb
         if not self.is_modem_available():
@@ -862,8 +1261,7 @@ class NetManager:
         username = data.get("username")
         password = data.get("password")
         roaming = data.get("roaming", False)
-        self.activation_status = self.ACTIVATION_PENDING
-        cb(self.activation_status)
+        cb(self.ACTIVATION_PENDING)
         try:
             self.remove_connection(LTE_CONN_NAME)
             # If the connection exists, NM will remove the ip config, but will not
@@ -874,6 +1272,12 @@ class NetManager:
             conn = create_lte_conn(LTE_CONN_NAME, WWAN_DEV_NAME, prefer_lte)
 
             self.new_conn_obj = self.nm_settings.AddConnection(conn)
+            self.conn_cache.refresh(self.new_conn_obj)
+            # NM activates the connection once the modem is online; the WWAN
+            # device is re-created then, see nm_device_added()
+            self.start_activation(ACTIVATION_LTE, cb)
+            if self.wwan_dev_path is not None:
+                self.activation.watch_device(self.wwan_dev_path)
             # Configure the LTE APN (if not default)
             if apn or username or password:
                 if apn:
@@ -889,12 +1293,9 @@ class NetManager:
             # Set the modem online
             syslog("Attempting to bring up LTE connection.")
             self.modem.SetProperty("Online", True)
-            # Set timer to check on activation
-            self.activation_start_time = time.time()
-            self.activation_msg_time = self.activation_start_time
-            gobject.timeout_add(ACTIVATION_TIMER_MS, self.check_activation, cb)
         except dbus.exceptions.DBusException as e:
             syslog("Failed to create connection: {}".format(e))
+            self.activation_cleanup()
             cb(self.ACTIVATION_INVALID)
 
     def req_get_lte_info(self):
@@ -930,9 +1331,8 @@ class NetManager:
             if self.modem_connman is not None:
                 ctxs = self.modem_connman.GetContexts()
                 if ctxs and len(ctxs) > 0:
-                    ctx = dbus.Interface(
-                        self.bus.get_object(OFONO_BUS_NAME, ctxs[0][0]),
-                        OFONO_CONNECTION_IFACE,
+                    ctx = get_interface(
+                        OFONO_BUS_NAME, ctxs[0][0], OFONO_CONNECTION_IFACE
                     )
                     lte_status["APN"] = ctx.GetProperties().get("AccessPointName", "")
             return lte_status
@@ -8,7 +8,11 @@ from syslog import syslog
 import json
 import socket
 import struct
-from gi.repository import GObject as gobject
+
+from .coalesce import Coalescer
+from .nmsnapshot import NMSnapshot, take_snapshot
+from .proxypool import get_interface
+from .worksched import scheduler
 
 # Network Manager Device Connection States
 NM_DEVICE_STATE_UNKNOWN = 0
@@ -94,34 +98,309 @@ NM_AP_IFACE = "org.freedesktop.NetworkManager.AccessPoint"
 NM_IP4CONFIG_IFACE = "org.freedesktop.NetworkManager.IP4Config"
 NM_IP6CONFIG_IFACE = "org.freedesktop.NetworkManager.IP6Config"
 
-PROPERTY_CHANGE_DELAY_MS = 15000
+# Stats changes reported without waiting for the quiet period: the device
+# getting activated or failing, and IP address changes
+URGENT_DEVICE_STATES = (
+    DEVICE_STATE_DESCRIPTIONS[NM_DEVICE_STATE_ACTIVATED],
+    DEVICE_STATE_DESCRIPTIONS[NM_DEVICE_STATE_FAILED],
+)
+URGENT_STAT_KEYS = ("ipv4-address-data", "ipv6-address-data")
+
+# Objects followed for each device, and the interface of their properties
+DEVICE_OBJ = "device"
+ACTIVE_OBJ = "active"
+IP4_OBJ = "ip4"
+IP6_OBJ = "ip6"
+AP_OBJ = "ap"
+OBJ_IFACES = {
+    ACTIVE_OBJ: NM_CONNECTION_ACTIVE_IFACE,
+    IP4_OBJ: NM_IP4CONFIG_IFACE,
+    IP6_OBJ: NM_IP6CONFIG_IFACE,
+    AP_OBJ: NM_AP_IFACE,
+}
+# Device properties holding the path of a followed object
+DEVICE_OBJ_PROPS = (
+    (ACTIVE_OBJ, "ActiveConnection"),
+    (IP4_OBJ, "Ip4Config"),
+    (IP6_OBJ, "Ip6Config"),
+)
+
+
+def urgent_change(old_entry: dict, new_entry: dict) -> bool:
+    """
+    Check if a stats entry change is a state transition to report promptly
+
+    :param old_entry: previous stats entry of the device, None if none
+    :param new_entry: new stats entry of the device
+    :return: True if the change is urgent
+    """
+    if old_entry is None:
+        return False
+    new_state = new_entry["device-state"]
+    if new_state != old_entry["device-state"] and new_state in URGENT_DEVICE_STATES:
+        return True
+    return any(old_entry[k] != new_entry[k] for k in URGENT_STAT_KEYS)
+
+
+class DeviceStat:
+    """
+    Cached state of one device and of the objects its stats come from (the
+    active connection and its settings, the IP configs and the active AP),
+    with the JSON fragment of its last stats entry
+    """
+
+    def __init__(self, path: str, props: dict):
+        self.path = path
+        self.interface = str(props["Interface"])
+        self.objs = {}  # object kind -> path
+        self.props = {kind: {} for kind in OBJ_IFACES}
+        self.props[DEVICE_OBJ] = dict(props)
+        self.settings = {}  # settings of the active connection
+        self.settings_path = None  # path of the settings read, if any
+        self.entry = None
+        self.fragment = None
 
 
 class NetStat:
-    """NetworkManager connection stats reporting service"""
+    """
+    NetworkManager connection stats reporting service.  The stats model is
+    read once per device, then kept current from the PropertiesChanged
+    signals of the devices and the objects they refer to, and the Updated
+    signal of the settings of their active connections, so a change only
+    updates the affected device.  The JSON of each device entry is cached,
+    and the stats are only reported when their content changed.
+    """
 
     def __init__(self, connection_stat_changed_signal):
         try:
             self.bus = dbus.SystemBus()
             self.nm = dbus.Interface(self.bus.get_object(NM_IFACE, NM_OBJ), NM_IFACE)
-            self.nm_props = dbus.Interface(
-                self.bus.get_object(NM_IFACE, NM_OBJ), DBUS_PROP_IFACE
+            self.nm.connect_to_signal("DeviceAdded", self.device_added)
+            self.nm.connect_to_signal("DeviceRemoved", self.device_removed)
+            # One receiver per interface, for the property changes of all the
+            # objects of that interface
+            for iface in (NM_DEVICE_IFACE, NM_WIFI_DEVICE_IFACE) + tuple(
+                OBJ_IFACES.values()
+            ):
+                self.bus.add_signal_receiver(
+                    self.props_changed,
+                    signal_name="PropertiesChanged",
+                    dbus_interface=DBUS_PROP_IFACE,
+                    bus_name=NM_IFACE,
+                    arg0=iface,
+                    path_keyword="path",
+                )
+            # The settings of an active connection can be updated while it
+            # stays active, without any property change of the device
+            self.bus.add_signal_receiver(
+                self.settings_updated,
+                signal_name="Updated",
+                dbus_interface=NM_CONNECTION_IFACE,
+                bus_name=NM_IFACE,
+                path_keyword="path",
             )
-            # self.nm_settings = dbus.Interface(self.bus.get_object(NM_IFACE, NM_SETTINGS_OBJ), NM_SETTINGS_IFACE)
-            self.nm_props.connect_to_signal("PropertiesChanged", self.nm_props_changed)
             self.connection_stats_changed = connection_stat_changed_signal
-            self.property_timer_id = None
-            self.connection_stats = {}
-            self.schedule_status_update()
+            self.coalescer = Coalescer(self.status_update)
+            self.update_task = None
+            self.devices = {}  # device path -> DeviceStat
+            self.objs = {}  # followed object path -> (DeviceStat, object kind)
+            self.settings_objs = {}  # settings path -> {device path: DeviceStat}
+            self.connection_stats = None  # last JSON reported
+            self.update_connection_stats()
         except dbus.DBusException:
             pass
 
-    def nm_props_changed(self, iface, props_changed, props_invalidated):
-        """Signal callback for change to Network Manager properties"""
+    #
+    # Stats model
+    #
+    def update_connection_stats(self) -> None:
+        """
+        (Re)load the stats model of all devices from NetworkManager via
+        DBus, as a background task reading one device per step
+        """
+        if self.update_task is not None:
+            self.update_task.cancel()
+        for dev_path in list(self.devices):
+            self.device_removed(dev_path)
+        self.update_task = scheduler.add("connection stats", self.read_devices())
 
-        # Trigger an update of the connection stats
+    def read_devices(self):
+        """
+        Generator loading one device per iteration, then scheduling the
+        stats report.  The objects are taken from a snapshot of the whole
+        NetworkManager tree when available, or else read one by one.
+        """
+        snapshot = take_snapshot()
+        for dev_path in self.nm.GetDevices():
+            try:
+                self.load_device(dev_path, snapshot)
+            except Exception as e:
+                syslog(f"Error reading device properties: {str(e)}")
+            yield
+        self.update_task = None
         self.schedule_status_update()
 
+    def read_props(self, path: str, iface: str, snapshot: NMSnapshot = None) -> dict:
+        """
+        Get the properties of an object interface, from the snapshot if it
+        has them, else from NetworkManager
+
+        :param path: DBus path of the object
+        :param iface: the interface of the properties
+        :param snapshot: NetworkManager objects snapshot, or None
+        :return: dict of properties
+        """
+        if snapshot is not None:
+            props = snapshot.get(path, iface)
+            if props is not None:
+                return dict(props)
+        props_iface = get_interface(NM_IFACE, path, DBUS_PROP_IFACE)
+        return dict(props_iface.GetAll(iface))
+
+    def load_device(self, dev_path: str, snapshot: NMSnapshot = None) -> None:
+        """
+        Read the state of an Ethernet or Wi-Fi device and start following it
+
+        :param dev_path: DBus path representing the target interface
+        :param snapshot: NetworkManager objects snapshot, or None
+        """
+        props = self.read_props(dev_path, NM_DEVICE_IFACE, snapshot)
+        if props["DeviceType"] not in (NM_DEVICE_TYPE_ETHERNET, NM_DEVICE_TYPE_WIFI):
+            return
+        dev = DeviceStat(str(dev_path), props)
+        self.devices[dev.path] = dev
+        self.objs[dev.path] = (dev, DEVICE_OBJ)
+        for kind, prop in DEVICE_OBJ_PROPS:
+            self.follow(dev, kind, props[prop], snapshot)
+        if props["DeviceType"] == NM_DEVICE_TYPE_WIFI:
+            wifi_props = self.read_props(dev_path, NM_WIFI_DEVICE_IFACE, snapshot)
+            self.follow(dev, AP_OBJ, wifi_props["ActiveAccessPoint"], snapshot)
+        self.refresh(dev)
+
+    def follow(
+        self, dev: DeviceStat, kind: str, path: str, snapshot: NMSnapshot = None
+    ) -> None:
+        """
+        Switch one of the objects of a device to a new path, reading its
+        properties (and the settings of an active connection)
+
+        :param dev: the device stats model
+        :param kind: the kind of object
+        :param path: DBus path of the object, "/" if none
+        :param snapshot: NetworkManager objects snapshot, or None
+        """
+        old_path = dev.objs.pop(kind, None)
+        if old_path is not None:
+            self.objs.pop(old_path, None)
+        dev.props[kind] = {}
+        if kind == ACTIVE_OBJ:
+            self.set_settings_path(dev, None)
+            dev.settings = {}
+        path = str(path)
+        if path == "/":
+            return
+        dev.objs[kind] = path
+        self.objs[path] = (dev, kind)
+        try:
+            dev.props[kind] = self.read_props(path, OBJ_IFACES[kind], snapshot)
+            if kind == ACTIVE_OBJ:
+                self.read_settings(dev)
+        except dbus.exceptions.DBusException as e:
+            syslog(f"Error reading {kind} of {dev.interface}: {str(e)}")
+
+    def read_settings(self, dev: DeviceStat) -> None:
+        """Read the settings of the active connection of a Wi-Fi device"""
+        conn_path = str(dev.props[ACTIVE_OBJ].get("Connection", "/"))
+        wifi = dev.props[DEVICE_OBJ]["DeviceType"] == NM_DEVICE_TYPE_WIFI
+        if conn_path == "/" or not wifi:
+            self.set_settings_path(dev, None)
+            dev.settings = {}
+            return
+        self.set_settings_path(dev, conn_path)
+        conn_iface = get_interface(NM_IFACE, conn_path, NM_CONNECTION_IFACE)
+        dev.settings = conn_iface.GetSettings()
+
+    def set_settings_path(self, dev: DeviceStat, path: str) -> None:
+        """Switch the settings object whose updates refresh a device"""
+        if dev.settings_path is not None:
+            devs = self.settings_objs.get(dev.settings_path, {})
+            devs.pop(dev.path, None)
+            if not devs:
+                self.settings_objs.pop(dev.settings_path, None)
+        dev.settings_path = path
+        if path is not None:
+            self.settings_objs.setdefault(path, {})[dev.path] = dev
+
+    def device_added(self, dev_path):
+        """Signal callback for a new NetworkManager device"""
+        try:
+            self.load_device(dev_path)
+        except dbus.exceptions.DBusException as e:
+            syslog(f"Error reading device properties: {str(e)}")
+
+    def device_removed(self, dev_path):
+        """Signal callback for a removed NetworkManager device"""
+        dev = self.devices.pop(str(dev_path), None)
+        if dev is None:
+            return
+        self.objs.pop(dev.path, None)
+        for path in dev.objs.values():
+            self.objs.pop(path, None)
+        self.set_settings_path(dev, None)
+        self.schedule_status_update(urgent=True)
+
+    def props_changed(self, iface, props_changed, props_invalidated, path=None):
+        """Signal callback for a property change of a followed object"""
+        followed = self.objs.get(str(path))
+        if followed is None:
+            return
+        dev, kind = followed
+        try:
+            if kind != DEVICE_OBJ:
+                if iface != OBJ_IFACES[kind]:
+                    return
+                dev.props[kind].update(props_changed)
+                if kind == ACTIVE_OBJ and "Connection" in props_changed:
+                    self.read_settings(dev)
+            elif iface == NM_DEVICE_IFACE:
+                dev.props[DEVICE_OBJ].update(props_changed)
+                for obj_kind, prop in DEVICE_OBJ_PROPS:
+                    if prop in props_changed:
+                        self.follow(dev, obj_kind, props_changed[prop])
+            elif "ActiveAccessPoint" in props_changed:
+                self.follow(dev, AP_OBJ, props_changed["ActiveAccessPoint"])
+            else:
+                return
+        except dbus.exceptions.DBusException as e:
+            syslog(f"Error reading {kind} of {dev.interface}: {str(e)}")
+        self.refresh(dev)
+
+    def settings_updated(self, path=None):
+        """Signal callback for an update of a connection's settings"""
+        for dev in list(self.settings_objs.get(str(path), {}).values()):
+            try:
+                self.read_settings(dev)
+            except dbus.exceptions.DBusException as e:
+                syslog(f"Error reading settings of {dev.interface}: {str(e)}")
+            self.refresh(dev)
+
+    def refresh(self, dev: DeviceStat) -> None:
+        """Rebuild the stats entry of a device, reporting it if it changed"""
+        try:
+            entry = self.generate_stat_entry(dev)
+            fragment = json.dumps(entry)
+        except Exception as e:
+            syslog(f"Error generating stats of {dev.interface}: {str(e)}")
+            return
+        if fragment != dev.fragment:
+            urgent = urgent_change(dev.entry, entry)
+            dev.entry = entry
+            dev.fragment = fragment
+            self.schedule_status_update(urgent)
+
+    #
+    # Stats entries
+    #
     def generate_boilerplate_stat_entry(self, props: dict) -> dict:
         """
         Generate the boilerplate connection stats data that is common
@@ -148,251 +427,167 @@ class NetStat:
 
         return new_stat_entry
 
-    def populate_ip_data(self, dev_path: str, stat_entry: dict) -> None:
+    def populate_ip_data(self, dev: DeviceStat, stat_entry: dict) -> None:
         """
         Populate the IPv4/v6 stats for the target interface
 
-        :param dev_path: DBus path representing the target interface
+        :param dev: the device stats model
         :param stat_entry: dict of stats for the target device to be updated
         """
-        prop_iface = dbus.Interface(
-            self.bus.get_object(NM_IFACE, dev_path), DBUS_PROP_IFACE
-        )
-
-        # Grab IPv4 data
-        ipv4_config_proxy = self.bus.get_object(
-            NM_IFACE, prop_iface.Get(NM_DEVICE_IFACE, "Ip4Config")
-        )
-        ipv4_config_iface = dbus.Interface(ipv4_config_proxy, DBUS_PROP_IFACE)
+        # IPv4 data
+        ipv4_config = dev.props[IP4_OBJ]
 
         ipv4_addresses = []
-        for address in ipv4_config_iface.Get(NM_IP4CONFIG_IFACE, "AddressData"):
+        for address in ipv4_config.get("AddressData", []):
             ipv4_addresses.append(
                 str(address["address"]) + "/" + str(address["prefix"])
             )
 
         ipv4_nameservers = []
-        for nameserver in ipv4_config_iface.Get(NM_IP4CONFIG_IFACE, "Nameservers"):
+        for nameserver in ipv4_config.get("Nameservers", []):
             # IPv4 DNS nameservers are returned as an array of dbus.UInt32's,
             # so we need to unpack them
             nameserver_string = socket.inet_ntoa(struct.pack("=L", nameserver))
             ipv4_nameservers.append(nameserver_string)
 
         stat_entry["ipv4-address-data"] = ipv4_addresses
-        stat_entry["ipv4-gateway"] = str(
-            ipv4_config_iface.Get(NM_IP4CONFIG_IFACE, "Gateway")
-        )
+        stat_entry["ipv4-gateway"] = str(ipv4_config.get("Gateway", ""))
         stat_entry["ipv4-nameservers"] = ipv4_nameservers
 
-        # Grab IPv6 data
-        ipv6_config_proxy = self.bus.get_object(
-            NM_IFACE, prop_iface.Get(NM_DEVICE_IFACE, "Ip6Config")
-        )
-        ipv6_config_iface = dbus.Interface(ipv6_config_proxy, DBUS_PROP_IFACE)
+        # IPv6 data
+        ipv6_config = dev.props[IP6_OBJ]
 
         ipv6_addresses = []
-        for address in ipv6_config_iface.Get(NM_IP6CONFIG_IFACE, "AddressData"):
+        for address in ipv6_config.get("AddressData", []):
             ipv6_addresses.append(
                 str(address["address"]) + "/" + str(address["prefix"])
             )
 
         ipv6_nameservers = []
-        for nameserver in ipv6_config_iface.Get(NM_IP6CONFIG_IFACE, "Nameservers"):
+        for nameserver in ipv6_config.get("Nameservers", []):
             # IPv6 nameservers are returned as an array of arrays of bytes, so
             # we need to convert this back to a string
             nameserver_string = socket.inet_ntop(socket.AF_INET6, bytes(nameserver))
             ipv6_nameservers.append(nameserver_string)
 
         stat_entry["ipv6-address-data"] = ipv6_addresses
-        stat_entry["ipv6-gateway"] = str(
-            ipv6_config_iface.Get(NM_IP6CONFIG_IFACE, "Gateway")
-        )
+        stat_entry["ipv6-gateway"] = str(ipv6_config.get("Gateway", ""))
         stat_entry["ipv6-nameservers"] = ipv6_nameservers
 
-    def generate_ethernet_stat_entry(self, dev_path: str) -> dict:
+    def populate_wifi_data(self, dev: DeviceStat, stat_entry: dict) -> None:
         """
-        Generate the connection stats for an Ethernet interface
+        Populate the AP and security stats for the target Wi-Fi interface
 
-        :param dev_path: DBus path representing the target interface
-        :return: dict of stats for the target interface
+        :param dev: the device stats model
+        :param stat_entry: dict of stats for the target device to be updated
         """
-        props_iface = dbus.Interface(
-            self.bus.get_object(NM_IFACE, dev_path), DBUS_PROP_IFACE
-        )
-        props = props_iface.GetAll(NM_DEVICE_IFACE)
-
-        new_stat_entry = self.generate_boilerplate_stat_entry(props)
-        new_stat_entry["mac-address"] = str(props["HwAddress"])
-
-        if props["State"] == NM_DEVICE_STATE_ACTIVATED:
-            active_connection = props_iface.Get(NM_DEVICE_IFACE, "ActiveConnection")
-            active_connection_prop_iface = dbus.Interface(
-                self.bus.get_object(NM_IFACE, active_connection), DBUS_PROP_IFACE
-            )
-
-            new_stat_entry["connection-id"] = str(
-                active_connection_prop_iface.Get(NM_CONNECTION_ACTIVE_IFACE, "Id")
-            )
-            new_stat_entry["connection-state"] = ACTIVE_CONNECTION_STATE_DESCRIPTIONS[
-                active_connection_prop_iface.Get(NM_CONNECTION_ACTIVE_IFACE, "State")
-            ]
+        ap_props = dev.props[AP_OBJ]
+        if ap_props:
+            # Wi-Fi interface is currently associated with an AP
+            ssid = ""
+            for c in ap_props.get("Ssid", []):
+                ssid = ssid + chr(c)
+            stat_entry["ssid"] = ssid
+            stat_entry["strength"] = int(ap_props.get("Strength", 0))
+
+        connection_settings = dev.settings
+        if "802-11-wireless-security" in connection_settings:
+            stat_entry["security"] = {}
+            if "auth-alg" in connection_settings["802-11-wireless-security"]:
+                stat_entry["security"]["auth-alg"] = str(
+                    connection_settings["802-11-wireless-security"]["auth-alg"]
+                )
 
-            self.populate_ip_data(dev_path, new_stat_entry)
+            if "key-mgmt" in connection_settings["802-11-wireless-security"]:
+                stat_entry["security"]["key-mgmt"] = str(
+                    connection_settings["802-11-wireless-security"]["key-mgmt"]
+                )
 
-        return new_stat_entry
+            # Check if enterprise Wi-Fi is being used, and if so, pull in
+            # those settings
+            if "802-1x" in connection_settings:
+                if "eap" in connection_settings["802-1x"]:
+                    # connection_settings["802-1x"]["eap"] is a dbus.Array
+                    eap_methods = []
+                    for eap in connection_settings["802-1x"]["eap"]:
+                        eap_methods.append(str(eap))
+                    stat_entry["security"]["eap"] = eap_methods
+
+                if "identity" in connection_settings["802-1x"]:
+                    stat_entry["security"]["identity"] = str(
+                        connection_settings["802-1x"]["identity"]
+                    )
 
-    def generate_wifi_stat_entry(self, dev_path: str) -> dict:
+                if "phase2-auth" in connection_settings["802-1x"]:
+                    # connection_settings["802-1x"]["phase2-auth""] is a dbus.Array
+                    phase2_auth_methods = []
+                    for method in connection_settings["802-1x"]["phase2-auth"]:
+                        phase2_auth_methods.append(str(method))
+                    stat_entry["security"]["phase2-auth"] = phase2_auth_methods
+
+                if "phase2-autheap" in connection_settings["802-1x"]:
+                    # connection_settings["802-1x"]["phase2-autheap""] is a dbus.Array
+                    phase2_autheap_methods = []
+                    for method in connection_settings["802-1x"]["phase2-autheap"]:
+                        phase2_autheap_methods.append(str(method))
+                    stat_entry["security"]["phase2-autheap"] = phase2_autheap_methods
+
+    def generate_stat_entry(self, dev: DeviceStat) -> dict:
         """
-        Generate the connection stats for a Wi-Fi interface
+        Generate the connection stats for an Ethernet or Wi-Fi interface
+        from its cached state
 
-        :param dev_path: DBus path representing the target interface
+        :param dev: the device stats model
         :return: dict of stats for the target interface
         """
-        props_iface = dbus.Interface(
-            self.bus.get_object(NM_IFACE, dev_path), DBUS_PROP_IFACE
-        )
-        props = props_iface.GetAll(NM_DEVICE_IFACE)
+        props = dev.props[DEVICE_OBJ]
 
         new_stat_entry = self.generate_boilerplate_stat_entry(props)
         new_stat_entry["mac-address"] = str(props["HwAddress"])
 
-        if props["State"] == NM_DEVICE_STATE_ACTIVATED:
-            active_connection = props_iface.Get(NM_DEVICE_IFACE, "ActiveConnection")
-            active_connection_prop_iface = dbus.Interface(
-                self.bus.get_object(NM_IFACE, active_connection), DBUS_PROP_IFACE
-            )
-
-            active_connection_connection = active_connection_prop_iface.Get(
-                NM_CONNECTION_ACTIVE_IFACE, "Connection"
-            )
-            active_connection_connection_iface = dbus.Interface(
-                self.bus.get_object(NM_IFACE, active_connection_connection),
-                NM_CONNECTION_IFACE,
-            )
-            connection_settings = active_connection_connection_iface.GetSettings()
-
-            new_stat_entry["connection-id"] = str(
-                active_connection_prop_iface.Get(NM_CONNECTION_ACTIVE_IFACE, "Id")
-            )
+        active_props = dev.props[ACTIVE_OBJ]
+        if props["State"] == NM_DEVICE_STATE_ACTIVATED and active_props:
+            new_stat_entry["connection-id"] = str(active_props["Id"])
             new_stat_entry["connection-state"] = ACTIVE_CONNECTION_STATE_DESCRIPTIONS[
-                active_connection_prop_iface.Get(NM_CONNECTION_ACTIVE_IFACE, "State")
+                active_props["State"]
             ]
 
-            self.populate_ip_data(dev_path, new_stat_entry)
+            self.populate_ip_data(dev, new_stat_entry)
 
             if props["DeviceType"] == NM_DEVICE_TYPE_WIFI:
-                active_ap_path = props_iface.Get(
-                    NM_WIFI_DEVICE_IFACE, "ActiveAccessPoint"
-                )
-                if active_ap_path != "/":
-                    # Wi-Fi interface is currently associated with an AP
-                    ap_proxy = self.bus.get_object(NM_IFACE, active_ap_path)
-                    ap_props = dbus.Interface(ap_proxy, DBUS_PROP_IFACE)
-                    raw_ssid = ap_props.Get(NM_AP_IFACE, "Ssid")
-
-                    ssid = ""
-                    for c in raw_ssid:
-                        ssid = ssid + chr(c)
-                    new_stat_entry["ssid"] = ssid
-                    new_stat_entry["strength"] = int(
-                        ap_props.Get(NM_AP_IFACE, "Strength")
-                    )
-
-                if "802-11-wireless-security" in connection_settings:
-                    new_stat_entry["security"] = {}
-                    if "auth-alg" in connection_settings["802-11-wireless-security"]:
-                        new_stat_entry["security"]["auth-alg"] = str(
-                            connection_settings["802-11-wireless-security"]["auth-alg"]
-                        )
-
-                    if "key-mgmt" in connection_settings["802-11-wireless-security"]:
-                        new_stat_entry["security"]["key-mgmt"] = str(
-                            connection_settings["802-11-wireless-security"]["key-mgmt"]
-                        )
-
-                    # Check if enterprise Wi-Fi is being used, and if so, pull in
-                    # those settings
-                    if "802-1x" in connection_settings:
-                        if "eap" in connection_settings["802-1x"]:
-                            # connection_settings["802-1x"]["eap"] is a dbus.Array
-                            eap_methods = []
-                            for eap in connection_settings["802-1x"]["eap"]:
-                                eap_methods.append(str(eap))
-                            new_stat_entry["security"]["eap"] = eap_methods
-
-                        if "identity" in connection_settings["802-1x"]:
-                            new_stat_entry["security"]["identity"] = str(
-                                connection_settings["802-1x"]["identity"]
-                            )
-
-                        if "phase2-auth" in connection_settings["802-1x"]:
-                            # connection_settings["802-1x"]["phase2-auth""] is a dbus.Array
-                            phase2_auth_methods = []
-                            for method in connection_settings["802-1x"]["phase2-auth"]:
-                                phase2_auth_methods.append(str(method))
-                            new_stat_entry["security"][
-                                "phase2-auth"
-                            ] = phase2_auth_methods
-
-                        if "phase2-autheap" in connection_settings["802-1x"]:
-                            # connection_settings["802-1x"]["phase2-autheap""] is a dbus.Array
-                            phase2_autheap_methods = []
-                            for method in connection_settings["802-1x"][
-                                "phase2-autheap"
-                            ]:
-                                phase2_autheap_methods.append(str(method))
-                            new_stat_entry["security"][
-                                "phase2-autheap"
-                            ] = phase2_autheap_methods
+                self.populate_wifi_data(dev, new_stat_entry)
 
         return new_stat_entry
 
-    def update_connection_stats(self) -> None:
-        """
-        Update the connection stats from NetworkManager via DBus
-        """
-        devices = self.nm.GetDevices()
-
-        connection_stats = {}
-
-        # Loop through devices
-        for dev_path in devices:
-            try:
-                props_iface = dbus.Interface(
-                    self.bus.get_object(NM_IFACE, dev_path), DBUS_PROP_IFACE
-                )
-                props = props_iface.GetAll(NM_DEVICE_IFACE)
-
-                # Ethernet interface
-                if props["DeviceType"] == NM_DEVICE_TYPE_ETHERNET:
-                    connection_stats[
-                        str(props["Interface"])
-                    ] = self.generate_ethernet_stat_entry(dev_path)
-                # Wi-Fi interface
-                elif props["DeviceType"] == NM_DEVICE_TYPE_WIFI:
-                    connection_stats[
-                        str(props["Interface"])
-                    ] = self.generate_wifi_stat_entry(dev_path)
-                # Other interface
-                else:
-                    continue
-            except Exception as e:
-                syslog(f"Error reading device properties: {str(e)}")
-
-        self.connection_stats = connection_stats
+    #
+    # Reporting
+    #
+    def status_update(self):
+        """Send the status report, if it changed since the last one"""
+        # Same as json.dumps() of the entries, from the cached fragments
+        connection_stats = (
+            "{"
+            + ", ".join(
+                json.dumps(dev.interface) + ": " + dev.fragment
+                for dev in self.devices.values()
+                if dev.fragment is not None
+            )
+            + "}"
+        )
+        if connection_stats != self.connection_stats:
+            self.connection_stats = connection_stats
+            # Fire the handler if defined
+            if self.connection_stats_changed != None:
+                self.connection_stats_changed(connection_stats)
 
-        # Fire the handler if defined
-        if self.connection_stats_changed != None:
-            self.connection_stats_changed(json.dumps(self.connection_stats))
-        self.property_timer_id = None
+    def schedule_status_update(self, urgent: bool = False) -> None:
+        """
+        Schedule the status report, coalescing the changes until they stop
+        for the quiet period, within the maximum latency
 
-    def schedule_status_update(self):
-        """Schedule or reschedule the status report"""
-        if self.property_timer_id is not None:
-            gobject.source_remove(self.property_timer_id)
-        self.property_timer_id = gobject.timeout_add(
-            PROPERTY_CHANGE_DELAY_MS, self.update_connection_stats
-        )
+        :param urgent: report the change within the urgent delay
+        """
+        self.coalescer.changed(urgent)
 
     def set_connection_stats_changed(self, callback_function):
         self.connection_stats_changed = callback_function
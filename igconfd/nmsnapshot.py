@@ -0,0 +1,64 @@
+"""
+nmsnapshot - Whole NetworkManager object tree in one D-Bus call
+"""
+
+import dbus, dbus.exceptions
+from syslog import syslog
+
+from .proxypool import get_interface
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
+# NetworkManager 1.18+ exports its objects through an ObjectManager here
+NM_OM_OBJ = "/org/freedesktop"
+
+SNAPSHOT_TIMEOUT = 5.0
+
+# Errors telling that NetworkManager has no ObjectManager
+DBUS_ERROR_UNKNOWN_METHOD = "org.freedesktop.DBus.Error.UnknownMethod"
+DBUS_ERROR_UNKNOWN_INTERFACE = "org.freedesktop.DBus.Error.UnknownInterface"
+DBUS_ERROR_UNKNOWN_OBJECT = "org.freedesktop.DBus.Error.UnknownObject"
+
+# Cleared once NetworkManager turns out not to support GetManagedObjects
+snapshot_supported = True
+
+
+class NMSnapshot:
+    """
+    The properties of all the NetworkManager objects (devices, active
+    connections, IP configs, access points...) at one point in time, so
+    that the cross-references between them can be followed locally.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects  # path -> {interface -> properties}
+
+    def get(self, path, iface):
+        """Get the properties of an object interface, None if not there"""
+        return self.objects.get(str(path), {}).get(iface)
+
+
+def take_snapshot():
+    """
+    Read the NetworkManager object tree with a single GetManagedObjects
+    call.  Returns None if that fails, in which case the caller falls back
+    to reading each object.
+    """
+    global snapshot_supported
+    if not snapshot_supported:
+        return None
+    try:
+        om = get_interface(NM_IFACE, NM_OM_OBJ, DBUS_OM_IFACE)
+        objects = om.GetManagedObjects(timeout=SNAPSHOT_TIMEOUT)
+    except dbus.exceptions.DBusException as e:
+        if e.get_dbus_name() in (
+            DBUS_ERROR_UNKNOWN_METHOD,
+            DBUS_ERROR_UNKNOWN_INTERFACE,
+            DBUS_ERROR_UNKNOWN_OBJECT,
+        ):
+            syslog("NetworkManager has no ObjectManager, reading objects one by one.")
+            snapshot_supported = False
+        else:
+            syslog("Failed to read NetworkManager objects: {}".format(e))
+        return None
+    return NMSnapshot({str(path): ifaces for path, ifaces in objects.items()})
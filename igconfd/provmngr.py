@@ -6,6 +6,9 @@ import time
 import dbus, dbus.exceptions
 from syslog import syslog
 
+from .asynccall import call_async
+from .cancel import CancelToken
+
 from gi.repository import GObject as gobject
 
 PROV_SVC = "com.lairdtech.IG.ProvService"
@@ -15,6 +18,7 @@ DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
 
 PROVISION_INTERMEDIATE_TIMEOUT = 2
 PROVISION_TIMER_MS = 500
+PROV_START_CALL_TIMEOUT = 30.0
 
 EDGEIQ_URL = "http://api.edgeiq.io/"
 
@@ -37,6 +41,8 @@ class ProvManager:
 
     def __init__(self, response_cb):
         self._prov_state = self.PROV_UNPROVISIONED
+        self._start_pending = False
+        self.token = CancelToken()
         try:
             bus = dbus.SystemBus()
             self.prov = dbus.Interface(bus.get_object(PROV_SVC, PROV_OBJ), PROV_IFACE)
@@ -109,6 +115,14 @@ class ProvManager:
         else:
             return False
 
+    def is_busy(self):
+        """Check if provisioning is being started or is in progress"""
+        return (
+            self._start_pending
+            or self._prov_state == self.PROV_INPROGRESS_DOWNLOADING
+            or self._prov_state == self.PROV_INPROGRESS_APPLYING
+        )
+
     def check_provision(self):
         ret = self.is_provisioning()
         if (
@@ -130,9 +144,10 @@ class ProvManager:
 
         return ret
 
-    def start_provisioning(self, prov_data):
+    def start_provisioning(self, prov_data, token=None):
 
         syslog("Starting provisioning.")
+        self.token = token or CancelToken()
         if (
             self._prov_state == self.PROV_INPROGRESS_DOWNLOADING
             or self._prov_state == self.PROV_INPROGRESS_APPLYING
@@ -146,26 +161,18 @@ class ProvManager:
                 }
             else:
                 auth_params = {}
-            status = self.prov.StartProvisioning(prov_data["url"].encode(), auth_params)
-            self.response_cb(status)
-            self._prov_state = status
+            url = prov_data["url"]
         except KeyError:
             syslog("Invalid provisioning request data.")
             self.response_cb(self.PROV_FAILED_INVALID)
             self._prov_state = self.PROV_FAILED_INVALID
             return
 
-        if self.is_provisioning():
-            # Success, send actualt response
-            self.response_cb(self.PROV_UNPROVISIONED, {"operation": "connect"})
-            # Set timer task to check status & sent intermediate responses
-            self.provision_msg_time = time.time()
-            gobject.timeout_add(PROVISION_TIMER_MS, self.check_provision)
-        else:
-            self.response_cb(self.PROV_FAILED_CONNECT)
+        self.request_provisioning(url, auth_params)
 
-    def start_provisioning_edge(self, prov_data):
+    def start_provisioning_edge(self, prov_data, token=None):
         syslog("Starting provisioning Edge.")
+        self.token = token or CancelToken()
         if (
             self._prov_state == self.PROV_INPROGRESS_DOWNLOADING
             or self._prov_state == self.PROV_INPROGRESS_APPLYING
@@ -174,20 +181,49 @@ class ProvManager:
         try:
             # Construct special EdgeIQ "url"
             url = EDGEIQ_URL + prov_data["company"]
-            status = self.prov.StartProvisioning(url.encode(), {})
-            self.response_cb(status)
-            self._prov_state = status
         except KeyError:
             syslog("Invalid provisioning request data.")
             self.response_cb(self.PROV_FAILED_INVALID)
             self._prov_state = self.PROV_FAILED_INVALID
             return
 
+        self.request_provisioning(url, {})
+
+    def request_provisioning(self, url, auth_params):
+        """Ask the Provisioning Service to start without blocking the main loop"""
+        if self._start_pending:
+            # Callers check is_busy() first; never leave a request unanswered
+            syslog("Provisioning start already pending.")
+            self.response_cb(self.PROV_FAILED_CONNECT)
+            return
+        self._start_pending = True
+        call_async(
+            self.prov.StartProvisioning,
+            url.encode(),
+            auth_params,
+            timeout=self.token.clamp(PROV_START_CALL_TIMEOUT),
+            reply_cb=self.start_provisioning_reply,
+            error_cb=self.start_provisioning_error,
+        )
+
+    def start_provisioning_reply(self, status):
+        self._start_pending = False
+        self._prov_state = status
+        if self.token.cancelled:
+            return
+        self.response_cb(status)
+
         if self.is_provisioning():
             # Success, send actualt response
             self.response_cb(self.PROV_UNPROVISIONED, {"operation": "connect"})
             # Set timer task to check status & sent intermediate responses
             self.provision_msg_time = time.time()
-            gobject.timeout_add(PROVISION_TIMER_MS, self.check_provision)
+            self.token.timeout_add(PROVISION_TIMER_MS, self.check_provision)
         else:
             self.response_cb(self.PROV_FAILED_CONNECT)
+
+    def start_provisioning_error(self, error):
+        self._start_pending = False
+        syslog("Failed to start provisioning: {}".format(error))
+        if not self.token.cancelled:
+            self.response_cb(self.PROV_FAILED_CONNECT)
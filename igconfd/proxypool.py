@@ -0,0 +1,97 @@
+"""
+proxypool - Shared D-Bus interface proxies for the BLE configuration service
+"""
+
+from collections import OrderedDict
+
+import dbus
+
+DBUS_OM_IFACE = "org.freedesktop.DBus.ObjectManager"
+DBUS_IFACE = "org.freedesktop.DBus"
+
+# Proxies kept; the least recently used one is dropped beyond this
+PROXY_POOL_SIZE = 128
+
+
+class ProxyPool:
+    """
+    Interface proxies on the system bus, keyed by (bus name, path,
+    interface), so that the objects used over and over (APs, devices,
+    connections, modem interfaces) are only created once.  The pool is
+    bounded with LRU eviction, and the proxies of an object are dropped
+    when its service reports the object (or interface) removed through the
+    ObjectManager InterfacesRemoved signal, or when the owner calls evict()
+    from a service specific signal (e.g. ConnectionRemoved).  All the
+    proxies of a bus name are dropped when its owner changes (the service
+    restarted), as they are bound to the old owner.
+    """
+
+    def __init__(self, size=PROXY_POOL_SIZE, bus=None):
+        self.size = size
+        self.bus = bus
+        self.proxies = OrderedDict()
+        # Bus names watched for InterfacesRemoved and NameOwnerChanged
+        self.watched = set()
+        # Counters, for tuning the pool size
+        self.created = 0
+        self.hits = 0
+        self.evicted = 0
+
+    def get(self, bus_name, path, iface, introspect=True):
+        """Get the interface proxy for an object, creating it if needed"""
+        key = (bus_name, str(path), iface)
+        proxy = self.proxies.get(key)
+        if proxy is not None:
+            self.hits += 1
+            self.proxies.move_to_end(key)
+            return proxy
+        if self.bus is None:
+            self.bus = dbus.SystemBus()
+        if bus_name not in self.watched:
+            self.watched.add(bus_name)
+            self.bus.add_signal_receiver(
+                lambda path, ifaces: self.evict(bus_name, path, ifaces),
+                signal_name="InterfacesRemoved",
+                dbus_interface=DBUS_OM_IFACE,
+                bus_name=bus_name,
+            )
+            self.bus.add_signal_receiver(
+                self.owner_changed,
+                signal_name="NameOwnerChanged",
+                dbus_interface=DBUS_IFACE,
+                arg0=bus_name,
+            )
+        proxy = dbus.Interface(
+            self.bus.get_object(bus_name, path, introspect=introspect), iface
+        )
+        self.created += 1
+        self.proxies[key] = proxy
+        if len(self.proxies) > self.size:
+            self.proxies.popitem(last=False)
+            self.evicted += 1
+        return proxy
+
+    def evict(self, bus_name, path, ifaces=None):
+        """Drop the proxies of a removed object, or of some of its interfaces"""
+        path = str(path)
+        for key in list(self.proxies):
+            if key[:2] == (bus_name, path) and (ifaces is None or key[2] in ifaces):
+                del self.proxies[key]
+                self.evicted += 1
+
+    def owner_changed(self, bus_name, old_owner, new_owner):
+        """Drop the proxies of a bus name whose owner went away"""
+        if not old_owner:
+            return
+        for key in list(self.proxies):
+            if key[0] == bus_name:
+                del self.proxies[key]
+                self.evicted += 1
+
+
+pool = ProxyPool()
+
+
+def get_interface(bus_name, path, iface, introspect=True):
+    """Get a pooled interface proxy on the system bus"""
+    return pool.get(bus_name, path, iface, introspect)
@@ -0,0 +1,111 @@
+"""
+reconnect - Fast reconnect hints for the saved Wi-Fi profiles
+"""
+
+import json
+import os
+import time
+from syslog import syslog
+
+RECONNECT_HINTS_FILE = "/var/lib/igconfd/reconnect.json"
+
+HINT_BSSID = "bssid"
+HINT_FREQUENCY = "frequency"
+HINT_TIME = "time"
+
+# Time-to-connect statistics, for activations with and without a hint
+STATS_HINTED = "hinted"
+STATS_UNHINTED = "unhinted"
+
+
+class ReconnectHints:
+    """
+    The BSSID and frequency of the last successful activation of each
+    profile (by SSID), persisted so that they survive a reboot, and the
+    time-to-connect statistics of the activations started with and without
+    a hint.
+    """
+
+    def __init__(self, path=RECONNECT_HINTS_FILE):
+        self.path = path
+        self.hints = {}
+        self.stats = {
+            STATS_HINTED: {"count": 0, "totalMs": 0, "minMs": None, "maxMs": None},
+            STATS_UNHINTED: {"count": 0, "totalMs": 0, "minMs": None, "maxMs": None},
+        }
+        try:
+            with open(self.path, "r") as f:
+                hints = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            syslog("Failed to read reconnect hints: {}".format(e))
+            return
+        if not isinstance(hints, dict):
+            syslog("Ignoring malformed reconnect hints file.")
+            return
+        # Drop entries that can't be used, so get() always returns a valid hint
+        self.hints = {
+            ssid: hint
+            for ssid, hint in hints.items()
+            if isinstance(hint, dict) and isinstance(hint.get(HINT_BSSID), str)
+        }
+
+    def get(self, ssid):
+        return self.hints.get(ssid)
+
+    def remove(self, ssid):
+        """Forget the hint of a profile that no longer exists"""
+        if self.hints.pop(ssid, None) is not None:
+            self.save()
+
+    def record(self, ssid, bssid, frequency):
+        """Remember the AP of a successful activation"""
+        self.hints[ssid] = {
+            HINT_BSSID: bssid,
+            HINT_FREQUENCY: frequency,
+            HINT_TIME: int(time.time()),
+        }
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump(self.hints, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            syslog("Failed to save reconnect hints: {}".format(e))
+
+    def connected(self, hinted, elapsed_ms):
+        """Add the time-to-connect of a successful activation"""
+        stats = self.stats[STATS_HINTED if hinted else STATS_UNHINTED]
+        stats["count"] += 1
+        stats["totalMs"] += elapsed_ms
+        if stats["minMs"] is None or elapsed_ms < stats["minMs"]:
+            stats["minMs"] = elapsed_ms
+        if stats["maxMs"] is None or elapsed_ms > stats["maxMs"]:
+            stats["maxMs"] = elapsed_ms
+        syslog(
+            "Connected in {} ms ({}); {}".format(
+                elapsed_ms,
+                STATS_HINTED if hinted else STATS_UNHINTED,
+                ", ".join(
+                    "{} mean {} ms over {}".format(
+                        name, s["totalMs"] // s["count"], s["count"]
+                    )
+                    for name, s in self.stats.items()
+                    if s["count"]
+                ),
+            )
+        )
+
+    def get_stats(self):
+        """Get the time-to-connect statistics, with the mean of each"""
+        stats = {}
+        for name, s in self.stats.items():
+            stats[name] = dict(
+                s, meanMs=s["totalMs"] // s["count"] if s["count"] else None
+            )
+        return stats
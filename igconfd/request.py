@@ -0,0 +1,78 @@
+"""
+request - Client request decoding for the BLE configuration service
+"""
+
+# JSON Message Strings
+MSG_VERSION = "version"
+MSG_ID = "id"
+MSG_TYPE = "type"
+MSG_DATA = "data"
+MSG_DEADLINE = "deadline"
+
+MSG_ID_VERSION = "version"
+
+
+class RequestError(Exception):
+    """
+    Raised when a message cannot be decoded into a request; 'field' is the
+    path of the invalid field, and 'request' a partial Request to answer
+    (None if the message has no usable id)
+    """
+
+    def __init__(self, message, field, request=None):
+        super().__init__(message)
+        self.field = field
+        self.request = request
+
+
+class Request:
+    """
+    A decoded client request.  The JSON payload is parsed once when the
+    message is received; json.loads already yields 'str' keys and values,
+    so the payload is used as-is rather than copied.
+    """
+
+    __slots__ = ("version", "id", "type", "data", "deadline", "token")
+
+    def __init__(self, msg_type, msg_id=None, version=None, data=None, deadline=None):
+        self.type = msg_type
+        self.id = msg_id
+        self.version = version
+        self.data = data
+        self.deadline = deadline
+        self.token = None
+
+    def has_data(self):
+        return self.data is not None
+
+
+def is_msg_id(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def decode_request(obj):
+    """
+    Decode a parsed JSON message into a Request.  Raises RequestError if
+    the message is not a request object.
+    """
+    if not isinstance(obj, dict):
+        raise RequestError("message is not an object", "")
+    msg_id = obj.get(MSG_ID)
+    msg_type = obj.get(MSG_TYPE)
+    if not isinstance(msg_type, str):
+        msg_type = None
+    # What is needed to answer an invalid request
+    partial = Request(msg_type, msg_id) if is_msg_id(msg_id) else None
+    if msg_type is None:
+        raise RequestError("missing message type", MSG_TYPE, partial)
+    version = obj.get(MSG_VERSION)
+    # The version check is skipped for the version message itself, all
+    # other messages must carry a version
+    if msg_type != MSG_ID_VERSION and (
+        not isinstance(version, int) or isinstance(version, bool)
+    ):
+        raise RequestError("missing message version", MSG_VERSION, partial)
+    deadline = obj.get(MSG_DEADLINE)
+    if not isinstance(deadline, int) or isinstance(deadline, bool) or deadline <= 0:
+        deadline = None
+    return Request(msg_type, msg_id, version, obj.get(MSG_DATA), deadline)
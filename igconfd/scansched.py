@@ -0,0 +1,144 @@
+"""
+scansched - Background Wi-Fi scan scheduling for the BLE configuration service
+"""
+
+import dbus, dbus.exceptions
+import time
+from syslog import syslog
+
+from gi.repository import GObject as gobject
+
+NM_WIFI_DEVICE_IFACE = "org.freedesktop.NetworkManager.Device.Wireless"
+NM_DEVICE_NOT_ALLOWED = "org.freedesktop.NetworkManager.Device.NotAllowed"
+
+# Scan interval while BLE is active; doubles up to the maximum while the
+# scan results don't change
+SCAN_INTERVAL_MIN_MS = 15000
+SCAN_INTERVAL_MAX_MS = 120000
+# Retry delay when NetworkManager refuses a scan (rate limited or busy)
+SCAN_RETRY_MS = 5000
+# Give up waiting for LastScan after this long
+SCAN_TIMEOUT_MS = 30000
+
+
+def boottime_ms():
+    """Current CLOCK_BOOTTIME in ms, the clock of the NM LastScan property"""
+    return int(time.clock_gettime(time.CLOCK_BOOTTIME) * 1000)
+
+
+class ScanScheduler:
+    """
+    Periodic full AP scans while the BLE service is active.  The interval
+    backs off while the AP table doesn't change, scans refused by
+    NetworkManager are retried later, and the age of the last results is
+    tracked from the device LastScan property.
+    """
+
+    def __init__(self, wifi_dev, wifi_dev_props, ap_table, scan_done_cb):
+        self.wifi_dev = wifi_dev
+        self.ap_table = ap_table
+        self.scan_done_cb = scan_done_cb
+        self.active = False
+        self.scanning = False
+        self.timer_id = None
+        self.interval_ms = SCAN_INTERVAL_MIN_MS
+        self.scan_changes = None  # AP table changes at the last scan
+        try:
+            self.last_scan = int(wifi_dev_props.Get(NM_WIFI_DEVICE_IFACE, "LastScan"))
+        except dbus.exceptions.DBusException:
+            self.last_scan = -1
+
+    def start(self):
+        """Start periodic scans, beginning with an immediate scan"""
+        if self.active:
+            return
+        syslog("Starting background AP scans.")
+        self.active = True
+        self.interval_ms = SCAN_INTERVAL_MIN_MS
+        self.scan_now()
+
+    def stop(self):
+        """Stop periodic scans; a scan in progress is left to complete"""
+        if not self.active:
+            return
+        syslog("Stopping background AP scans.")
+        self.active = False
+        if not self.scanning:
+            self.cancel_timer()
+
+    def age_ms(self):
+        """Age of the last scan results in ms, or None if never scanned"""
+        if self.last_scan < 0:
+            return None
+        return max(0, boottime_ms() - self.last_scan)
+
+    def is_fresh(self, max_age_ms):
+        age = self.age_ms()
+        return age is not None and age <= max_age_ms
+
+    def schedule(self, delay_ms):
+        self.cancel_timer()
+        self.timer_id = gobject.timeout_add(delay_ms, self.scan_timer)
+
+    def cancel_timer(self):
+        if self.timer_id is not None:
+            gobject.source_remove(self.timer_id)
+            self.timer_id = None
+
+    def scan_timer(self):
+        self.timer_id = None
+        if self.scanning:
+            syslog("AP scan did not complete.")
+            self.scan_finished()
+        elif self.active:
+            self.scan_now()
+        return False
+
+    def scan_now(self, ssid=""):
+        """
+        Request a scan, a full scan unless an SSID to probe for is given;
+        returns True if a scan is in progress
+        """
+        if self.scanning:
+            return True
+        try:
+            self.wifi_dev.RequestScan({"ssids": [dbus.ByteArray(ssid.encode())]})
+        except dbus.exceptions.DBusException as e:
+            if e.get_dbus_name() == NM_DEVICE_NOT_ALLOWED:
+                # NetworkManager rate limits scans and refuses them while
+                # activating, so try again once that has passed
+                syslog("AP scan not allowed, retrying: {}".format(e))
+                delay_ms = SCAN_RETRY_MS
+            else:
+                syslog("Attempt to start AP scan failed: {}".format(e))
+                delay_ms = self.interval_ms
+            if self.active:
+                self.schedule(delay_ms)
+            return False
+        syslog("Starting {} AP scan...".format("directed" if ssid else "full"))
+        self.scanning = True
+        self.schedule(SCAN_TIMEOUT_MS)
+        return True
+
+    def last_scan_changed(self, last_scan):
+        """Handle a change of the device LastScan property"""
+        self.last_scan = int(last_scan)
+        changes = self.ap_table.changes
+        if changes == self.scan_changes:
+            self.interval_ms = min(self.interval_ms * 2, SCAN_INTERVAL_MAX_MS)
+        else:
+            self.interval_ms = SCAN_INTERVAL_MIN_MS
+        self.scan_changes = changes
+        if self.scanning:
+            syslog("Full AP scan complete.")
+            self.scan_finished()
+        elif self.active:
+            # NetworkManager scanned by itself, restart the interval
+            self.schedule(self.interval_ms)
+
+    def scan_finished(self):
+        self.scanning = False
+        self.cancel_timer()
+        if self.active:
+            self.schedule(self.interval_ms)
+        self.scan_done_cb()
@@ -0,0 +1,298 @@
+"""
+schema - Request payload validation for the BLE configuration service
+
+Each message type has a compact schema for its 'data' payload, which is
+compiled into a validator function when the module is imported.  A
+validator returns None if the payload is valid, otherwise the path of the
+first invalid field (e.g. "data[2].priority").
+"""
+
+import math
+
+# Message types (must match messagemngr)
+MSG_ID_GET_APS = "getAccessPoints"
+MSG_ID_CONNECT_AP = "connectAP"
+MSG_ID_UPDATE_APS = "updateAPS"
+MSG_ID_GET_CURRENT_APS = "getAPS"
+MSG_ID_CONNECT_LTE = "connectLTE"
+MSG_ID_PROVISION_URL = "provisionURL"
+MSG_ID_PROVISION_EDGE = "provisionEdge"
+MSG_ID_CONN_CHECK = "connCheck"
+MSG_ID_CONN_PROBE = "connProbe"
+MSG_ID_UPDATE_CONFIG = "updateConfig"
+
+DATA_PATH = "data"
+
+# NetworkManager limits
+SSID_MAX_LEN = 32
+PSK_MIN_LEN = 8
+PSK_MAX_LEN = 64
+WEP_INDEX_MAX = 3
+NM_PRIORITY_MIN = -999
+NM_PRIORITY_MAX = 999
+IFNAMSIZ = 16
+PROBE_MAX_URLS = 8
+CONNECT_MAX_CANDIDATES = 8
+
+# Access point list options (must match aptable)
+AP_STRENGTH_MAX = 100
+AP_SECURITY_TYPES = ("open", "wep", "psk", "eap")
+AP_SORT_ORDERS = ("strength", "ssid")
+
+
+#
+# Validator builders; each returns a function (value, path) -> error path
+#
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def string(min_len=0, max_len=None, encoded=False):
+    """A string; with encoded=True the length limits apply to UTF-8 bytes"""
+
+    def check(value, path):
+        if not isinstance(value, str):
+            return path
+        n = len(value.encode()) if encoded else len(value)
+        if n < min_len or (max_len is not None and n > max_len):
+            return path
+        return None
+
+    return check
+
+
+def integer(lo=None, hi=None):
+    def check(value, path):
+        if not is_int(value):
+            return path
+        if (lo is not None and value < lo) or (hi is not None and value > hi):
+            return path
+        return None
+
+    return check
+
+
+def number(lo=None, hi=None, exclusive_lo=False):
+    """
+    A finite int or float within [lo, hi]; with exclusive_lo=True the value
+    must be greater than lo (e.g. a timeout must be positive)
+    """
+
+    def check(value, path):
+        if not (is_int(value) or isinstance(value, float)):
+            return path
+        if not math.isfinite(value):
+            # json.loads accepts NaN and Infinity
+            return path
+        if lo is not None and (value <= lo if exclusive_lo else value < lo):
+            return path
+        if hi is not None and value > hi:
+            return path
+        return None
+
+    return check
+
+
+def boolean():
+    def check(value, path):
+        return None if isinstance(value, bool) else path
+
+    return check
+
+
+def anything():
+    def check(value, path):
+        return None
+
+    return check
+
+
+def array(item, min_len=0, max_len=None):
+    def check(value, path):
+        if not isinstance(value, list):
+            return path
+        if len(value) < min_len or (max_len is not None and len(value) > max_len):
+            return path
+        for i, v in enumerate(value):
+            error = item(v, "{}[{}]".format(path, i))
+            if error is not None:
+                return error
+        return None
+
+    return check
+
+
+def obj(fields, required=(), require_any=()):
+    """
+    An object; fields maps key to validator.  Keys in 'required' must be
+    present, and at least one key in 'require_any' (if given).  Unknown
+    keys are allowed, so that older daemons accept newer clients.
+    """
+    items = tuple(fields.items())
+
+    def check(value, path):
+        if not isinstance(value, dict):
+            return path
+        for key in required:
+            if key not in value:
+                return "{}.{}".format(path, key)
+        if require_any and not any(key in value for key in require_any):
+            return "{}.{}".format(path, require_any[0])
+        for key, validator in items:
+            if key in value:
+                error = validator(value[key], "{}.{}".format(path, key))
+                if error is not None:
+                    return error
+        return None
+
+    return check
+
+
+def choice(*values):
+    """One of a fixed set of values"""
+
+    def check(value, path):
+        return None if value in values else path
+
+    return check
+
+
+def mapping(value):
+    """An object with arbitrary keys, all values checked by one validator"""
+
+    def check(v, path):
+        if not isinstance(v, dict):
+            return path
+        for key, item in v.items():
+            error = value(item, "{}.{}".format(path, key))
+            if error is not None:
+                return error
+        return None
+
+    return check
+
+
+def one_of(*validators):
+    """Valid if any of the validators accepts the value"""
+
+    def check(value, path):
+        error = path
+        for validator in validators:
+            error = validator(value, path)
+            if error is None:
+                return None
+        return error
+
+    return check
+
+
+#
+# Message schemas
+#
+WIFI_CONFIG_FIELDS = {
+    "ssid": string(1, SSID_MAX_LEN, encoded=True),
+    "priority": integer(NM_PRIORITY_MIN, NM_PRIORITY_MAX),
+    "psk": string(PSK_MIN_LEN, PSK_MAX_LEN),
+    "wep-key": string(1),
+    "wep-index": integer(0, WEP_INDEX_MAX),
+    "eap": string(1),
+    "identity": string(),
+    "password": string(),
+    "phase2-auth": string(1),
+    "disable-ipv6": boolean(),
+}
+
+WIFI_CONFIG = obj(WIFI_CONFIG_FIELDS, required=("ssid",))
+
+# (validator, data required)
+SCHEMAS = {
+    MSG_ID_GET_APS: (
+        obj(
+            {
+                "minStrength": integer(0, AP_STRENGTH_MAX),
+                "security": array(choice(*AP_SECURITY_TYPES), 1),
+                "limit": integer(1),
+                "sort": choice(*AP_SORT_ORDERS),
+                "maxAge": integer(0),
+                "since": integer(0),
+            }
+        ),
+        False,
+    ),
+    MSG_ID_CONNECT_AP: (
+        one_of(WIFI_CONFIG, array(WIFI_CONFIG, 1, CONNECT_MAX_CANDIDATES)),
+        True,
+    ),
+    MSG_ID_UPDATE_APS: (
+        one_of(
+            array(WIFI_CONFIG),
+            obj(
+                {
+                    "hash": string(1),
+                    "changed": array(WIFI_CONFIG),
+                    "removed": array(string(1, SSID_MAX_LEN, encoded=True)),
+                },
+                required=("hash",),
+            ),
+        ),
+        True,
+    ),
+    MSG_ID_GET_CURRENT_APS: (
+        obj({"hash": string(), "profiles": mapping(string())}),
+        False,
+    ),
+    MSG_ID_CONNECT_LTE: (
+        obj(
+            {
+                "apn": string(),
+                "username": string(),
+                "password": string(),
+                "roaming": boolean(),
+                "preferLTE": boolean(),
+            }
+        ),
+        False,
+    ),
+    MSG_ID_PROVISION_URL: (
+        obj(
+            {"url": string(1), "username": string(), "password": string()},
+            required=("url",),
+        ),
+        True,
+    ),
+    MSG_ID_PROVISION_EDGE: (obj({"company": string(1)}, required=("company",)), True),
+    MSG_ID_CONN_CHECK: (
+        obj(
+            {"url": string(1), "timeout": number(0, exclusive_lo=True)},
+            required=("url", "timeout"),
+        ),
+        True,
+    ),
+    MSG_ID_CONN_PROBE: (
+        obj(
+            {
+                "url": string(1),
+                "urls": array(string(1), 1, PROBE_MAX_URLS),
+                "interfaces": array(string(1, IFNAMSIZ - 1)),
+                "timeout": number(0, exclusive_lo=True),
+            },
+            require_any=("urls", "url"),
+        ),
+        True,
+    ),
+    MSG_ID_UPDATE_CONFIG: (anything(), True),
+}
+
+
+def validate_data(msg_type, data):
+    """
+    Validate a request payload for the message type.  Returns None if it
+    is valid (or the type has no schema), otherwise the invalid field path.
+    """
+    schema = SCHEMAS.get(msg_type)
+    if schema is None:
+        return None
+    validator, data_required = schema
+    if data is None:
+        return DATA_PATH if data_required else None
+    return validator(data, DATA_PATH)
@@ -0,0 +1,99 @@
+"""
+statsdoc - Versioned connection stats document with JSON Patch deltas
+"""
+
+import copy
+import uuid
+from collections import deque
+
+# Versions whose patch is kept for GetConnectionStats(since_version)
+STATS_HISTORY_LEN = 16
+
+
+def pointer_token(key):
+    """Escape a key as a JSON Pointer (RFC 6901) reference token"""
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def diff(old, new, path="", patch=None):
+    """
+    Compute the RFC 6902 patch turning the dict 'old' into 'new'.  Nested
+    objects are diffed member by member; other values (including arrays)
+    are replaced as a whole.
+    """
+    if patch is None:
+        patch = []
+    for key in old:
+        if key not in new:
+            patch.append({"op": "remove", "path": path + "/" + pointer_token(key)})
+    for key, value in new.items():
+        member_path = path + "/" + pointer_token(key)
+        if key not in old:
+            patch.append({"op": "add", "path": member_path, "value": value})
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            diff(old[key], value, member_path, patch)
+        elif value != old[key]:
+            patch.append({"op": "replace", "path": member_path, "value": value})
+    return patch
+
+
+def merge(target, source):
+    """Recursively merge a copy of the dict 'source' into 'target'"""
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class StatsDocument:
+    """
+    The connection stats of all the reporters (NetworkManager and LTE) as
+    one JSON document, with a version incremented on each change.  The
+    patch of each version is kept, so a consumer at an older version can
+    catch up with the patches instead of the whole document.  Versions
+    restart from 0 with each process, so they are only meaningful along
+    with the epoch, a random id of the document instance.
+    """
+
+    def __init__(self, history_len=STATS_HISTORY_LEN):
+        self.epoch = uuid.uuid4().hex
+        self.sources = {}  # reporter -> its part of the document
+        self.doc = {}
+        self.version = 0
+        self.history = deque(maxlen=history_len)  # (version, patch)
+
+    def update(self, source, stats):
+        """
+        Replace the part of the document of a reporter.  Returns the patch
+        of the new version, or None if the document is unchanged.
+        """
+        self.sources[source] = stats
+        doc = {}
+        for part in self.sources.values():
+            merge(doc, part)
+        patch = diff(self.doc, doc)
+        if not patch:
+            return None
+        self.doc = doc
+        self.version += 1
+        self.history.append((self.version, patch))
+        return patch
+
+    def get_since(self, epoch, since):
+        """
+        Get the patch from version 'since' of epoch 'epoch' to the current
+        version, or the full document if that version is no longer (or not)
+        known, e.g. because it is from an earlier process
+        """
+        reply = {"epoch": self.epoch, "version": self.version}
+        if epoch == self.epoch:
+            if since == self.version:
+                return dict(reply, patch=[])
+            if self.history and self.history[0][0] <= since + 1 <= self.version:
+                patch = []
+                for version, version_patch in self.history:
+                    if version > since:
+                        patch.extend(version_patch)
+                return dict(reply, patch=patch)
+        return dict(reply, full=True, stats=self.doc)
@@ -32,12 +32,21 @@ class VirtualSerialPortService(gattsvc.Service):
         self.vsp_tx = VspTxCharacteristic(bus, 1, self, disc_cb)
         self.add_characteristic(self.vsp_tx)
 
-    def tx(self, message, tx_complete=None):
-        self.vsp_tx.tx(message, tx_complete)
+    def tx(self, message, tx_complete=None, owner=None):
+        self.vsp_tx.tx(message, tx_complete, owner)
 
     def flush_tx(self):
         self.vsp_tx.flush_tx()
 
+    def tx_pending(self):
+        return self.vsp_tx.tx_pending()
+
+    def purge_tx(self):
+        self.vsp_tx.purge_tx()
+
+    def drop_tx(self, owner):
+        self.vsp_tx.drop_tx(owner)
+
 
 class VspRxCharacteristic(gattsvc.Characteristic):
     """
@@ -75,6 +84,7 @@ class VspTxCharacteristic(gattsvc.Characteristic):
         self.tx_queue = Queue.Queue()
         self.tx_remain = None
         self.tx_complete = None
+        self.tx_owner = None
         self.disc_cb = disc_cb
 
     def send_next_chunk(self):
@@ -90,10 +100,15 @@ class VspTxCharacteristic(gattsvc.Characteristic):
                 tx_complete = self.tx_complete
                 # Get next message from queue
                 if not self.tx_queue.empty():
-                    self.tx_remain, self.tx_complete = self.tx_queue.get_nowait()
+                    (
+                        self.tx_remain,
+                        self.tx_complete,
+                        self.tx_owner,
+                    ) = self.tx_queue.get_nowait()
                 else:
                     self.tx_remain = None
                     self.tx_complete = None
+                    self.tx_owner = None
         self.tx_mutex.release()
         if tx_chunk and len(tx_chunk) > 0:
             # Convert string to array of DBus Bytes & send
@@ -102,23 +117,50 @@ class VspTxCharacteristic(gattsvc.Characteristic):
         if tx_complete:
             tx_complete()
 
-    def tx(self, message, tx_complete):
+    def tx(self, message, tx_complete, owner=None):
         self.tx_mutex.acquire()
         if self.tx_remain and len(self.tx_remain) > 0:
             # Message in progress, queue for later
-            self.tx_queue.put_nowait((message.encode(), tx_complete))
+            self.tx_queue.put_nowait((message.encode(), tx_complete, owner))
         else:
             # Send immediately
             self.tx_remain = message.encode()
             self.tx_complete = tx_complete
+            self.tx_owner = owner
         self.tx_mutex.release()
         self.send_next_chunk()
 
+    def tx_pending(self):
+        # A message is still being indicated (waiting for Confirm)
+        return bool(self.tx_remain)
+
     def flush_tx(self):
         # Flush any pending Tx data
         self.tx_mutex.acquire()
         self.tx_remain = None
         self.tx_complete = None
+        self.tx_owner = None
+        self.tx_mutex.release()
+
+    def purge_tx(self):
+        # Flush pending Tx data and drop all queued messages
+        self.tx_mutex.acquire()
+        self.flush_tx()
+        while not self.tx_queue.empty():
+            self.tx_queue.get_nowait()
+        self.tx_mutex.release()
+
+    def drop_tx(self, owner):
+        # Drop the queued messages of one owner (request); a message already
+        # being indicated is completed, so the client can still frame it
+        self.tx_mutex.acquire()
+        kept = []
+        while not self.tx_queue.empty():
+            entry = self.tx_queue.get_nowait()
+            if entry[2] is not owner:
+                kept.append(entry)
+        for entry in kept:
+            self.tx_queue.put_nowait(entry)
         self.tx_mutex.release()
 
     def find_objs_by_iface(self, iface):
@@ -0,0 +1,129 @@
+"""
+worksched - Time-sliced background work for the BLE configuration service
+"""
+
+import time
+from collections import deque
+from syslog import syslog
+
+from gi.repository import GObject as gobject
+
+# Main loop time budget of one slice of background work
+SLICE_BUDGET_MS = 5
+# Delay before the next slice while a BLE message is still being sent
+TX_YIELD_MS = 10
+
+
+class WorkTask:
+    """One long running job, a generator doing a bounded step per iteration"""
+
+    def __init__(self, name, steps, done_cb=None):
+        self.name = name
+        self.steps = steps
+        self.done_cb = done_cb
+        self.slice_count = 0
+        self.total_ms = 0.0
+        self.max_slice_ms = 0.0
+        self.overruns = 0  # slices that went over the budget
+        self.cancelled = False
+
+    def record(self, slice_ms, budget_ms):
+        self.slice_count += 1
+        self.total_ms += slice_ms
+        self.max_slice_ms = max(self.max_slice_ms, slice_ms)
+        if slice_ms > budget_ms:
+            self.overruns += 1
+
+    def cancel(self):
+        self.cancelled = True
+        self.steps.close()
+
+
+class WorkScheduler:
+    """
+    Cooperative scheduler for long D-Bus heavy jobs (AP reads, stats
+    collection, settings reads).  Each job is a generator, and the jobs are
+    run round robin from a low priority idle source in slices of a few ms,
+    so GATT Confirm/WriteValue calls and other bus traffic are dispatched
+    in between.  While a BLE message is being sent, no slice is run at all,
+    bounding the Tx latency whatever the background work.
+    """
+
+    def __init__(self, budget_ms=SLICE_BUDGET_MS):
+        self.budget_ms = budget_ms
+        self.tasks = deque()
+        self.source_id = None
+        self.tx_pending = None
+
+    def set_tx_pending(self, tx_pending):
+        """Set the function telling if a BLE message is being sent"""
+        self.tx_pending = tx_pending
+
+    def add(self, name, steps, done_cb=None):
+        """
+        Run the generator 'steps' in slices; done_cb() is called once it is
+        exhausted.  Returns the task, which can be cancelled.
+        """
+        task = WorkTask(name, steps, done_cb)
+        self.tasks.append(task)
+        self.wakeup()
+        return task
+
+    def wakeup(self, delay_ms=0):
+        if self.source_id is not None:
+            return
+        if delay_ms:
+            self.source_id = gobject.timeout_add(
+                delay_ms, self.run_slice, priority=gobject.PRIORITY_LOW
+            )
+        else:
+            self.source_id = gobject.idle_add(
+                self.run_slice, priority=gobject.PRIORITY_LOW
+            )
+
+    def run_slice(self):
+        self.source_id = None
+        while self.tasks and self.tasks[0].cancelled:
+            self.tasks.popleft()
+        if not self.tasks:
+            return False
+        if self.tx_pending is not None and self.tx_pending():
+            # Let the indications go out first
+            self.wakeup(TX_YIELD_MS)
+            return False
+
+        task = self.tasks.popleft()
+        start = time.monotonic()
+        deadline = start + self.budget_ms / 1000.0
+        done = False
+        try:
+            while time.monotonic() < deadline:
+                next(task.steps)
+        except StopIteration:
+            done = True
+        except Exception as e:
+            syslog("Background task {} failed: {}".format(task.name, e))
+            done = True
+        task.record((time.monotonic() - start) * 1000.0, self.budget_ms)
+
+        if done:
+            syslog(
+                "Task {}: {:.1f} ms in {} slices, max {:.1f} ms, {} overruns.".format(
+                    task.name,
+                    task.total_ms,
+                    task.slice_count,
+                    task.max_slice_ms,
+                    task.overruns,
+                )
+            )
+            if task.done_cb is not None:
+                task.done_cb()
+        else:
+            self.tasks.append(task)
+        if self.tasks:
+            self.wakeup()
+        return False
+
+
+# Shared by all the managers, so their jobs take turns on the main loop
+scheduler = WorkScheduler()
@@ -0,0 +1,133 @@
+"""
+updateAPS benchmark: 100 profiles pushed to a mock NetworkManager with a
+per-call latency, comparing the former entry by entry update (a
+ListConnections scan and a blocking call per entry) with the pipelined
+BulkUpdate transaction (user-040).
+
+Run from the repository root: python3 test/bench_bulkupdate.py
+"""
+
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakenm import FakeNM
+
+from igconfd import bulkupdate, conncache
+from igconfd.conncache import ConnectionCache
+
+PROFILES = 100
+EXISTING = 20
+LATENCY_MS = 2.0
+WIFI_DEVICE = "/org/freedesktop/NetworkManager/Devices/3"
+
+
+def wifi_settings(ssid, priority=0):
+    return {
+        "connection": {
+            "id": ssid,
+            "uuid": "uuid-" + ssid,
+            "type": "802-11-wireless",
+            "autoconnect-priority": priority,
+        },
+        "802-11-wireless": {"ssid": list(ssid.encode())},
+        "802-11-wireless-security": {"key-mgmt": "wpa-psk", "psk": "passphrase"},
+    }
+
+
+def mock_nm():
+    nm = FakeNM(latency_ms=LATENCY_MS)
+    for i in range(EXISTING):
+        nm.add(wifi_settings("net-{}".format(i)))
+    return nm
+
+
+def entry_by_entry(nm):
+    """The former updateAPS: every call blocks for the bus latency"""
+    settings = nm.proxy()
+    for i in range(PROFILES):
+        config = wifi_settings("net-{}".format(i), 1)
+        # find_conn_path_by_id(): list and read every connection
+        found = None
+        for path in settings.ListConnections():
+            if settings_id(nm.proxy(path).GetSettings()) == config["connection"]["id"]:
+                found = path
+                break
+        if found is not None:
+            nm.proxy(found).Update(config)
+        else:
+            settings.AddConnection(config)
+    return nm.loop.now
+
+
+def settings_id(settings):
+    return settings["connection"]["id"]
+
+
+def bulk(nm):
+    """The BulkUpdate transaction, planned against the connection cache"""
+    with mock.patch.multiple(conncache, get_interface=nm.get_interface):
+        cache = ConnectionCache(nm.bus, nm.proxy())
+        loaded = round_trips(nm)
+        ops = []
+        for i in range(PROFILES):
+            ssid = "net-{}".format(i)
+            path = cache.find_path_by_id(ssid)
+            if path is None:
+                ops.append({"op": bulkupdate.OP_ADD, "settings": wifi_settings(ssid)})
+            else:
+                ops.append(
+                    {
+                        "op": bulkupdate.OP_UPDATE,
+                        "path": path,
+                        "settings": wifi_settings(ssid, 1),
+                    }
+                )
+        results = []
+        with mock.patch.multiple(bulkupdate, get_interface=nm.get_interface):
+            bulkupdate.BulkUpdate(
+                nm.bus,
+                nm.proxy(),
+                nm.proxy(),
+                cache,
+                [WIFI_DEVICE],
+                ops,
+                results.append,
+            ).start()
+            nm.loop.run()
+        assert results == [True]
+    return loaded, nm.loop.now
+
+
+def round_trips(nm):
+    return sum(n for name, n in nm.calls.items() if name[0].isupper())
+
+
+def main():
+    nm = mock_nm()
+    start = time.perf_counter()
+    bus_ms = entry_by_entry(nm)
+    cpu_ms = (time.perf_counter() - start) * 1000.0
+    print(
+        "entry by entry: {} round trips, {:.0f} ms on the bus, {:.1f} ms CPU".format(
+            round_trips(nm), bus_ms, cpu_ms
+        )
+    )
+
+    nm = mock_nm()
+    start = time.perf_counter()
+    loaded, bus_ms = bulk(nm)
+    cpu_ms = (time.perf_counter() - start) * 1000.0
+    print(
+        "bulk update:    {} round trips ({} for the cache load), "
+        "{:.0f} ms on the bus, {:.1f} ms CPU".format(
+            round_trips(nm), loaded, bus_ms, cpu_ms
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
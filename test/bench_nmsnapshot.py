@@ -0,0 +1,53 @@
+"""
+NetStat startup benchmark: the stats model of 10 devices loaded from a
+mock NetworkManager with a per-call latency, with one GetManagedObjects
+snapshot and with the per-object reads used before it (and still used
+when NetworkManager has no ObjectManager) (user-048).
+
+Run from the repository root: python3 test/bench_nmsnapshot.py
+"""
+
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakenm import FakeNM
+
+from igconfd.netstat import NetStat
+
+DEVICES = 10
+LATENCY_MS = 1.0
+
+
+def startup(object_manager):
+    nm = FakeNM(latency_ms=LATENCY_MS, object_manager=object_manager)
+    for i in range(DEVICES):
+        nm.add_device(i, wifi=i % 2 == 1)
+    with contextlib.ExitStack() as stack:
+        for patcher in nm.netstat_patchers():
+            stack.enter_context(patcher)
+        start = time.perf_counter()
+        NetStat(None).coalescer.flush()
+        cpu_ms = (time.perf_counter() - start) * 1000.0
+    return round_trips(nm), nm.loop.now, cpu_ms
+
+
+def round_trips(nm):
+    return sum(n for name, n in nm.calls.items() if name[0].isupper())
+
+
+def main():
+    for name, object_manager in (("per object", False), ("snapshot", True)):
+        calls, bus_ms, cpu_ms = startup(object_manager)
+        print(
+            "{:<11} {} round trips, {:.1f} ms on the bus, {:.1f} ms CPU".format(
+                name + ":", calls, bus_ms, cpu_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
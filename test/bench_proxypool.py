@@ -0,0 +1,72 @@
+"""
+Proxy pool benchmark: the proxy lookups of a day of operation (AP table
+reads on each background scan, status reads of the devices, profile
+lookups on requests) replayed against a fake bus whose objects cost one
+Introspect round trip to create, with a proxy created on every lookup as
+before the pool, and with the pool (user-046).
+
+Run from the repository root: python3 test/bench_proxypool.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_proxypool import FakeBus
+
+from igconfd.proxypool import ProxyPool, PROXY_POOL_SIZE
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_CONNECTION_IFACE = "org.freedesktop.NetworkManager.Settings.Connection"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+AP_PATH = "/org/freedesktop/NetworkManager/AccessPoint/{}"
+DEVICE_PATH = "/org/freedesktop/NetworkManager/Devices/{}"
+CONNECTION_PATH = "/org/freedesktop/NetworkManager/Settings/{}"
+
+SCANS = 720  # a background scan every 2 minutes
+APS = 40  # APs in range, a few of them changing on each scan
+DEVICES = 4
+PROFILES = 20
+INTROSPECT_MS = 3.0
+
+
+def lookups():
+    """The (bus name, path, interface) of each proxy lookup"""
+    for scan in range(SCANS):
+        for i in range(APS):
+            # One AP in 10 is replaced on each scan
+            ap = i + (scan // 10) * APS if i % 10 == scan % 10 else i
+            yield NM_IFACE, AP_PATH.format(ap), DBUS_PROP_IFACE
+        for i in range(DEVICES):
+            yield NM_IFACE, DEVICE_PATH.format(i), DBUS_PROP_IFACE
+        yield NM_IFACE, CONNECTION_PATH.format(scan % PROFILES), NM_CONNECTION_IFACE
+
+
+def run(size):
+    bus = FakeBus()
+    pool = ProxyPool(size, bus)
+    count = 0
+    for key in lookups():
+        pool.get(*key)
+        count += 1
+    return count, bus.introspections
+
+
+def main():
+    print(
+        "{:<10} {:>10} {:>16} {:>14}".format(
+            "pool", "lookups", "introspections", "time (s)"
+        )
+    )
+    for name, size in (("none", 0), ("LRU", PROXY_POOL_SIZE)):
+        count, introspections = run(size)
+        print(
+            "{:<10} {:>10} {:>16} {:>14.1f}".format(
+                name, count, introspections, introspections * INTROSPECT_MS / 1000
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Request decode benchmark: json.loads plus decoding of typical client
+messages, compared with the deep string conversion that was done on every
+request before requests were decoded once (user-029).
+
+Run from the repository root: python3 test/bench_request.py
+"""
+
+import json
+import timeit
+
+from igconfd.request import decode_request, RequestError
+
+ITERATIONS = 20000
+
+MESSAGES = {
+    "version": {"type": "version", "id": 1},
+    "getAccessPoints": {
+        "version": 2,
+        "type": "getAccessPoints",
+        "id": 2,
+        "data": {"minStrength": 30, "security": ["psk", "eap"], "limit": 10},
+    },
+    "updateAPS": {
+        "version": 2,
+        "type": "updateAPS",
+        "id": 3,
+        "data": [
+            {
+                "ssid": "network-{}".format(i),
+                "psk": "passphrase-{}".format(i),
+                "priority": i,
+            }
+            for i in range(8)
+        ],
+    },
+}
+
+
+def convert_dict_keys_values_to_string(data):
+    """The conversion formerly applied to every request payload"""
+    if isinstance(data, bytes):
+        return data.decode("utf-8")
+    if isinstance(data, dict):
+        return dict(map(convert_dict_keys_values_to_string, data.items()))
+    if isinstance(data, tuple):
+        return tuple(map(convert_dict_keys_values_to_string, data))
+    if isinstance(data, list):
+        return list(map(convert_dict_keys_values_to_string, data))
+    if isinstance(data, set):
+        return set(map(convert_dict_keys_values_to_string, data))
+    return data
+
+
+def decode_old(message):
+    obj = json.loads(message)
+    obj["type"], obj.get("version"), obj.get("id")
+    if "data" in obj:
+        convert_dict_keys_values_to_string(obj["data"])
+
+
+def decode_new(message):
+    try:
+        decode_request(json.loads(message))
+    except RequestError:
+        pass
+
+
+def main():
+    print("{:<16} {:>12} {:>12}".format("message", "before (us)", "after (us)"))
+    for name, obj in MESSAGES.items():
+        message = json.dumps(obj, separators=(",", ":"))
+        old = timeit.timeit(lambda: decode_old(message), number=ITERATIONS)
+        new = timeit.timeit(lambda: decode_new(message), number=ITERATIONS)
+        print(
+            "{:<16} {:>12.2f} {:>12.2f}".format(
+                name, old * 1e6 / ITERATIONS, new * 1e6 / ITERATIONS
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Mock NetworkManager for the unit tests and benchmarks: the proxies answer
+like dbus-python ones (synchronously, or through reply_handler and
+error_handler), with an optional latency simulated on a fake main loop,
+and count the calls made.
+"""
+
+import copy
+import heapq
+import itertools
+from collections import Counter
+from unittest import mock
+
+import dbus.exceptions
+
+from igconfd import netstat, nmsnapshot
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+DBUS_ERROR_UNKNOWN_METHOD = "org.freedesktop.DBus.Error.UnknownMethod"
+
+# Settings NetworkManager keeps as secrets, out of GetSettings
+SECRET_KEYS = {
+    "802-11-wireless-security": (
+        "psk",
+        "wep-key0",
+        "wep-key1",
+        "wep-key2",
+        "wep-key3",
+        "leap-password",
+    ),
+    "802-1x": ("password", "private-key-password", "phase2-private-key-password"),
+}
+
+
+class FakeError(dbus.exceptions.DBusException):
+    def __init__(self, name, message=""):
+        super().__init__(message)
+        self.name = name
+
+    def get_dbus_name(self):
+        return self.name
+
+
+class FakeLoop:
+    """Main loop with a simulated clock (ms)"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.queue = []
+        self.seq = itertools.count()
+
+    def call_later(self, delay_ms, fn, *args):
+        heapq.heappush(self.queue, (self.now + delay_ms, next(self.seq), fn, args))
+
+    def run(self):
+        while self.queue:
+            due, _, fn, args = heapq.heappop(self.queue)
+            # Blocking calls may have held the loop past the due time
+            self.now = max(self.now, due)
+            fn(*args)
+
+
+class FakeProxy:
+    """Proxy whose methods are dispatched to FakeNM handlers"""
+
+    def __init__(self, nm, path, iface):
+        self.nm = nm
+        self.path = str(path)
+        self.iface = iface
+
+    def __getattr__(self, name):
+        handler = getattr(self.nm, "do_" + name, None)
+        if handler is None:
+            raise AttributeError(name)
+
+        def method(*args, reply_handler=None, error_handler=None, timeout=None):
+            self.nm.calls[name] += 1
+            if reply_handler is None:
+                # A blocking call holds the main loop for the latency
+                self.nm.loop.now += self.nm.latency_ms
+                return handler(self.path, *args)
+
+            def complete():
+                try:
+                    ret = handler(self.path, *args)
+                except dbus.exceptions.DBusException as e:
+                    error_handler(e)
+                    return
+                if ret is None:
+                    reply_handler()
+                else:
+                    reply_handler(ret)
+
+            self.nm.loop.call_later(self.nm.latency_ms, complete)
+
+        return method
+
+    def connect_to_signal(self, *args, **kwargs):
+        pass
+
+
+class FakeBus:
+    def __init__(self, nm):
+        self.nm = nm
+
+    def get_object(self, bus_name, path, introspect=True):
+        self.nm.calls["get_object"] += 1
+        return path
+
+    def add_signal_receiver(self, *args, **kwargs):
+        return FakeMatch()
+
+
+class FakeMatch:
+    def remove(self):
+        pass
+
+
+class RunNow:
+    """Work scheduler running the steps of a task at once"""
+
+    def add(self, name, steps, done_cb=None):
+        for _ in steps:
+            pass
+
+
+class FakeNM:
+    """
+    Saved connections (path -> settings, secrets kept apart as NM does) and
+    objects (path -> {interface: properties}) of a mock NetworkManager.
+    'fail' holds (method, path) pairs whose calls fail.  Checkpoints and the
+    ObjectManager can be left out, as in older NetworkManager versions.
+    """
+
+    def __init__(self, latency_ms=0.0, checkpoints=True, object_manager=True):
+        self.loop = FakeLoop()
+        self.latency_ms = latency_ms
+        self.checkpoints = checkpoints
+        self.object_manager = object_manager
+        self.connections = {}
+        self.secrets = {}
+        self.objects = {}
+        self.calls = Counter()
+        self.fail = set()
+        self.activations = []  # (connection, AP) of each ActivateConnection
+        self.deactivations = []
+        self.next_id = itertools.count(1)
+        self.bus = FakeBus(self)
+
+    def get_interface(self, bus_name, path, iface, introspect=True):
+        self.calls["get_interface"] += 1
+        return FakeProxy(self, path, iface)
+
+    def proxy(self, path="/org/freedesktop/NetworkManager", iface=NM_IFACE):
+        return FakeProxy(self, path, iface)
+
+    def netstat_patchers(self):
+        """Patchers running NetStat (and its snapshot) against this mock"""
+        return [
+            mock.patch.multiple(nmsnapshot, get_interface=self.get_interface),
+            mock.patch.object(nmsnapshot, "snapshot_supported", True),
+            mock.patch.multiple(
+                netstat,
+                get_interface=self.get_interface,
+                scheduler=RunNow(),
+                dbus=mock.Mock(
+                    SystemBus=lambda: self.bus,
+                    Interface=self.proxy,
+                    DBusException=dbus.exceptions.DBusException,
+                    exceptions=dbus.exceptions,
+                ),
+            ),
+        ]
+
+    def add(self, settings, secrets=None):
+        path = "/org/freedesktop/NetworkManager/Settings/{}".format(next(self.next_id))
+        self.store(path, settings)
+        for name, values in (secrets or {}).items():
+            self.secrets[path].setdefault(name, {}).update(values)
+        return path
+
+    def store(self, path, settings):
+        """Save settings as NetworkManager does: secrets apart, id a string"""
+        settings = copy.deepcopy(settings)
+        conn = settings.get("connection", {})
+        if isinstance(conn.get("id"), bytes):
+            conn["id"] = conn["id"].decode()
+        secrets = {}
+        for name, keys in SECRET_KEYS.items():
+            for key in keys:
+                if key in settings.get(name, {}):
+                    secrets.setdefault(name, {})[key] = settings[name].pop(key)
+        self.connections[path] = settings
+        self.secrets[path] = secrets
+
+    def add_device(self, index, wifi=True, settings=None):
+        """
+        Add an activated Ethernet or Wi-Fi device with its active connection
+        (using a new saved connection of the given settings), IP configs and
+        AP.  Returns the path of the device.
+        """
+        nm = "/org/freedesktop/NetworkManager/"
+        conn_path = self.add(settings or {"connection": {"id": "conn"}})
+        path = nm + "Devices/{}".format(index)
+        active = nm + "ActiveConnection/{}".format(index)
+        ip4 = nm + "IP4Config/{}".format(index)
+        ip6 = nm + "IP6Config/{}".format(index)
+        self.objects[path] = {
+            NM_IFACE
+            + ".Device": {
+                "Interface": "{}{}".format("wlan" if wifi else "eth", index),
+                "DeviceType": 2 if wifi else 1,
+                "State": 100,
+                "HwAddress": "00:11:22:33:44:{:02x}".format(index),
+                "ActiveConnection": active,
+                "Ip4Config": ip4,
+                "Ip6Config": ip6,
+            }
+        }
+        self.objects[active] = {
+            NM_IFACE
+            + ".Connection.Active": {
+                "Id": "conn{}".format(index),
+                "State": 2,
+                "Connection": conn_path,
+            }
+        }
+        self.objects[ip4] = {
+            NM_IFACE
+            + ".IP4Config": {
+                "AddressData": [{"address": "10.0.0.{}".format(index), "prefix": 24}],
+                "Gateway": "10.0.0.254",
+                "Nameservers": [0x0100000A],
+            }
+        }
+        self.objects[ip6] = {
+            NM_IFACE
+            + ".IP6Config": {"AddressData": [], "Gateway": "", "Nameservers": []}
+        }
+        if wifi:
+            ap = nm + "AccessPoint/{}".format(index)
+            self.objects[path][NM_IFACE + ".Device.Wireless"] = {
+                "ActiveAccessPoint": ap
+            }
+            self.objects[ap] = {
+                NM_IFACE + ".AccessPoint": {"Ssid": list(b"net"), "Strength": 70}
+            }
+        return path
+
+    def check(self, method, path):
+        if (method, path) in self.fail:
+            raise FakeError("org.freedesktop.NetworkManager.Settings.Failed")
+
+    # Settings
+    def do_ListConnections(self, path):
+        return list(self.connections)
+
+    def do_AddConnection(self, path, settings):
+        conn_id = settings["connection"]["id"]
+        if isinstance(conn_id, bytes):
+            conn_id = conn_id.decode()
+        self.check("AddConnection", conn_id)
+        return self.add(settings)
+
+    # Settings.Connection
+    def do_GetSettings(self, path):
+        return self.connections[path]
+
+    def do_GetSecrets(self, path, setting):
+        return {setting: self.secrets[path].get(setting, {})}
+
+    def do_Update(self, path, settings):
+        self.check("Update", path)
+        self.store(path, settings)
+
+    def do_Delete(self, path):
+        self.check("Delete", path)
+        del self.connections[path]
+        del self.secrets[path]
+
+    # NetworkManager
+    def do_ActivateConnection(self, path, connection, device, specific_object):
+        self.check("ActivateConnection", str(connection))
+        self.activations.append((str(connection), str(specific_object)))
+        return "/org/freedesktop/NetworkManager/ActiveConnection/{}".format(
+            len(self.activations)
+        )
+
+    def do_DeactivateConnection(self, path, active_connection):
+        self.deactivations.append(str(active_connection))
+
+    def do_CheckpointCreate(self, path, devices, timeout, flags):
+        if not self.checkpoints:
+            raise FakeError(DBUS_ERROR_UNKNOWN_METHOD)
+        return "/org/freedesktop/NetworkManager/Checkpoint/1"
+
+    def do_CheckpointRollback(self, path, checkpoint):
+        return {}
+
+    def do_CheckpointDestroy(self, path, checkpoint):
+        return None
+
+    def do_GetDevices(self, path):
+        device_iface = NM_IFACE + ".Device"
+        return [p for p, ifaces in self.objects.items() if device_iface in ifaces]
+
+    def do_GetManagedObjects(self, path):
+        if not self.object_manager:
+            raise FakeError(DBUS_ERROR_UNKNOWN_METHOD)
+        self.check("GetManagedObjects", path)
+        return self.objects
+
+    # Properties
+    def do_GetAll(self, path, iface):
+        return self.objects[path][iface]
+
+    def do_Get(self, path, iface, prop):
+        return self.objects[path][iface][prop]
@@ -0,0 +1,183 @@
+"""
+Unit tests for the activation state machine, driven directly by the
+StateChanged signal handlers
+"""
+
+import unittest
+
+from igconfd.activation import (
+    Activation,
+    ACT_RESULT_FAILED,
+    ACT_RESULT_SUCCESS,
+    ACT_RESULT_TIMEOUT,
+    NM_ACTIVE_CONNECTION_STATE_ACTIVATED,
+    NM_ACTIVE_CONNECTION_STATE_DEACTIVATED,
+    NM_CONNECTIVITY_FULL,
+    NM_CONNECTIVITY_NONE,
+    NM_DEVICE_STATE_ACTIVATED,
+    NM_DEVICE_STATE_CONFIG,
+    NM_DEVICE_STATE_IP_CONFIG,
+    NM_DEVICE_STATE_NEED_AUTH,
+    NM_DEVICE_STATE_PREPARE,
+)
+
+DEVICE = "/org/freedesktop/NetworkManager/Devices/3"
+ACTIVE = "/org/freedesktop/NetworkManager/ActiveConnection/7"
+RETRY_ACTIVE = "/org/freedesktop/NetworkManager/ActiveConnection/8"
+
+
+class FakeMatch:
+    def __init__(self, bus):
+        self.bus = bus
+
+    def remove(self):
+        self.bus.matches.remove(self)
+
+
+class FakeBus:
+    def __init__(self):
+        self.matches = []
+
+    def add_signal_receiver(self, handler, **kwargs):
+        match = FakeMatch(self)
+        self.matches.append(match)
+        return match
+
+
+class FakeToken:
+    """The timers of a request token, fired by the test"""
+
+    def __init__(self):
+        self.timers = {}  # id -> (interval ms, callback)
+        self.next_id = 1
+
+    def timeout_add(self, interval_ms, cb, *args):
+        timer_id = self.next_id
+        self.next_id += 1
+        self.timers[timer_id] = (interval_ms, cb)
+        return timer_id
+
+    def source_remove(self, source_id):
+        del self.timers[source_id]
+
+    def fire(self, interval_ms):
+        """Fire the timers of an interval, dropping those not repeating"""
+        for timer_id, (ms, cb) in list(self.timers.items()):
+            if ms == interval_ms and not cb():
+                self.timers.pop(timer_id, None)
+
+
+class ActivationTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = FakeBus()
+        self.token = FakeToken()
+        self.progress = 0
+        self.results = []
+
+    def start(self, connectivity=NM_CONNECTIVITY_NONE, active=ACTIVE):
+        act = Activation(
+            self.bus,
+            "WiFi",
+            self.token,
+            connectivity,
+            self.progress_cb,
+            lambda result, reason: self.results.append((result, reason)),
+            heartbeat_ms=5000,
+            timeout_ms=120000,
+        )
+        act.watch_device(DEVICE)
+        if active is not None:
+            act.watch_active(active)
+        return act
+
+    def progress_cb(self):
+        self.progress += 1
+
+    def assert_cleaned_up(self):
+        self.assertEqual(self.bus.matches, [])
+        self.assertEqual(self.token.timers, {})
+
+    def test_fail_fast_reasons(self):
+        for reason in (7, 8, 53):
+            with self.subTest(reason=reason):
+                self.setUp()
+                act = self.start()
+                act.device_state_changed(NM_DEVICE_STATE_PREPARE, 30, 0, path=DEVICE)
+                act.device_state_changed(
+                    NM_DEVICE_STATE_NEED_AUTH,
+                    NM_DEVICE_STATE_CONFIG,
+                    reason,
+                    path=DEVICE,
+                )
+                self.assertEqual(self.results, [(ACT_RESULT_FAILED, reason)])
+                self.assertTrue(act.is_done())
+                self.assert_cleaned_up()
+
+    def test_other_reasons_keep_going(self):
+        act = self.start()
+        act.device_state_changed(NM_DEVICE_STATE_CONFIG, 40, 2, path=DEVICE)
+        self.assertEqual(self.results, [])
+        self.assertEqual(self.progress, 1)
+
+    def test_retried_active_connection_never_succeeds(self):
+        act = self.start(connectivity=NM_CONNECTIVITY_FULL)
+        act.active_state_changed(NM_ACTIVE_CONNECTION_STATE_DEACTIVATED, 1, path=ACTIVE)
+        self.assertEqual(self.results, [(ACT_RESULT_FAILED, None)])
+        act.active_state_changed(
+            NM_ACTIVE_CONNECTION_STATE_ACTIVATED, 0, path=RETRY_ACTIVE
+        )
+        self.assertEqual(self.results, [(ACT_RESULT_FAILED, None)])
+
+    def test_other_active_connection_ignored(self):
+        act = self.start(connectivity=NM_CONNECTIVITY_FULL)
+        act.active_state_changed(
+            NM_ACTIVE_CONNECTION_STATE_ACTIVATED, 0, path=RETRY_ACTIVE
+        )
+        self.assertEqual(self.results, [])
+        self.assertFalse(act.is_done())
+
+    def test_device_activated_waits_for_active_connection(self):
+        act = self.start(connectivity=NM_CONNECTIVITY_FULL)
+        act.device_state_changed(NM_DEVICE_STATE_ACTIVATED, 90, 0, path=DEVICE)
+        self.assertEqual(self.results, [])
+        act.active_state_changed(NM_ACTIVE_CONNECTION_STATE_ACTIVATED, 0, path=ACTIVE)
+        self.assertEqual(self.results, [(ACT_RESULT_SUCCESS, None)])
+
+    def test_activated_then_connectivity(self):
+        act = self.start()
+        act.device_state_changed(NM_DEVICE_STATE_IP_CONFIG, 50, 0, path=DEVICE)
+        act.active_state_changed(NM_ACTIVE_CONNECTION_STATE_ACTIVATED, 0, path=ACTIVE)
+        self.assertEqual(self.results, [])
+        act.connectivity_changed(NM_CONNECTIVITY_FULL)
+        self.assertEqual(self.results, [(ACT_RESULT_SUCCESS, None)])
+        self.assertEqual(act.timeline()["events"][-1][0], ACT_RESULT_SUCCESS)
+        self.assert_cleaned_up()
+
+    def test_connectivity_before_activation_is_not_success(self):
+        act = self.start()
+        act.connectivity_changed(NM_CONNECTIVITY_FULL)
+        self.assertEqual(self.results, [])
+        act.active_state_changed(NM_ACTIVE_CONNECTION_STATE_ACTIVATED, 0, path=ACTIVE)
+        self.assertEqual(self.results, [(ACT_RESULT_SUCCESS, None)])
+
+    def test_heartbeat_then_timeout(self):
+        act = self.start()
+        self.token.fire(5000)
+        self.token.fire(5000)
+        self.assertEqual(self.progress, 2)
+        self.token.fire(120000)
+        self.assertEqual(self.results, [(ACT_RESULT_TIMEOUT, None)])
+        self.assert_cleaned_up()
+        # Signals after the end are ignored
+        act.device_state_changed(NM_DEVICE_STATE_ACTIVATED, 90, 0, path=DEVICE)
+        self.assertEqual(len(self.results), 1)
+
+    def test_cancel_cleans_up(self):
+        act = self.start()
+        act.cancel()
+        self.assertEqual(self.results, [])
+        self.assert_cleaned_up()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+"""
+Unit tests for the transactional profile update, against a mock
+NetworkManager
+"""
+
+import unittest
+from unittest import mock
+
+from fakenm import FakeNM, FakeError
+
+from igconfd import bulkupdate, conncache
+from igconfd.conncache import ConnectionCache
+
+WIFI_DEVICE = "/org/freedesktop/NetworkManager/Devices/3"
+
+
+def wifi_settings(ssid, priority=0):
+    return {
+        "connection": {
+            "id": ssid,
+            "uuid": "uuid-" + ssid,
+            "type": "802-11-wireless",
+            "autoconnect-priority": priority,
+        },
+        "802-11-wireless": {"ssid": list(ssid.encode())},
+        "802-11-wireless-security": {"key-mgmt": "wpa-psk"},
+    }
+
+
+def psk(value):
+    return {"802-11-wireless-security": {"psk": value}}
+
+
+class BulkUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.nm = FakeNM()
+        patcher = mock.patch.multiple(conncache, get_interface=self.nm.get_interface)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.multiple(bulkupdate, get_interface=self.nm.get_interface)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.path_a = self.nm.add(wifi_settings("a"), psk("secret-a"))
+        self.path_b = self.nm.add(wifi_settings("b"), psk("secret-b"))
+        self.cache = ConnectionCache(self.nm.bus, self.nm.proxy())
+
+    def run_update(self, ops):
+        results = []
+        bulkupdate.BulkUpdate(
+            self.nm.bus,
+            self.nm.proxy(),
+            self.nm.proxy(),
+            self.cache,
+            [WIFI_DEVICE],
+            ops,
+            results.append,
+        ).start()
+        self.nm.loop.run()
+        self.assertEqual(len(results), 1)
+        return results[0]
+
+    def ops(self):
+        return [
+            {"op": bulkupdate.OP_ADD, "settings": wifi_settings("c")},
+            {
+                "op": bulkupdate.OP_UPDATE,
+                "path": self.path_a,
+                "settings": wifi_settings("a", 5),
+            },
+            {"op": bulkupdate.OP_DELETE, "path": self.path_b},
+        ]
+
+    def ids(self):
+        return sorted(s["connection"]["id"] for s in self.nm.connections.values())
+
+    def test_success(self):
+        ops = self.ops()
+        self.assertTrue(self.run_update(ops))
+        self.assertEqual(
+            [op["status"] for op in ops], [bulkupdate.OP_STATUS_SUCCESS] * 3
+        )
+        self.assertEqual(self.ids(), ["a", "c"])
+        self.assertEqual(self.nm.calls["CheckpointDestroy"], 1)
+        self.assertEqual(self.cache.find_path_by_id("c"), ops[0]["path"])
+        self.assertIsNone(self.cache.find_path_by_id("b"))
+
+    def test_failure_restores_profiles(self):
+        ops = self.ops()
+        self.nm.fail.add(("Update", self.path_a))
+        self.assertFalse(self.run_update(ops))
+        # All entries failed, the applied ones were rolled back
+        self.assertEqual(
+            [op["status"] for op in ops], [bulkupdate.OP_STATUS_FAILED] * 3
+        )
+        self.assertEqual(self.ids(), ["a", "b"])
+        self.assertEqual(self.nm.calls["CheckpointRollback"], 1)
+        # The deleted profile came back with its secrets
+        path_b = self.cache.find_path_by_id("b")
+        self.assertIsNotNone(path_b)
+        self.assertEqual(self.nm.secrets[path_b], psk("secret-b"))
+        self.assertIsNone(self.cache.find_path_by_id("c"))
+
+    def test_failed_update_restored(self):
+        ops = self.ops()
+        self.nm.fail.add(("Delete", self.path_b))
+        self.assertFalse(self.run_update(ops))
+        settings = self.nm.connections[self.path_a]
+        self.assertEqual(settings["connection"]["autoconnect-priority"], 0)
+        self.assertEqual(self.nm.secrets[self.path_a], psk("secret-a"))
+
+    def test_no_checkpoint_support(self):
+        self.nm.checkpoints = False
+        ops = self.ops()
+        self.nm.fail.add(("AddConnection", "c"))
+        self.assertFalse(self.run_update(ops))
+        self.assertEqual(self.ids(), ["a", "b"])
+        self.assertEqual(self.nm.calls["CheckpointRollback"], 0)
+
+    def test_checkpoint_failure(self):
+        ops = self.ops()
+        with mock.patch.object(
+            FakeNM,
+            "do_CheckpointCreate",
+            side_effect=FakeError("org.freedesktop.NetworkManager.Failed"),
+        ):
+            self.assertFalse(self.run_update(ops))
+        self.assertEqual(
+            [op["status"] for op in ops], [bulkupdate.OP_STATUS_FAILED] * 3
+        )
+        self.assertEqual(self.ids(), ["a", "b"])
+        self.assertEqual(self.nm.calls["Update"] + self.nm.calls["Delete"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+"""
+Unit tests for the multi-candidate connectAP, against a mock
+NetworkManager
+"""
+
+import copy
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from fakenm import FakeNM
+
+from igconfd import cancel, conncache, netmngr
+from igconfd.aptable import AccessPointTable, NM_802_11_AP_SEC_KEY_MGMT_PSK
+from igconfd.cancel import CancelToken
+from igconfd.conncache import ConnectionCache
+from igconfd.netmngr import NetManager
+from igconfd.reconnect import ReconnectHints
+
+WIFI_DEVICE = "/org/freedesktop/NetworkManager/Devices/3"
+NM_DEVICE_STATE_FAILED = 120
+NM_DEVICE_STATE_REASON_NO_SECRETS = 7
+NM_ACTIVE_CONNECTION_STATE_ACTIVATED = 2
+NM_CONNECTIVITY_FULL = 4
+
+
+class FakeGObject:
+    """Main loop sources, only the immediate ones being run"""
+
+    def __init__(self):
+        self.sources = {}
+        self.next_id = 1
+
+    def timeout_add(self, interval_ms, cb, *args):
+        source_id = self.next_id
+        self.next_id += 1
+        self.sources[source_id] = (interval_ms, cb, args)
+        return source_id
+
+    def source_remove(self, source_id):
+        self.sources.pop(source_id, None)
+
+    def run_idle(self):
+        while True:
+            ready = [i for i, s in self.sources.items() if s[0] == 0]
+            if not ready:
+                return
+            _, cb, args = self.sources.pop(ready[0])
+            cb(*args)
+
+
+def wifi_settings(ssid, priority, psk=None):
+    settings = {
+        "connection": {
+            "id": ssid,
+            "uuid": "uuid-" + ssid,
+            "type": "802-11-wireless",
+            "autoconnect-priority": priority,
+            "interface-name": "wlan0",
+        },
+        "802-11-wireless": {"ssid": list(ssid.encode()), "hidden": False},
+        "802-11-wireless-security": {"key-mgmt": "wpa-psk"},
+        "ipv6": {"method": "auto"},
+    }
+    secrets = {"802-11-wireless-security": {"psk": psk}} if psk else None
+    return settings, secrets
+
+
+def ap(ssid, strength, psk=True):
+    return {
+        "ssid": ssid,
+        "bssid": "00:11:22:33:44:{:02x}".format(strength),
+        "strength": strength,
+        "flags": 1 if psk else 0,
+        "wpa-flags": 0,
+        "rsn-flags": NM_802_11_AP_SEC_KEY_MGMT_PSK if psk else 0,
+    }
+
+
+class CandidatesTest(unittest.TestCase):
+    def setUp(self):
+        self.nm = FakeNM()
+        self.gobject = FakeGObject()
+        for module, attrs in (
+            (conncache, {"get_interface": self.nm.get_interface}),
+            (netmngr, {"get_interface": self.nm.get_interface}),
+            (cancel, {"gobject": self.gobject}),
+        ):
+            patcher = mock.patch.multiple(module, **attrs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.nm.objects[WIFI_DEVICE] = {
+            netmngr.NM_WIFI_DEVICE_IFACE: {
+                "HwAddress": "00:11:22:33:44:55",
+                "ActiveAccessPoint": "/",
+            }
+        }
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.responses = []
+
+    def start(self, aps):
+        net = NetManager.__new__(NetManager)
+        net.bus = self.nm.bus
+        net.nm = self.nm.proxy()
+        net.nm_settings = self.nm.proxy("/org/freedesktop/NetworkManager/Settings")
+        net.conn_cache = ConnectionCache(
+            self.nm.bus, net.nm_settings, net.connection_removed
+        )
+        net.wifi_dev_obj = SimpleNamespace(object_path=WIFI_DEVICE)
+        net.wifi_dev_props = self.nm.proxy(WIFI_DEVICE)
+        net.ap_table = AccessPointTable.__new__(AccessPointTable)
+        net.ap_table.aps = {
+            "/org/freedesktop/NetworkManager/AccessPoint/{}".format(i): a
+            for i, a in enumerate(aps)
+        }
+        net.scan_sched = SimpleNamespace(scanning=True)
+        net.scan_token = CancelToken()
+        net.reconnect_hints = ReconnectHints(os.path.join(self.dir.name, "hints"))
+        net.activation_hinted = False
+        net.activation = None
+        net.activation_history = []
+        net.activation_heartbeat_ms = 0
+        net.connectivity = NM_CONNECTIVITY_FULL
+        net.watched_token = None
+        net.new_conn_obj = None
+        net.candidates = []
+        net.candidate = None
+        net.ap_scanning = False
+        net.response_cb = lambda status, data=None: self.responses.append(
+            (status, data)
+        )
+        self.net = net
+        return net
+
+    def connect(self, configs):
+        self.net.req_connect_ap(configs, CancelToken())
+
+    def fail_activation(self):
+        self.net.activation.device_state_changed(
+            NM_DEVICE_STATE_FAILED,
+            60,
+            NM_DEVICE_STATE_REASON_NO_SECRETS,
+            path=WIFI_DEVICE,
+        )
+        self.gobject.run_idle()
+
+    def succeed_activation(self):
+        self.net.activation.active_state_changed(
+            NM_ACTIVE_CONNECTION_STATE_ACTIVATED,
+            0,
+            path=self.net.activation.active_path,
+        )
+
+    def statuses(self):
+        return [status for status, _ in self.responses]
+
+    def tried(self):
+        """SSIDs of the profiles activated, in order"""
+        return [
+            (
+                self.nm.connections[path]["connection"]["id"]
+                if path in self.nm.connections
+                else path
+            )
+            for path, _ in self.nm.activations
+        ]
+
+    def test_ranking(self):
+        net = self.start(
+            [ap("weak", 30), ap("strong", 80), ap("open-only", 90, psk=False)]
+        )
+        ranked = net.rank_candidates(
+            [
+                {"ssid": "hidden", "psk": "x"},
+                {"ssid": "weak", "psk": "x"},
+                {"ssid": "open-only", "psk": "x"},
+                {"ssid": "strong", "psk": "x"},
+                {"ssid": "hidden2", "psk": "x"},
+            ]
+        )
+        self.assertEqual(
+            [(index, hidden) for index, _, _, hidden in ranked],
+            [(3, False), (1, False), (0, True), (4, True)],
+        )
+
+    def test_nothing_usable(self):
+        self.start([ap("open-only", 90, psk=False)])
+        self.connect([{"ssid": "open-only", "psk": "x"}])
+        self.assertEqual(self.statuses(), [NetManager.ACTIVATION_BAD_CONFIG])
+        self.assertEqual(self.nm.activations, [])
+
+    def test_fallback_to_next_candidate(self):
+        settings, secrets = wifi_settings("home", 5, psk="home-secret")
+        home = self.nm.add(settings, secrets)
+        self.nm.add(*wifi_settings("other", 7, psk="other-secret"))
+        before = copy.deepcopy((self.nm.connections[home], self.nm.secrets[home]))
+        self.start([ap("home", 80), ap("guest", 40)])
+
+        self.connect(
+            [
+                {"ssid": "home", "psk": "wrong-secret"},
+                {"ssid": "guest", "psk": "guest-secret"},
+            ]
+        )
+        self.assertEqual(self.tried(), ["home"])
+        # The profile was changed for the attempt
+        self.assertEqual(
+            self.nm.secrets[home]["802-11-wireless-security"]["psk"], b"wrong-secret"
+        )
+
+        self.fail_activation()
+        # The failed profile is back as it was, byte for byte
+        self.assertEqual((self.nm.connections[home], self.nm.secrets[home]), before)
+        self.assertEqual(self.net.conn_cache.get_settings(home), before[0])
+        self.assertEqual(self.tried(), ["home", "guest"])
+
+        self.succeed_activation()
+        self.assertEqual(self.statuses()[-1], NetManager.ACTIVATION_SUCCESS)
+        self.assertEqual(self.responses[-1][1]["index"], 1)
+        self.assertEqual(self.responses[-1][1]["ssid"], "guest")
+        # Only the winner keeps the raised priority
+        priorities = {
+            s["connection"]["id"]: s["connection"]["autoconnect-priority"]
+            for s in self.nm.connections.values()
+        }
+        self.assertEqual(priorities, {"home": 5, "other": 7, "guest": 8})
+
+    def test_added_profile_deleted_on_failure(self):
+        self.start([])
+        self.connect(
+            [{"ssid": "first", "psk": "secret1"}, {"ssid": "second", "psk": "s2"}]
+        )
+        self.fail_activation()
+        self.assertEqual(
+            [s["connection"]["id"] for s in self.nm.connections.values()], ["second"]
+        )
+        self.assertIsNone(self.net.conn_cache.find_path_by_id("first"))
+        self.fail_activation()
+        self.assertEqual(self.nm.connections, {})
+        self.assertEqual(len(self.nm.activations), 2)
+        self.assertEqual(self.statuses()[-1], self.net.activation_failure_status(7))
+
+    def test_failed_activate_call_moves_on(self):
+        self.start([ap("a", 80), ap("b", 60)])
+        self.nm.fail.add(
+            ("ActivateConnection", "/org/freedesktop/NetworkManager/Settings/1")
+        )
+        self.connect([{"ssid": "a", "psk": "x"}, {"ssid": "b", "psk": "y"}])
+        self.assertIsNone(self.net.conn_cache.find_path_by_id("a"))
+        self.assertEqual(self.tried(), ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
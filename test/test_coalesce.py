@@ -0,0 +1,106 @@
+"""
+Unit tests for the bounded-latency coalescing of status reports, with a
+fake clock and timers
+"""
+
+import unittest
+
+from igconfd.coalesce import Coalescer
+
+
+class FakeTimers:
+    """Clock (s) and GLib-like timeouts run as the clock is advanced"""
+
+    def __init__(self):
+        self.now_ms = 0
+        self.timers = {}  # id -> (due ms, callback)
+        self.next_id = 1
+
+    def clock(self):
+        return self.now_ms / 1000.0
+
+    def timeout_add(self, delay_ms, callback):
+        timer_id = self.next_id
+        self.next_id += 1
+        self.timers[timer_id] = (self.now_ms + delay_ms, callback)
+        return timer_id
+
+    def source_remove(self, timer_id):
+        del self.timers[timer_id]
+
+    def advance(self, ms):
+        """Move the clock forward, firing the timers due meanwhile"""
+        end = self.now_ms + ms
+        while True:
+            due = [(t[0], i) for i, t in self.timers.items() if t[0] <= end]
+            if not due:
+                break
+            due_ms, timer_id = min(due)
+            self.now_ms = due_ms
+            _, callback = self.timers.pop(timer_id)
+            if callback():
+                self.timers[timer_id] = (self.now_ms, callback)
+        self.now_ms = end
+
+
+class CoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.timers = FakeTimers()
+        self.reports = []
+        self.coalescer = Coalescer(
+            lambda: self.reports.append(self.timers.now_ms),
+            clock=self.timers.clock,
+            timeout_add=self.timers.timeout_add,
+            source_remove=self.timers.source_remove,
+        )
+
+    def test_report_after_quiet_period(self):
+        for _ in range(5):
+            self.coalescer.changed()
+            self.timers.advance(500)
+        # Last change at 2000 ms
+        self.timers.advance(10000)
+        self.assertEqual(self.reports, [4000])
+
+    def test_max_latency_under_constant_changes(self):
+        for _ in range(40):
+            self.coalescer.changed()
+            self.timers.advance(1000)
+        self.assertEqual(self.reports, [15000, 30000])
+
+    def test_urgent_change_within_a_second(self):
+        self.coalescer.changed()
+        self.timers.advance(300)
+        self.coalescer.changed(urgent=True)
+        self.timers.advance(1000)
+        self.assertEqual(self.reports, [1300])
+
+    def test_urgent_change_cuts_the_quiet_period(self):
+        self.coalescer.changed()
+        self.timers.advance(1500)
+        self.coalescer.changed()
+        self.timers.advance(1900)
+        self.coalescer.changed(urgent=True)
+        self.timers.advance(100)
+        self.assertEqual(self.reports, [])
+        self.timers.advance(900)
+        self.assertEqual(self.reports, [4400])
+
+    def test_cancel_drops_pending_report(self):
+        self.coalescer.changed()
+        self.timers.advance(1000)
+        self.coalescer.cancel()
+        self.timers.advance(20000)
+        self.assertEqual(self.reports, [])
+        self.assertEqual(self.timers.timers, {})
+
+    def test_flush_reports_at_once(self):
+        self.coalescer.changed()
+        self.coalescer.flush()
+        self.coalescer.flush()
+        self.assertEqual(self.reports, [0])
+        self.assertEqual(self.timers.timers, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+"""
+Unit tests for the connectivity probe, with stubbed sockets and HTTP
+"""
+
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from igconfd import connprobe
+from igconfd.connprobe import ProbeError, race_connect, summarize, probe_url
+
+IPV4 = (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 80))
+IPV6 = (socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("2001:db8::1", 80, 0, 0))
+
+
+class FakeSocket:
+    def __init__(self, family):
+        self.family = family
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def stub_connect(delays, sockets):
+    """connect_socket() taking delays[family] s, or failing if None"""
+
+    def connect(addr_info, iface, timeout):
+        delay = delays[addr_info[0]]
+        if delay is None:
+            raise ConnectionRefusedError("refused")
+        time.sleep(delay)
+        s = FakeSocket(addr_info[0])
+        sockets.append(s)
+        return s
+
+    return connect
+
+
+class RaceConnectTest(unittest.TestCase):
+    def race(self, delays):
+        sockets = []
+        with mock.patch.object(
+            connprobe, "connect_socket", stub_connect(delays, sockets)
+        ):
+            s, family = race_connect([IPV4, IPV6], None, 1.0)
+            # Let the loser complete
+            time.sleep(0.1)
+        return s, family, sockets
+
+    def test_faster_family_wins(self):
+        s, family, sockets = self.race({socket.AF_INET: 0.05, socket.AF_INET6: 0})
+        self.assertEqual(family, socket.AF_INET6)
+        self.assertEqual(s.family, socket.AF_INET6)
+        loser = [x for x in sockets if x is not s]
+        self.assertEqual(len(loser), 1)
+        self.assertTrue(loser[0].closed.wait(1.0))
+        self.assertFalse(s.closed.is_set())
+
+    def test_failed_family_loses(self):
+        s, family, _ = self.race({socket.AF_INET: 0.02, socket.AF_INET6: None})
+        self.assertEqual(family, socket.AF_INET)
+
+    def test_all_failed(self):
+        with self.assertRaises(ProbeError) as cm:
+            self.race({socket.AF_INET: None, socket.AF_INET6: None})
+        self.assertEqual(cm.exception.phase, connprobe.PHASE_CONNECT)
+
+    def test_no_usable_address(self):
+        unix = (socket.AF_UNIX, socket.SOCK_STREAM, 0, "", "/tmp/x")
+        with self.assertRaises(ProbeError) as cm:
+            race_connect([unix], None, 1.0)
+        self.assertEqual(cm.exception.phase, connprobe.PHASE_DNS)
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def read(self):
+        if self.error is not None:
+            raise self.error
+        return b"ok"
+
+
+class FakeHTTPConnection:
+    response = None
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = None
+
+    def request(self, method, path, headers=None):
+        pass
+
+    def getresponse(self):
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+    def close(self):
+        pass
+
+
+class ProbeUrlTest(unittest.TestCase):
+    def probe(self, response):
+        FakeHTTPConnection.response = response
+        with mock.patch.object(
+            connprobe.socket, "getaddrinfo", return_value=[IPV4]
+        ), mock.patch.object(
+            connprobe, "race_connect", return_value=(FakeSocket(IPV4[0]), IPV4[0])
+        ), mock.patch.object(
+            connprobe.http.client, "HTTPConnection", FakeHTTPConnection
+        ):
+            return probe_url("http://example.com/")
+
+    def test_success(self):
+        result = self.probe(FakeResponse())
+        self.assertEqual(result["result"], 200)
+        self.assertEqual(result["len"], 2)
+        self.assertEqual(result["family"], "ipv4")
+        self.assertEqual(
+            set(result["phases"]),
+            {
+                connprobe.PHASE_DNS,
+                connprobe.PHASE_CONNECT,
+                connprobe.PHASE_TTFB,
+                connprobe.PHASE_TRANSFER,
+            },
+        )
+
+    def test_no_response_is_ttfb(self):
+        result = self.probe(ConnectionResetError("reset"))
+        self.assertEqual(result["error"], connprobe.PHASE_TTFB)
+
+    def test_reset_during_body_is_transfer(self):
+        result = self.probe(FakeResponse(ConnectionResetError("reset")))
+        self.assertEqual(result["error"], connprobe.PHASE_TRANSFER)
+        self.assertIn(connprobe.PHASE_TTFB, result["phases"])
+        self.assertNotIn(connprobe.PHASE_TRANSFER, result["phases"])
+
+
+class SummarizeTest(unittest.TestCase):
+    def test_best_interface(self):
+        results = [
+            {"interface": "eth0", "total": 100},
+            {"interface": "eth0", "total": 300},
+            {"interface": "wlan0", "total": 50},
+            {"interface": "wlan0", "total": 90, "error": "ttfb"},
+            {"interface": "wwan0", "total": 10000, "error": "dns"},
+        ]
+        summary, best = summarize(results)
+        self.assertEqual(best, "wlan0")
+        self.assertEqual(
+            summary,
+            {
+                "eth0": {"ok": 2, "failed": 0, "mean": 200},
+                "wlan0": {"ok": 1, "failed": 1, "mean": 50},
+                "wwan0": {"ok": 0, "failed": 1},
+            },
+        )
+
+    def test_no_interface_succeeded(self):
+        summary, best = summarize([{"interface": "eth0", "total": 5, "error": "dns"}])
+        self.assertIsNone(best)
+        self.assertEqual(summary, {"eth0": {"ok": 0, "failed": 1}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Unit tests for the per-device connection stats model, against a mock
+NetworkManager
+"""
+
+import json
+import unittest
+
+from fakenm import FakeNM
+
+from igconfd import netstat
+from igconfd.netstat import NetStat
+
+
+def wifi_settings(key_mgmt):
+    return {
+        "connection": {"id": "net"},
+        "802-11-wireless-security": {"key-mgmt": key_mgmt},
+    }
+
+
+class NetStatTest(unittest.TestCase):
+    def setUp(self):
+        self.nm = FakeNM()
+        self.reports = []
+        for patcher in self.nm.netstat_patchers():
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def start(self):
+        stat = NetStat(lambda stats: self.reports.append(json.loads(stats)))
+        stat.coalescer.flush()
+        return stat
+
+    def test_settings_update_refreshes_device(self):
+        dev = self.nm.add_device(0, settings=wifi_settings("wpa-psk"))
+        stat = self.start()
+        self.assertEqual(self.reports[-1]["wlan0"]["security"]["key-mgmt"], "wpa-psk")
+        conn_path = self.nm.objects[dev][netstat.NM_DEVICE_IFACE]["ActiveConnection"]
+        settings_path = self.nm.objects[conn_path][netstat.NM_CONNECTION_ACTIVE_IFACE][
+            "Connection"
+        ]
+        self.nm.connections[settings_path] = wifi_settings("sae")
+        stat.settings_updated(path=settings_path)
+        stat.coalescer.flush()
+        self.assertEqual(self.reports[-1]["wlan0"]["security"]["key-mgmt"], "sae")
+
+    def test_unrelated_settings_update_is_ignored(self):
+        self.nm.add_device(0, settings=wifi_settings("wpa-psk"))
+        other = self.nm.add(wifi_settings("sae"))
+        stat = self.start()
+        reads = self.nm.calls["GetSettings"]
+        stat.settings_updated(path=other)
+        self.assertEqual(self.nm.calls["GetSettings"], reads)
+
+    def test_device_removal_stops_settings_updates(self):
+        dev = self.nm.add_device(0, settings=wifi_settings("wpa-psk"))
+        stat = self.start()
+        stat.device_removed(dev)
+        self.assertEqual(stat.settings_objs, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Unit tests for the NetworkManager object snapshot and the per-object
+fallback, against a mock NetworkManager
+"""
+
+import json
+import unittest
+
+from fakenm import FakeNM
+
+from igconfd import nmsnapshot
+from igconfd.netstat import NetStat, NM_DEVICE_IFACE, NM_AP_IFACE
+
+DEVICE = "/org/freedesktop/NetworkManager/Devices/1"
+AP = "/org/freedesktop/NetworkManager/AccessPoint/1"
+
+
+class SnapshotTest(unittest.TestCase):
+    def start(self, nm):
+        for patcher in nm.netstat_patchers():
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def load(self):
+        """Load the stats of the devices, returning the report"""
+        reports = []
+        stat = NetStat(lambda stats: reports.append(json.loads(stats)))
+        stat.coalescer.flush()
+        return reports[-1]
+
+    def test_snapshot_of_canned_reply(self):
+        nm = FakeNM()
+        nm.add_device(1)
+        self.start(nm)
+        snapshot = nmsnapshot.take_snapshot()
+        self.assertEqual(nm.calls["GetManagedObjects"], 1)
+        self.assertEqual(snapshot.get(DEVICE, NM_DEVICE_IFACE)["Interface"], "wlan1")
+        self.assertEqual(snapshot.get(AP, NM_AP_IFACE)["Strength"], 70)
+        self.assertIsNone(snapshot.get(DEVICE, NM_AP_IFACE))
+        self.assertIsNone(snapshot.get("/org/freedesktop/NetworkManager/x", AP))
+
+    def test_unknown_method_disables_snapshot(self):
+        nm = FakeNM(object_manager=False)
+        self.start(nm)
+        self.assertIsNone(nmsnapshot.take_snapshot())
+        self.assertFalse(nmsnapshot.snapshot_supported)
+        self.assertIsNone(nmsnapshot.take_snapshot())
+        self.assertEqual(nm.calls["GetManagedObjects"], 1)
+
+    def test_other_errors_keep_snapshot(self):
+        nm = FakeNM()
+        self.start(nm)
+        nm.fail.add(("GetManagedObjects", nmsnapshot.NM_OM_OBJ))
+        self.assertIsNone(nmsnapshot.take_snapshot())
+        self.assertTrue(nmsnapshot.snapshot_supported)
+
+    def test_fallback_reads_each_object(self):
+        nm = FakeNM()
+        for i in range(3):
+            nm.add_device(i, wifi=i > 0)
+        self.start(nm)
+        from_snapshot = self.load()
+        snapshot_calls = nm.calls["GetAll"]
+
+        nm = FakeNM(object_manager=False)
+        for i in range(3):
+            nm.add_device(i, wifi=i > 0)
+        self.start(nm)
+        from_objects = self.load()
+
+        self.assertEqual(from_objects, from_snapshot)
+        self.assertEqual(sorted(from_objects), ["eth0", "wlan1", "wlan2"])
+        self.assertEqual(snapshot_calls, 0)
+        # Device, active connection, IP configs, and Wi-Fi device and AP
+        self.assertEqual(nm.calls["GetAll"], 3 * 4 + 2 * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Unit tests for the shared D-Bus interface proxies, against a fake bus
+"""
+
+import unittest
+from collections import Counter
+
+from igconfd.proxypool import ProxyPool
+
+NM_IFACE = "org.freedesktop.NetworkManager"
+NM_AP_IFACE = "org.freedesktop.NetworkManager.AccessPoint"
+DBUS_PROP_IFACE = "org.freedesktop.DBus.Properties"
+
+
+class FakeObject:
+    def __init__(self, bus_name, path):
+        self.bus_name = bus_name
+        self.object_path = path
+
+
+class FakeBus:
+    """
+    Counts the objects created (each one costs an Introspect call) and
+    keeps the signal receivers, to emit signals
+    """
+
+    def __init__(self):
+        self.objects = 0
+        self.introspections = 0
+        self.receivers = []
+
+    def get_object(self, bus_name, path, introspect=True):
+        self.objects += 1
+        if introspect:
+            self.introspections += 1
+        return FakeObject(bus_name, path)
+
+    def add_signal_receiver(self, handler, signal_name=None, **kwargs):
+        self.receivers.append((signal_name, kwargs, handler))
+
+    def emit(self, signal_name, *args, bus_name=None):
+        for name, kwargs, handler in self.receivers:
+            if name != signal_name:
+                continue
+            if "bus_name" in kwargs and kwargs["bus_name"] != bus_name:
+                continue
+            if "arg0" in kwargs and kwargs["arg0"] != args[0]:
+                continue
+            handler(*args)
+
+
+def ap_path(i):
+    return "/org/freedesktop/NetworkManager/AccessPoint/{}".format(i)
+
+
+class ProxyPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = FakeBus()
+        self.pool = ProxyPool(size=4, bus=self.bus)
+
+    def test_proxies_are_shared(self):
+        # Reading the properties of 4 APs on each of 10 scans
+        for _ in range(10):
+            for i in range(4):
+                self.pool.get(NM_IFACE, ap_path(i), DBUS_PROP_IFACE)
+        self.assertEqual(self.pool.created, 4)
+        self.assertEqual(self.pool.hits, 36)
+        self.assertEqual(self.bus.introspections, 4)
+
+    def test_interfaces_of_an_object_are_distinct(self):
+        props = self.pool.get(NM_IFACE, ap_path(0), DBUS_PROP_IFACE)
+        ap = self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE)
+        self.assertIsNot(props, ap)
+        self.assertIs(self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE), ap)
+
+    def test_least_recently_used_is_evicted(self):
+        proxies = [self.pool.get(NM_IFACE, ap_path(i), NM_AP_IFACE) for i in range(4)]
+        # Use the first one again, so that the second is the oldest
+        self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE)
+        self.pool.get(NM_IFACE, ap_path(4), NM_AP_IFACE)
+        self.assertEqual(self.pool.evicted, 1)
+        self.assertIs(self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE), proxies[0])
+        self.assertIsNot(self.pool.get(NM_IFACE, ap_path(1), NM_AP_IFACE), proxies[1])
+
+    def test_interfaces_removed(self):
+        ap = self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE)
+        props = self.pool.get(NM_IFACE, ap_path(0), DBUS_PROP_IFACE)
+        self.bus.emit("InterfacesRemoved", ap_path(0), [NM_AP_IFACE], bus_name=NM_IFACE)
+        self.assertIsNot(self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE), ap)
+        self.assertIs(self.pool.get(NM_IFACE, ap_path(0), DBUS_PROP_IFACE), props)
+
+    def test_owner_change_drops_the_name(self):
+        ap = self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE)
+        other = self.pool.get("org.ofono", "/ril_0", "org.ofono.Modem")
+        self.bus.emit("NameOwnerChanged", NM_IFACE, ":1.5", ":1.9")
+        self.assertIsNot(self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE), ap)
+        self.assertIs(self.pool.get("org.ofono", "/ril_0", "org.ofono.Modem"), other)
+
+    def test_name_acquired_keeps_proxies(self):
+        ap = self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE)
+        self.bus.emit("NameOwnerChanged", NM_IFACE, "", ":1.9")
+        self.assertIs(self.pool.get(NM_IFACE, ap_path(0), NM_AP_IFACE), ap)
+
+    def test_name_watched_once(self):
+        for i in range(3):
+            self.pool.get(NM_IFACE, ap_path(i), NM_AP_IFACE)
+        signals = Counter(name for name, _, _ in self.bus.receivers)
+        self.assertEqual(signals, {"InterfacesRemoved": 1, "NameOwnerChanged": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Unit tests for the reconnect hints and their use when activating a profile
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from igconfd.netmngr import NetManager
+from igconfd.reconnect import ReconnectHints
+
+
+class FakeApTable:
+    def __init__(self, aps):
+        self.aps = aps
+
+    def find_bssid(self, ssid, bssid):
+        for path, ap in self.aps.items():
+            if ap["ssid"] == ssid and ap["bssid"] == bssid:
+                return path
+        return None
+
+
+class FakeScanScheduler:
+    def __init__(self, scanning=False):
+        self.scanning = scanning
+        self.scans = []
+
+    def scan_now(self, ssid=""):
+        if not self.scanning:
+            self.scans.append(ssid)
+            self.scanning = True
+        return True
+
+
+class ReconnectHintsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.path = os.path.join(self.dir.name, "reconnect.json")
+
+    def write(self, data):
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+
+    def test_malformed_file_is_ignored(self):
+        self.write(["not", "a", "dict"])
+        self.assertEqual(ReconnectHints(self.path).hints, {})
+
+    def test_malformed_entries_are_dropped(self):
+        self.write({"a": {"bssid": "00:11"}, "b": "00:22", "c": {"bssid": 1}})
+        self.assertEqual(list(ReconnectHints(self.path).hints), ["a"])
+
+    def test_remove_persists(self):
+        hints = ReconnectHints(self.path)
+        hints.record("a", "00:11", 2412)
+        hints.remove("a")
+        self.assertIsNone(ReconnectHints(self.path).get("a"))
+
+    def test_stats(self):
+        hints = ReconnectHints(self.path)
+        hints.connected(True, 100)
+        hints.connected(True, 300)
+        stats = hints.get_stats()
+        self.assertEqual(stats["hinted"]["count"], 2)
+        self.assertEqual(stats["hinted"]["meanMs"], 200)
+        self.assertIsNone(stats["unhinted"]["meanMs"])
+
+
+class ReconnectApTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.hints = ReconnectHints(os.path.join(self.dir.name, "reconnect.json"))
+        self.hints.record("net", "00:11", 2412)
+        self.net = NetManager.__new__(NetManager)
+        self.net.reconnect_hints = self.hints
+        self.net.scan_sched = FakeScanScheduler()
+        self.net.conn_cache = SimpleNamespace(find_paths_by_ssid=lambda ssid: [])
+
+    def set_aps(self, hint_strength, best_strength):
+        self.net.ap_table = FakeApTable(
+            {
+                "/ap/1": {"ssid": "net", "bssid": "00:11", "strength": hint_strength},
+                "/ap/2": {"ssid": "net", "bssid": "00:22", "strength": best_strength},
+            }
+        )
+
+    def test_hint_within_margin_is_preferred(self):
+        self.set_aps(60, 70)
+        self.assertEqual(self.net.reconnect_ap("net", "/ap/2"), "/ap/1")
+        self.assertTrue(self.net.activation_hinted)
+
+    def test_much_weaker_hint_is_ignored(self):
+        self.set_aps(20, 80)
+        self.assertEqual(self.net.reconnect_ap("net", "/ap/2"), "/ap/2")
+        self.assertFalse(self.net.activation_hinted)
+
+    def test_directed_scan_is_hinted(self):
+        self.net.ap_table = FakeApTable({})
+        self.assertEqual(self.net.reconnect_ap("net", "/"), "/")
+        self.assertEqual(self.net.scan_sched.scans, ["net"])
+        self.assertTrue(self.net.activation_hinted)
+
+    def test_running_full_scan_is_not_hinted(self):
+        self.net.ap_table = FakeApTable({})
+        self.net.scan_sched.scanning = True
+        self.net.reconnect_ap("net", "/")
+        self.assertEqual(self.net.scan_sched.scans, [])
+        self.assertFalse(self.net.activation_hinted)
+
+    def test_hint_pruned_with_last_profile(self):
+        settings = {"802-11-wireless": {"ssid": list(b"net")}}
+        self.net.conn_cache = SimpleNamespace(find_paths_by_ssid=lambda ssid: ["/c/2"])
+        self.net.connection_removed("/c/1", settings)
+        self.assertIsNotNone(self.hints.get("net"))
+        self.net.conn_cache = SimpleNamespace(find_paths_by_ssid=lambda ssid: [])
+        self.net.connection_removed("/c/2", settings)
+        self.assertIsNone(self.hints.get("net"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+Unit tests for client request decoding
+"""
+
+import unittest
+
+from igconfd.request import decode_request, RequestError
+
+
+class DecodeRequestTest(unittest.TestCase):
+    def test_decode(self):
+        req = decode_request(
+            {"version": 2, "type": "getAPS", "id": 7, "data": {}, "deadline": 500}
+        )
+        self.assertEqual(req.type, "getAPS")
+        self.assertEqual(req.id, 7)
+        self.assertEqual(req.version, 2)
+        self.assertEqual(req.deadline, 500)
+        self.assertTrue(req.has_data())
+
+    def test_version_message_needs_no_version(self):
+        req = decode_request({"type": "version", "id": 1})
+        self.assertIsNone(req.version)
+
+    def test_invalid_deadline_ignored(self):
+        for deadline in (0, -5, True, "100"):
+            req = decode_request({"version": 2, "type": "getAPS", "deadline": deadline})
+            self.assertIsNone(req.deadline)
+
+    def test_missing_version(self):
+        with self.assertRaises(RequestError) as cm:
+            decode_request({"type": "getAPS", "id": 3})
+        self.assertEqual(cm.exception.field, "version")
+        self.assertEqual(cm.exception.request.id, 3)
+        self.assertEqual(cm.exception.request.type, "getAPS")
+
+    def test_missing_type(self):
+        with self.assertRaises(RequestError) as cm:
+            decode_request({"version": 2, "id": "a"})
+        self.assertEqual(cm.exception.field, "type")
+        self.assertEqual(cm.exception.request.id, "a")
+        self.assertIsNone(cm.exception.request.type)
+
+    def test_no_usable_id(self):
+        for msg_id in (None, True, [1]):
+            with self.assertRaises(RequestError) as cm:
+                decode_request({"type": "getAPS", "id": msg_id})
+            self.assertIsNone(cm.exception.request)
+
+    def test_not_an_object(self):
+        with self.assertRaises(RequestError) as cm:
+            decode_request([1, 2])
+        self.assertIsNone(cm.exception.request)
+
+
+if __name__ == "__main__":
+    unittest.main()
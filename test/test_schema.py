@@ -0,0 +1,47 @@
+"""
+Unit tests for request payload validation
+"""
+
+import json
+import unittest
+
+from igconfd import schema
+
+
+class NumberTest(unittest.TestCase):
+    def test_bounds(self):
+        check = schema.number(0, 10)
+        self.assertIsNone(check(0, "t"))
+        self.assertIsNone(check(10, "t"))
+        self.assertIsNone(check(2.5, "t"))
+        self.assertEqual(check(-1, "t"), "t")
+        self.assertEqual(check(10.5, "t"), "t")
+
+    def test_exclusive_lo(self):
+        check = schema.number(0, exclusive_lo=True)
+        self.assertEqual(check(0, "t"), "t")
+        self.assertIsNone(check(0.1, "t"))
+
+    def test_not_finite(self):
+        check = schema.number(0)
+        for value in json.loads("[NaN, Infinity, -Infinity]"):
+            self.assertEqual(check(value, "t"), "t")
+
+    def test_not_a_number(self):
+        check = schema.number()
+        for value in (True, "1", None):
+            self.assertEqual(check(value, "t"), "t")
+
+
+class ConnCheckTest(unittest.TestCase):
+    def test_timeout(self):
+        for timeout, valid in (("5", True), ("0", False), ("NaN", False)):
+            data = json.loads('{"url": "http://x", "timeout": ' + timeout + "}")
+            field = schema.validate_data(schema.MSG_ID_CONN_CHECK, data)
+            self.assertEqual(field is None, valid)
+            if not valid:
+                self.assertEqual(field, "data.timeout")
+
+
+if __name__ == "__main__":
+    unittest.main()
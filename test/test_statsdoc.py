@@ -0,0 +1,177 @@
+"""
+Unit tests for the versioned connection stats document and its JSON Patch
+deltas
+"""
+
+import copy
+import unittest
+
+from igconfd.statsdoc import StatsDocument, diff, merge, pointer_token
+
+
+def apply_patch(doc, patch):
+    """Apply an RFC 6902 patch (add, remove and replace only) to a copy"""
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        tokens = [
+            t.replace("~1", "/").replace("~0", "~") for t in op["path"].split("/")[1:]
+        ]
+        parent = doc
+        for token in tokens[:-1]:
+            parent = parent[token]
+        if op["op"] == "remove":
+            del parent[tokens[-1]]
+        else:
+            parent[tokens[-1]] = copy.deepcopy(op["value"])
+    return doc
+
+
+def device(state, addresses=()):
+    return {"device-state": state, "ipv4-address-data": list(addresses)}
+
+
+class DiffTest(unittest.TestCase):
+    def test_pointer_escaping(self):
+        self.assertEqual(pointer_token("a~b/c"), "a~0b~1c")
+        patch = diff({}, {"x/y": 1, "~": 2})
+        self.assertEqual(
+            patch,
+            [
+                {"op": "add", "path": "/x~1y", "value": 1},
+                {"op": "add", "path": "/~0", "value": 2},
+            ],
+        )
+        self.assertEqual(apply_patch({}, patch), {"x/y": 1, "~": 2})
+
+    def test_nested_objects(self):
+        old = {"wlan0": {"device-state": "Activated", "strength": 60}}
+        new = {"wlan0": {"device-state": "Activated", "strength": 70, "ssid": "a"}}
+        self.assertEqual(
+            diff(old, new),
+            [
+                {"op": "replace", "path": "/wlan0/strength", "value": 70},
+                {"op": "add", "path": "/wlan0/ssid", "value": "a"},
+            ],
+        )
+
+    def test_arrays_replaced_whole(self):
+        old = {"eth0": device("Activated", ["10.0.0.1/24"])}
+        new = {"eth0": device("Activated", ["10.0.0.1/24", "10.0.0.2/24"])}
+        self.assertEqual(
+            diff(old, new),
+            [
+                {
+                    "op": "replace",
+                    "path": "/eth0/ipv4-address-data",
+                    "value": ["10.0.0.1/24", "10.0.0.2/24"],
+                }
+            ],
+        )
+
+    def test_removed_device(self):
+        old = {"eth0": device("Activated"), "wlan0": device("Disconnected")}
+        new = {"eth0": device("Activated")}
+        self.assertEqual(diff(old, new), [{"op": "remove", "path": "/wlan0"}])
+
+    def test_unchanged(self):
+        doc = {"eth0": device("Activated", ["10.0.0.1/24"])}
+        self.assertEqual(diff(doc, copy.deepcopy(doc)), [])
+
+    def test_merge_copies(self):
+        target = {"eth0": {"a": 1}}
+        source = {"eth0": {"b": [1]}, "wwan0": {"c": 2}}
+        merge(target, source)
+        self.assertEqual(target, {"eth0": {"a": 1, "b": [1]}, "wwan0": {"c": 2}})
+        target["eth0"]["b"].append(2)
+        self.assertEqual(source["eth0"]["b"], [1])
+
+
+class StatsDocumentTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = StatsDocument(history_len=3)
+
+    def test_sources_merged(self):
+        self.doc.update("nm", {"eth0": device("Activated"), "wlan0": device("Failed")})
+        self.doc.update("lte", {"eth0": {"lte-fallback": True}, "wwan0": {"rssi": -70}})
+        self.assertEqual(
+            self.doc.doc,
+            {
+                "eth0": dict(device("Activated"), **{"lte-fallback": True}),
+                "wlan0": device("Failed"),
+                "wwan0": {"rssi": -70},
+            },
+        )
+        # Replacing the NM part keeps the LTE members of eth0
+        self.doc.update("nm", {"eth0": device("Disconnected")})
+        self.assertEqual(
+            self.doc.doc,
+            {
+                "eth0": dict(device("Disconnected"), **{"lte-fallback": True}),
+                "wwan0": {"rssi": -70},
+            },
+        )
+
+    def test_unchanged_update_keeps_version(self):
+        self.assertIsNotNone(self.doc.update("nm", {"eth0": device("Activated")}))
+        self.assertIsNone(self.doc.update("nm", {"eth0": device("Activated")}))
+        self.assertEqual(self.doc.version, 1)
+
+    def test_patch_chain_reproduces_document(self):
+        self.doc.update("nm", {"eth0": device("Activated")})
+        consumer = copy.deepcopy(self.doc.doc)
+        version = self.doc.version
+        signalled = copy.deepcopy(consumer)
+        for state in ("Deactivating", "Disconnected"):
+            signalled = apply_patch(
+                signalled, self.doc.update("nm", {"eth0": device(state)})
+            )
+        self.doc.update("nm", {"eth0": device("Activated"), "wlan0": device("x")})
+        reply = self.doc.get_since(self.doc.epoch, version)
+        self.assertEqual(reply["version"], 4)
+        self.assertNotIn("full", reply)
+        self.assertEqual(apply_patch(consumer, reply["patch"]), self.doc.doc)
+        self.assertEqual(signalled["eth0"], device("Disconnected"))
+
+    def test_current_version(self):
+        self.doc.update("nm", {"eth0": device("Activated")})
+        reply = self.doc.get_since(self.doc.epoch, 1)
+        self.assertEqual(reply, {"epoch": self.doc.epoch, "version": 1, "patch": []})
+
+    def test_full_once_history_runs_out(self):
+        for i in range(5):
+            self.doc.update("nm", {"eth0": device(str(i))})
+        # Versions 3 to 5 are kept, so the patch from 2 can be built...
+        self.assertIn("patch", self.doc.get_since(self.doc.epoch, 2))
+        # ...but not from 1
+        reply = self.doc.get_since(self.doc.epoch, 1)
+        self.assertTrue(reply["full"])
+        self.assertEqual(reply["stats"], self.doc.doc)
+
+    def test_full_for_future_version(self):
+        self.doc.update("nm", {"eth0": device("Activated")})
+        reply = self.doc.get_since(self.doc.epoch, 7)
+        self.assertTrue(reply["full"])
+        self.assertEqual(reply["version"], 1)
+
+    def test_full_for_other_epoch(self):
+        # A consumer at version 2 of the document of an earlier process
+        old = StatsDocument()
+        old.update("nm", {"eth0": device("Activated")})
+        old.update("nm", {"eth0": device("Disconnected")})
+        self.doc.update("nm", {"wlan0": device("Activated")})
+        self.doc.update("nm", {"wlan0": device("Failed")})
+        self.assertNotEqual(old.epoch, self.doc.epoch)
+        reply = self.doc.get_since(old.epoch, 2)
+        self.assertTrue(reply["full"])
+        self.assertEqual(reply["epoch"], self.doc.epoch)
+        self.assertEqual(reply["stats"], {"wlan0": device("Failed")})
+
+    def test_full_for_empty_epoch(self):
+        reply = self.doc.get_since("", 0)
+        self.assertEqual(
+            reply, {"epoch": self.doc.epoch, "version": 0, "full": True, "stats": {}}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()